@@ -1,13 +1,15 @@
 import streamlit as st
+# Time the app's imports and startup stages when STARTUP_PROFILE is set
+from startup import profile_imports, stage, log_startup_report
+profile_imports()
 import os
 from dotenv import load_dotenv
-import re
-import sys
+import threading
 import time
-import json
 
 # Load environment variables
-load_dotenv('secrets.env')
+with stage("load secrets.env"):
+    load_dotenv('secrets.env')
 
 # Suppress logging warnings
 os.environ["GRPC_VERBOSITY"] = "ERROR"
@@ -17,11 +19,286 @@ os.environ["GLOG_minloglevel"] = "2"
 DEBUG = False
 
 # Import LLM module
-from llm_inference import (
-    run_gemini_flash, 
-    run_deepseek_r1_together, 
-    run_ollama_gpt_oss
+from llm_inference import warm_clients, warm_ollama
+from jobs import JobQueue, FAILED, CANCELLED
+from providers import PROVIDERS, get_provider, provider_keys, provider_label
+from router import stream_fastest, stream_auto, ROUTING_OBJECTIVE
+from metrics import record_call, record_speculation, start_metrics_server
+from paragraphs import stream_paragraphs, join_paragraphs
+from prompt_builder import (
+    construct_prompt_parts,
+    construct_paragraph_prompts,
+    construct_adapt_prompt_parts,
+    select_feedback_examples
 )
+from response_cache import ResponseCache, make_cache_key
+from speculation import Speculator, budget as speculation_budget, estimate_tokens, SPECULATE_TOKEN_BUDGET
+from rubric import load_marking_criteria, load_rubric_index, build_selected_criteria
+
+# Rubric file and optional pre-parsed snapshot of it
+MARKING_CRITERIA_FILE = os.environ.get("MARKING_CRITERIA_FILE", "marking_criteria.md")
+MARKING_CRITERIA_SNAPSHOT = os.environ.get("MARKING_CRITERIA_SNAPSHOT")
+
+# LLM label in the sidebar -> provider key used by the registry and the cache
+LLM_PROVIDER_KEYS = {provider_label(key): key for key in provider_keys()}
+# Sidebar option that races providers instead of pinning one
+FASTEST_AVAILABLE = "Fastest available"
+FASTEST_KEY = "fastest"
+# Sidebar option that picks a provider from its observed latency, errors and cost
+AUTO_ROUTING = "Auto (adaptive routing)"
+AUTO_KEY = "auto"
+# Options that may use any provider, with their job queue keys
+MULTI_PROVIDER_KEYS = {FASTEST_AVAILABLE: FASTEST_KEY, AUTO_ROUTING: AUTO_KEY}
+
+# One response cache per server process, shared by all sessions
+@st.cache_resource
+def get_response_cache():
+    return ResponseCache()
+
+# Previously generated feedback with a similarity index, shared by all sessions.
+# The NumPy-based modules are imported on first use (or by the startup warm-up)
+# rather than before the first page is shown.
+@st.cache_resource
+def get_feedback_index():
+    from feedback_index import FeedbackIndex
+    return FeedbackIndex()
+
+# Vector describing the current selections, for the feedback similarity index
+def current_request_vector():
+    from feedback_index import request_vector
+    return request_vector(
+        st.session_state.selected_criteria,
+        st.session_state.get("failing_feedback", ""),
+        st.session_state.get("learner_feedback", "")
+    )
+
+# The feedback example bank (indexed once, rebuilt only when a file changes)
+def get_example_bank():
+    from example_index import load_example_bank
+    return load_example_bank()
+
+# Prometheus exporter for LLM call metrics, if LLM_METRICS_PORT is set
+@st.cache_resource
+def start_metrics_exporter():
+    port = os.environ.get("LLM_METRICS_PORT")
+    return start_metrics_server(int(port)) if port else None
+
+# In the background at startup, load and index the feedback examples and, unless
+# LLM_WARMUP=0, import the provider SDKs and create their clients, then load the
+# local Ollama model unless OLLAMA_PRELOAD=0, so the first generation does not wait
+# for any of them. The first page is shown meanwhile.
+@st.cache_resource
+def start_warmup():
+    warm_sdks = os.environ.get("LLM_WARMUP", "1") == "1"
+    preload_ollama = os.environ.get("OLLAMA_PRELOAD", "1") == "1"
+    def warm_up():
+        # Also imports NumPy for the example and feedback indexes
+        get_example_bank()
+        if warm_sdks:
+            warm_clients()
+        if preload_ollama:
+            warm_ollama()
+    thread = threading.Thread(target=warm_up, name="llm-warmup", daemon=True)
+    thread.start()
+    return thread
+
+# One job queue per server process, shared by all sessions. Each provider's
+# jobs are bounded like its requests; "Fastest available" and "Auto" jobs get
+# the default bound.
+@st.cache_resource
+def get_job_queue():
+    return JobQueue(limits={key: provider["max_in_flight"] for key, provider in PROVIDERS.items()})
+
+# Work for a generation job: yields (paragraph index, chunk) events. `prompts`
+# is a list of (name, prefix, suffix), one per paragraph when they run in parallel.
+def generation_work(selected_llm, providers, prompts):
+    def work(job):
+        if selected_llm == FASTEST_AVAILABLE:
+            def make_stream(prefix, suffix):
+                return stream_fastest(suffix, prefix=prefix, order=providers, on_provider=job.providers.append)
+        elif selected_llm == AUTO_ROUTING:
+            def make_stream(prefix, suffix):
+                return stream_auto(suffix, prefix=prefix, order=providers, on_provider=job.providers.append)
+        else:
+            job.providers.append(providers[0])
+            stream_fn = get_provider(providers[0])["stream"]
+            def make_stream(prefix, suffix):
+                return stream_fn(suffix, prefix=prefix)
+        if len(prompts) > 1:
+            yield from stream_paragraphs(make_stream, prompts)
+            return
+        _, prefix, suffix = prompts[0]
+        stream = make_stream(prefix, suffix)
+        try:
+            for chunk in stream:
+                yield 0, chunk
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+    return work
+
+def job_feedback(job):
+    return job.texts[0] if len(job.texts) == 1 else join_paragraphs(job.texts)
+
+# Store a finished job's feedback in the response cache and, with the request's
+# vector, in the feedback similarity index (runs on the job's worker)
+def store_job_result(response_cache, cache_keys, feedback_index, vector):
+    def on_done(job):
+        feedback = job_feedback(job)
+        answered = list(dict.fromkeys(job.providers))
+        if not feedback or not answered:
+            return
+        models = [get_provider(provider)["model"] for provider in answered]
+        # Cached under the provider that answered; paragraphs from several
+        # providers are not one provider's answer, so they are not cached
+        if len(answered) == 1 and answered[0] in cache_keys:
+            response_cache.put(cache_keys[answered[0]], feedback, provider=answered[0], model=models[0])
+        feedback_index.add(vector, feedback, provider=",".join(answered), model=",".join(models))
+    return on_done
+
+# Show a job's output so far, then follow it live until it finishes. Used after
+# clicking Generate and to reattach after a rerun or a browser refresh.
+def render_job(job):
+    texts, position = job.snapshot()
+    placeholders = [st.empty() for _ in texts]
+    for placeholder, text in zip(placeholders, texts):
+        if text:
+            placeholder.markdown(text)
+    if job.active:
+        label = next((label for label, key in MULTI_PROVIDER_KEYS.items() if key == job.provider), provider_label(job.provider))
+        with st.spinner(f"Generating feedback using {label}..."):
+            for index, chunk in job.follow(position):
+                texts[index] += chunk
+                placeholders[index].markdown(texts[index])
+    if job.status == FAILED:
+        st.error(str(job.error))
+        return
+    if job.status == CANCELLED:
+        st.warning("Generation was cancelled.")
+        return
+    feedback = job_feedback(job)
+    end_time = job.finished or time.time()
+    first_token = job.first_chunk or end_time
+    provider_labels = ", ".join(provider_label(key) for key in dict.fromkeys(job.providers))
+    st.caption(
+        f"Generated in {end_time - job.created:.2f} seconds "
+        f"(first token after {first_token - job.created:.2f} seconds) by {provider_labels}"
+    )
+    st.download_button(
+        label="Download Feedback",
+        data=feedback,
+        file_name="course_project_feedback.md",
+        mime="text/markdown"
+    )
+
+# Show feedback for a very similar earlier request as a draft, with buttons to
+# adapt it with the LLM (a shorter prompt) or to generate new feedback anyway
+def render_reuse_offer(similarity, record):
+    st.info(f"Feedback for a very similar selection was generated before (similarity {similarity:.0%}). It is shown below as a draft.")
+    st.markdown(record["feedback"])
+    label = ", ".join(provider_label(key) for key in (record.get("provider") or "").split(","))
+    st.caption(f"Draft written by {label} on {time.strftime('%Y-%m-%d %H:%M', time.localtime(record['ts']))}")
+    columns = st.columns(3)
+    columns[0].download_button(
+        label="Download Draft",
+        data=record["feedback"],
+        file_name="course_project_feedback.md",
+        mime="text/markdown"
+    )
+    columns[1].button("Adapt this draft", on_click=st.session_state.__setitem__, args=("reuse_choice", "adapt"))
+    columns[2].button("Generate new feedback", on_click=st.session_state.__setitem__, args=("reuse_choice", "fresh"))
+
+# Prompts, providers, cache keys and the prompt budget report for the current
+# selections. `prompts` is a list of (name, prefix, suffix), one per paragraph
+# when they run in parallel. With a `draft`, the prompt asks to adapt it instead
+# and there is no budget report.
+def build_generation_request(selected_llm, parallel_paragraphs, draft=None):
+    # The prompt payload is only derived from the selections when needed
+    selected_criteria = build_selected_criteria(
+        load_rubric_index(MARKING_CRITERIA_FILE, MARKING_CRITERIA_SNAPSHOT),
+        st.session_state.selected_criteria
+    )
+    failing_feedback = st.session_state.get("failing_feedback", "")
+    learner_feedback = st.session_state.get("learner_feedback", "")
+    providers = provider_keys() if selected_llm in MULTI_PROVIDER_KEYS else [LLM_PROVIDER_KEYS[selected_llm]]
+    budget_report = None
+    if draft is not None:
+        prompts = [("adapt",) + construct_adapt_prompt_parts(draft, selected_criteria, failing_feedback, learner_feedback)]
+    else:
+        # Examples are chosen to fit the input token budget of the provider (an
+        # estimate when several may answer)
+        feedback_examples, budget_report = select_feedback_examples(
+            selected_criteria, failing_feedback, learner_feedback, get_example_bank(),
+            providers[0] if len(providers) == 1 else None
+        )
+        # The stable prefix (instructions + examples) is passed separately so
+        # providers can cache it; the response cache keys on the full prompt.
+        # A subset of the bank differs between requests, so it goes in the suffix.
+        per_request_examples = budget_report["examples"] < budget_report["available"]
+        prompt_args = (selected_criteria, failing_feedback, learner_feedback, feedback_examples, per_request_examples)
+        if parallel_paragraphs:
+            prompts = construct_paragraph_prompts(*prompt_args)
+        else:
+            prompts = [("feedback",) + construct_prompt_parts(*prompt_args)]
+    prompt = "".join(prefix + suffix for _, prefix, suffix in prompts)
+    # Cache keys for the chosen provider, or for every provider that may answer
+    cache_keys = {
+        p: make_cache_key(p, get_provider(p)["model"], get_provider(p)["params"], prompt)
+        for p in providers
+    }
+    return prompts, prompt, providers, cache_keys, budget_report
+
+# Start (or join) the generation job for a request
+def submit_generation(selected_llm, prompts, providers, cache_keys, speculative=False):
+    vector = current_request_vector()
+    return get_job_queue().submit(
+        "|".join(cache_keys[p] for p in providers),
+        MULTI_PROVIDER_KEYS.get(selected_llm, providers[0]),
+        generation_work(selected_llm, providers, prompts),
+        parts=len(prompts),
+        on_done=store_job_result(get_response_cache(), cache_keys, get_feedback_index(), vector),
+        speculative=speculative
+    )
+
+# Pre-generate once the selections have been unchanged for the debounce interval,
+# so that Generate finds the job, or its cached result, for the same prompt.
+# Reruns on its own every second to notice when the marker has stopped editing.
+@st.fragment(run_every=1)
+def speculate(selected_llm, parallel_paragraphs):
+    speculator = st.session_state.setdefault("speculator", Speculator())
+    if not st.session_state.get("selected_criteria"):
+        speculator.reset()
+        return
+    # Building the request every second is wasted work while nothing changes, so
+    # it is rebuilt only when its inputs differ from the last tick's. The rubric
+    # index and example bank are cached objects, replaced when their files change.
+    inputs = (
+        selected_llm,
+        parallel_paragraphs,
+        hash(tuple(sorted(st.session_state.selected_criteria.items()))),
+        hash(st.session_state.get("failing_feedback", "")),
+        hash(st.session_state.get("learner_feedback", "")),
+        load_rubric_index(MARKING_CRITERIA_FILE, MARKING_CRITERIA_SNAPSHOT),
+        get_example_bank()
+    )
+    request = st.session_state.get("speculation_request")
+    if request is None or request[0] != inputs:
+        request = st.session_state.speculation_request = (
+            inputs, build_generation_request(selected_llm, parallel_paragraphs)
+        )
+    prompts, prompt, providers, cache_keys, _ = request[1]
+    if speculator.watch("|".join(cache_keys[p] for p in providers)):
+        if any(get_response_cache().contains(key) for key in cache_keys.values()):
+            speculator.settle()
+        elif not speculation_budget.try_spend(estimate_tokens(len(prompt), len(prompts))):
+            record_speculation("over_budget")
+            speculator.settle()
+        else:
+            job = submit_generation(selected_llm, prompts, providers, cache_keys, speculative=True)
+            speculator.started(job, len(prompt))
+    if speculator.job is not None:
+        st.caption(f"Pre-generation {speculator.job.status}")
 
 # Debug helper function
 def debug_log(message, data=None):
@@ -36,159 +313,67 @@ def debug_log(message, data=None):
                 else:
                     st.write(data)
 
-# Parse marking criteria from the markdown file
-def parse_marking_criteria(file_path="marking_criteria.md"):
-    criteria = []
-    
-    try:
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
-        
-        current_section = None
-        current_part = None
-        current_id = None
-        current_title = None
-        pass_criteria = []
-        fail_criteria = []
+# Widget callbacks keeping st.session_state.selected_criteria in sync
+def toggle_criterion(criteria_id):
+    if st.session_state[f"check_{criteria_id}"]:
+        st.session_state.selected_criteria[criteria_id] = st.session_state.get(f"comment_{criteria_id}", "")
+    else:
+        st.session_state.selected_criteria.pop(criteria_id, None)
+
+def update_comment(criteria_id):
+    if criteria_id in st.session_state.selected_criteria:
+        st.session_state.selected_criteria[criteria_id] = st.session_state[f"comment_{criteria_id}"]
+
+# Checkboxes and comment fields for one rubric part. Running as a fragment
+# means ticking a box reruns only this part instead of the whole page.
+@st.fragment
+def render_rubric_part(item):
+    with st.container():
+        # Show item ID and title
+        st.markdown(f"**{item['id']}:** {item['description']}")
         
-        for line in lines:
-            # Strip any trailing whitespace
-            line = line.rstrip()
-            
-            # Check for section header
-            section_match = re.match(r'### \*\*Part (\d+)\*\*', line)
-            if section_match:
-                current_section = f"Part {section_match.group(1)}"
-                continue
-            
-            # Check for part header
-            part_match = re.match(r'#### \*\*Part (\d+)\.(\d+):\*\* (.*)', line)
-            if part_match:
-                # If we were processing a previous part, add it to the criteria list
-                if current_part is not None:
-                    criteria.append({
-                        "id": current_id,
-                        "section": current_section,
-                        "title": current_title,
-                        "pass_criteria": pass_criteria,
-                        "fail_criteria": fail_criteria,
-                        "description": current_title
-                    })
-                
-                # Start a new part
-                section_num = part_match.group(1)
-                part_num = part_match.group(2)
-                current_part = f"{section_num}.{part_num}"
-                current_id = f"Part {current_part}"
-                current_title = part_match.group(3).strip()
-                # Update current section just in case it wasn't set properly
-                current_section = f"Part {section_num}"
-                pass_criteria = []
-                fail_criteria = []
-                continue
-            
-            # Check for pass criteria
-            pass_match = re.match(r'- \[\s?\]\s*\*\*Pass\*\*:\s*(.*)', line)
-            if pass_match and current_part is not None:
-                pass_criteria.append(pass_match.group(1).strip())
-                continue
-            
-            # Check for fail criteria
-            fail_match = re.match(r'- \[\s?\]\s*\*\*Fail\*\*:\s*(.*)', line)
-            if fail_match and current_part is not None:
-                fail_criteria.append(fail_match.group(1).strip())
+        for kind, heading, icon in (("pass", "Pass Criteria", "✅"), ("fail", "Fail Criteria", "❌")):
+            if not item.get(f"{kind}_criteria", []):
                 continue
-        
-        # Add the last part if there is one
-        if current_part is not None:
-            criteria.append({
-                "id": current_id,
-                "section": current_section,
-                "title": current_title,
-                "pass_criteria": pass_criteria,
-                "fail_criteria": fail_criteria,
-                "description": current_title
-            })
-        
-        return criteria
-        
-    except Exception as e:
-        if DEBUG:
-            print(f"Error parsing marking criteria: {str(e)}")
-        return []
-
-# Load feedback examples for prompt construction
-def load_feedback_examples(file_path="feedback_examples.md"):
-    with open(file_path, 'r') as file:
-        return file.read()
-
-# Construct the prompt for the LLM
-def construct_prompt(selected_criteria, failing_feedback, learner_feedback, feedback_examples):
-    prompt = (
-        "You are an expert course project marker. Generate professional, concise feedback for a course project, following these best practices:\n\n"
-        + feedback_examples + "\n\n"
-    )
-    
-    # General feedback section
-    prompt += (
-        "---\n"
-        "Paragraph 1: General Feedback (Strengths and Areas for Improvement)\n"
-        "Summarize the strengths and areas for improvement based on the selected marking criteria and comments below. Combine strengths and improvements in a single paragraph. Do not include any final thoughts or use lists.\n"
+            st.markdown(f"**{heading}:**")
+            for i, criteria in enumerate(item[f"{kind}_criteria"]):
+                criteria_id = f"{item['id']}_{kind}_{i}"
+                # The criterion text is the checkbox label, which renders the
+                # same as a separate markdown column with far fewer elements
+                checked = st.checkbox(
+                    f"{icon} {criteria}",
+                    key=f"check_{criteria_id}",
+                    on_change=toggle_criterion,
+                    args=(criteria_id,)
+                )
+                if checked:
+                    st.text_area(
+                        f"Comment for '{criteria[:40]}...'", 
+                        placeholder="Add your feedback comments here...",
+                        height=68,
+                        key=f"comment_{criteria_id}",
+                        on_change=update_comment,
+                        args=(criteria_id,)
+                    )
+        st.markdown("---")
+
+# Free-text feedback fields, read from session state when generating
+@st.fragment
+def render_additional_feedback():
+    st.header("Additional Feedback")
+    st.text_area(
+        "Failing Criteria Feedback (if applicable)",
+        height=150,
+        key="failing_feedback",
+        help="Provide specific feedback for criteria that were not met."
     )
-    if selected_criteria:
-        prompt += "Checked Marking Criteria and Comments:\n"
-        for part_item in selected_criteria:
-            part_id = part_item["id"]
-            part_title = part_item["title"]
-            prompt += f"- {part_id}: {part_title}\n"
-            if "selected_criteria" in part_item and part_item["selected_criteria"]:
-                for criteria_item in part_item["selected_criteria"]:
-                    criteria_type = criteria_item["type"]
-                    criteria_text = criteria_item["criteria"]
-                    criteria_comment = criteria_item["comment"] if criteria_item["comment"] else ""
-                    type_indicator = "Pass" if criteria_type == "pass" else "Fail"
-                    prompt += f"    - {type_indicator}: {criteria_text}"
-                    if criteria_comment:
-                        prompt += f" | Comment: {criteria_comment}"
-                    prompt += "\n"
-    else:
-        prompt += "No marking criteria selected.\n"
-    
-    # Failing criteria feedback section
-    if failing_feedback:
-        prompt += (
-            "---\n"
-            "Paragraph 2: Failing Criteria Feedback\n"
-            "If the following text is not empty, generate a second paragraph explaining why the submission failed these items, focusing only on the failed criteria. Do not use lists.\n"
-            f"Failing Criteria Feedback:\n{failing_feedback}\n"
-        )
-    else:
-        prompt += (
-            "---\n"
-            "Paragraph 2: Failing Criteria Feedback\n"
-            "No failing criteria feedback provided. Omit this paragraph.\n"
-        )
-    
-    # Learner-requested feedback section
-    if learner_feedback:
-        prompt += (
-            "---\n"
-            "Paragraph 3: Learner-Requested Items Feedback\n"
-            "If the following text is not empty, generate a third paragraph with advice or responses to the learner's specific requests. Do not use lists.\n"
-            f"Learner-Requested Items Feedback:\n{learner_feedback}\n"
-        )
-    else:
-        prompt += (
-            "---\n"
-            "Paragraph 3: Learner-Requested Items Feedback\n"
-            "No learner-requested feedback provided. Omit this paragraph.\n"
-        )
-    
-    prompt += (
-        "---\n"
-        "Output only the paragraphs as described above, in order. If a paragraph is to be omitted, do not mention it. Each paragraph should be clearly separated. Do not use lists or headings.\n"
+    st.text_area(
+        "Learner-Requested Items Feedback (if applicable)",
+        height=150,
+        key="learner_feedback",
+        help="Provide feedback for specific questions or concerns raised by the learner."
     )
-    return prompt
+    st.markdown("---")
 
 # Main app
 def main():
@@ -199,185 +384,167 @@ def main():
     )
     
     st.title("AI-Powered Course Project Feedback Generator")
+    start_metrics_exporter()
+    start_warmup()
     
-    # Load marking criteria
-    marking_criteria = parse_marking_criteria()
+    # Load marking criteria (parsed once, re-parsed only when the file changes)
+    with stage("load marking criteria"):
+        marking_criteria = load_marking_criteria(MARKING_CRITERIA_FILE, MARKING_CRITERIA_SNAPSHOT)
     
     # Debug the marking criteria
     if DEBUG:
         debug_log("Parsed Marking Criteria", marking_criteria)
     
-    # Load feedback examples
-    feedback_examples = load_feedback_examples()
-    
     # Sidebar for LLM selection
     with st.sidebar:
         st.header("Settings")
         selected_llm = st.selectbox(
             "Choose LLM", 
-            [
-                "Gemini 2.5 Flash",
-                "GPT-OSS 120B (Together)",
-                "Ollama GPT-OSS 20B"
-            ]
+            list(LLM_PROVIDER_KEYS) + list(MULTI_PROVIDER_KEYS),
+            help=f"'{FASTEST_AVAILABLE}' hedges slow requests on a second provider and falls back on errors. "
+                 f"'{AUTO_ROUTING}' picks the provider with the best recent latency, error rate and cost "
+                 f"(objective: {ROUTING_OBJECTIVE})."
+        )
+        bypass_cache = st.checkbox(
+            "Bypass cache / regenerate",
+            help="Always call the LLM, even if identical feedback was generated before."
+        )
+        parallel_paragraphs = st.checkbox(
+            "Generate paragraphs in parallel",
+            help="Write each paragraph with its own request, all at the same time. "
+                 "Usually faster, at the cost of one request per paragraph."
+        )
+        speculative = st.checkbox(
+            "Pre-generate while editing",
+            disabled=SPECULATE_TOKEN_BUDGET <= 0,
+            help="Start generating in the background once the selections stop changing, "
+                 "so Generate returns at once if nothing changed since. Uses extra tokens."
         )
         
         # Generate button in sidebar
         generate_button = st.button("Generate Feedback", type="primary", use_container_width=True)
+        
+        response_cache = get_response_cache()
+        cache_stats = response_cache.stats()
+        st.caption(
+            f"Response cache: {cache_stats['entries']} entries, "
+            f"{cache_stats['hits']} hits / {cache_stats['misses']} misses"
+        )
+        
+        if speculative and not bypass_cache:
+            speculate(selected_llm, parallel_paragraphs)
+        elif "speculator" in st.session_state:
+            st.session_state.speculator.reset()
 
     # --- Unified full-width layout ---
     st.header("Marking Criteria")
     st.markdown("Select the criteria that have been met and add optional comments.")
     
-    # Selected criteria storage
+    # Selected criteria storage: criterion id -> comment, kept up to date by
+    # widget callbacks so each toggle is an O(1) dict update
     if "selected_criteria" not in st.session_state:
-        st.session_state.selected_criteria = []
+        st.session_state.selected_criteria = {}
     
-    # Sort marking criteria by ID for consistent ordering
-    marking_criteria.sort(key=lambda x: x["id"])
+    # Sort marking criteria by ID for consistent ordering (the cached list is shared, so copy it)
+    marking_criteria = sorted(marking_criteria, key=lambda x: x["id"])
     
-    # Display criteria directly as a flat list
+    # Display criteria as a flat list, one fragment per rubric part
     for item in marking_criteria:
-        with st.container():
-            # Show item ID and title
-            st.markdown(f"**{item['id']}:** {item['description']}")
-            
-            # Initialize criteria selection if not in session state
-            if f"selected_criteria_{item['id']}" not in st.session_state:
-                st.session_state[f"selected_criteria_{item['id']}"] = []
-            
-            # Show pass criteria with checkboxes and comment fields
-            if item.get('pass_criteria', []):
-                st.markdown("**Pass Criteria:**")
-                for i, criteria in enumerate(item.get('pass_criteria', [])):
-                    criteria_id = f"{item['id']}_pass_{i}"
-                    c1, c2 = st.columns([1, 10])
-                    with c1:
-                        checked = st.checkbox("", key=f"check_{criteria_id}")
-                    with c2:
-                        st.markdown(f"✅ {criteria}")
-                    if checked:
-                        comment = st.text_area(
-                            f"Comment for '{criteria[:40]}...'", 
-                            placeholder="Add your feedback comments here...",
-                            height=68,
-                            key=f"comment_{criteria_id}"
-                        )
-                        criteria_data = {
-                            "id": criteria_id,
-                            "parent_id": item["id"],
-                            "type": "pass",
-                            "criteria": criteria,
-                            "comment": comment
-                        }
-                        existing_idx = next((i for i, x in enumerate(st.session_state[f"selected_criteria_{item['id']}"]) 
-                                             if x["id"] == criteria_id), None)
-                        if existing_idx is not None:
-                            st.session_state[f"selected_criteria_{item['id']}"][existing_idx] = criteria_data
-                        else:
-                            st.session_state[f"selected_criteria_{item['id']}"].append(criteria_data)
-                    else:
-                        st.session_state[f"selected_criteria_{item['id']}"] = [
-                            x for x in st.session_state[f"selected_criteria_{item['id']}"] if x["id"] != criteria_id
-                        ]
-            # Show fail criteria with checkboxes and comment fields
-            if item.get('fail_criteria', []):
-                st.markdown("**Fail Criteria:**")
-                for i, criteria in enumerate(item.get('fail_criteria', [])):
-                    criteria_id = f"{item['id']}_fail_{i}"
-                    c1, c2 = st.columns([1, 10])
-                    with c1:
-                        checked = st.checkbox("", key=f"check_{criteria_id}")
-                    with c2:
-                        st.markdown(f"❌ {criteria}")
-                    if checked:
-                        comment = st.text_area(
-                            f"Comment for '{criteria[:40]}...'", 
-                            placeholder="Add your feedback comments here...",
-                            height=68,
-                            key=f"comment_{criteria_id}"
-                        )
-                        criteria_data = {
-                            "id": criteria_id,
-                            "parent_id": item["id"],
-                            "type": "fail",
-                            "criteria": criteria,
-                            "comment": comment
-                        }
-                        existing_idx = next((i for i, x in enumerate(st.session_state[f"selected_criteria_{item['id']}"])
-                                             if x["id"] == criteria_id), None)
-                        if existing_idx is not None:
-                            st.session_state[f"selected_criteria_{item['id']}"][existing_idx] = criteria_data
-                        else:
-                            st.session_state[f"selected_criteria_{item['id']}"].append(criteria_data)
-                    else:
-                        st.session_state[f"selected_criteria_{item['id']}"] = [
-                            x for x in st.session_state[f"selected_criteria_{item['id']}"] if x["id"] != criteria_id
-                        ]
-            # Update the primary selected_criteria collection for the prompt
-            if st.session_state[f"selected_criteria_{item['id']}"]:
-                existing_item = next((x for x in st.session_state.selected_criteria if x["id"] == item["id"]), None)
-                if existing_item:
-                    existing_item["selected_criteria"] = st.session_state[f"selected_criteria_{item['id']}"]
-                else:
-                    st.session_state.selected_criteria.append({
-                        "id": item["id"],
-                        "title": item["description"],
-                        "selected_criteria": st.session_state[f"selected_criteria_{item['id']}"]
-                    })
-            else:
-                st.session_state.selected_criteria = [
-                    x for x in st.session_state.selected_criteria if x["id"] != item["id"]
-                ]
-            st.markdown("---")
+        render_rubric_part(item)
 
-    # --- Additional Feedback Section ---
-    st.header("Additional Feedback")
-    failing_feedback = st.text_area(
-        "Failing Criteria Feedback (if applicable)",
-        height=150,
-        help="Provide specific feedback for criteria that were not met."
-    )
-    learner_feedback = st.text_area(
-        "Learner-Requested Items Feedback (if applicable)",
-        height=150,
-        help="Provide feedback for specific questions or concerns raised by the learner."
-    )
-    st.markdown("---")
+    render_additional_feedback()
 
     # --- Generated Feedback Section ---
     st.header("Generated Feedback")
-    if generate_button:
+    job_queue = get_job_queue()
+    show_job = True
+    # Set by the buttons of a reuse offer: "adapt" the draft or generate "fresh"
+    reuse_choice = st.session_state.pop("reuse_choice", None)
+    reuse_offer = st.session_state.pop("reuse_offer", None)
+    if generate_button or reuse_choice:
         if not st.session_state.selected_criteria:
             st.error("Please select at least one marking criteria.")
+            show_job = False
         else:
-            prompt = construct_prompt(
-                st.session_state.selected_criteria,
-                failing_feedback,
-                learner_feedback,
-                feedback_examples
+            prompts, prompt, providers, cache_keys, budget_report = build_generation_request(
+                selected_llm, parallel_paragraphs
             )
+            request_key = "|".join(cache_keys[p] for p in providers)
+            # The offer only applies while the selections are the ones it was made for
+            if reuse_offer is None or reuse_offer["request_key"] != request_key:
+                reuse_choice = None
+            if reuse_choice == "adapt":
+                prompts, prompt, providers, cache_keys, budget_report = build_generation_request(
+                    selected_llm, parallel_paragraphs, draft=reuse_offer["feedback"]
+                )
             if DEBUG:
                 debug_log("Generated Prompt", prompt)
-            with st.spinner(f"Generating feedback using {selected_llm}..."):
-                start_time = time.time()
-                if selected_llm == "Gemini 2.5 Flash":
-                    feedback = run_gemini_flash(prompt)
-                elif selected_llm == "GPT-OSS 120B (Together)":
-                    feedback = run_deepseek_r1_together(prompt)
-                elif selected_llm == "Ollama GPT-OSS 20B":
-                    feedback = run_ollama_gpt_oss(prompt)
-                else:
-                    feedback = "Error: Selected LLM not implemented"
-                end_time = time.time()
-            st.markdown(feedback)
-            st.caption(f"Generated in {end_time - start_time:.2f} seconds")
-            st.download_button(
-                label="Download Feedback",
-                data=feedback,
-                file_name="course_project_feedback.md",
-                mime="text/markdown"
+            if budget_report is not None:
+                st.caption(
+                    f"Prompt: {budget_report['prompt_tokens']} of {budget_report['budget']} tokens, "
+                    f"{budget_report['examples']} of {budget_report['available']} feedback examples "
+                    f"({budget_report['tokens_saved']} tokens saved)"
+                )
+            # A speculative job for a different prompt is cancelled; one for this
+            # prompt is joined below, or has already put its result in the cache
+            speculation_hit = "speculator" in st.session_state and st.session_state.speculator.claim(
+                "|".join(cache_keys[p] for p in providers)
             )
+            start_time = time.time()
+            feedback = None
+            if not bypass_cache:
+                # Read only the key that is cached (or the first one), so each
+                # request counts as a single hit or miss
+                provider = next(
+                    (p for p, key in cache_keys.items() if response_cache.contains(key)), next(iter(cache_keys))
+                )
+                feedback = response_cache.get(cache_keys[provider])
+            nearest = None
+            if feedback is None and not (bypass_cache or reuse_choice or speculation_hit):
+                # Before paying for a generation, look for feedback on a very similar request
+                nearest = get_feedback_index().nearest(current_request_vector())
+            if feedback is not None:
+                end_time = time.time()
+                record_call(
+                    provider=provider,
+                    model=get_provider(provider)["model"],
+                    prompt_chars=len(prompt),
+                    latency_s=end_time - start_time,
+                    cache_hit=True
+                )
+                st.markdown(feedback)
+                st.caption(f"Loaded from cache in {(end_time - start_time) * 1000:.0f} ms")
+                st.download_button(
+                    label="Download Feedback",
+                    data=feedback,
+                    file_name="course_project_feedback.md",
+                    mime="text/markdown"
+                )
+                show_job = False
+            elif nearest is not None:
+                similarity, record = nearest
+                render_reuse_offer(similarity, record)
+                st.session_state.reuse_offer = {"request_key": request_key, "feedback": record["feedback"]}
+                show_job = False
+            else:
+                # Generation runs as a background job, so reruns and refreshes do not
+                # lose it, and identical requests in flight share one job
+                job = submit_generation(selected_llm, prompts, providers, cache_keys)
+                st.session_state.job_id = job.id
+                st.query_params["job"] = job.id
+
+    # Reattach to this session's job, or after a refresh to the job in the URL
+    if show_job:
+        job_id = st.session_state.get("job_id") or st.query_params.get("job")
+        job = job_queue.get(job_id) if job_id else None
+        if job is not None:
+            st.session_state.job_id = job.id
+            render_job(job)
+        elif job_id:
+            # Expired, or the server restarted since
+            st.session_state.pop("job_id", None)
+            st.query_params.pop("job", None)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
+    log_startup_report()
\ No newline at end of file
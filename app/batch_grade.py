@@ -0,0 +1,327 @@
+"""
+Headless batch grading.
+
+Reads submissions from a JSONL file (one submission per line) or a directory of
+``.json`` files, builds a prompt for each with ``construct_prompt_parts`` and runs them
+through a bounded worker pool. Results are appended to an output JSONL file as
+they finish, so an interrupted run can be resumed by running the same command
+again.
+
+Each submission looks like::
+
+    {
+        "id": "learner-042",
+        "selected_criteria": [
+            {
+                "id": "Part 1.1",
+                "title": "Defines a problem statement",
+                "selected_criteria": [
+                    {"id": "Part 1.1_pass_0", "type": "pass",
+                     "criteria": "Defines a relevant business problem ...",
+                     "comment": "Clear and specific."}
+                ]
+            }
+        ],
+        "failing_feedback": "",
+        "learner_feedback": ""
+    }
+
+Instead of ``selected_criteria`` a submission can give just the criterion ids
+from the rubric and their comments, e.g.
+``"criteria": {"Part 1.1_pass_0": "Clear and specific.", "Part 2.1_fail_0": ""}``.
+
+With ``--pack`` several submissions share one request (see packing.py): the
+model returns a JSON object keyed by submission id, and submissions missing
+from the answer are packed again, then graded on their own.
+
+Usage:
+    python batch_grade.py submissions.jsonl -o results.jsonl --provider gemini --workers 8
+    python batch_grade.py submissions.jsonl -o results.jsonl --provider gemini --pack
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from llm_inference import FatalLLMError, run_fake_llm, warm_ollama
+from providers import PROVIDERS as REGISTERED_PROVIDERS
+from router import run_fastest, run_auto
+from prompt_builder import (
+    load_feedback_examples,
+    construct_prompt_prefix,
+    construct_prompt_parts,
+    construct_packed_prompt_suffix
+)
+from packing import PackSizer, PACK_MAX, PACK_MAX_ATTEMPTS, parse_packed_response
+from rubric import load_rubric_index, build_selected_criteria
+
+# Provider name on the command line -> inference function: every registered
+# provider, the fake server for testing, and the two routing modes
+PROVIDERS = {
+    **{key: provider["run"] for key, provider in REGISTERED_PROVIDERS.items()},
+    "fake": run_fake_llm,
+    "fastest": run_fastest,
+    "auto": run_auto,
+}
+
+# Load submissions from a JSONL file or a directory of .json files
+def load_submissions(source):
+    submissions = []
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if not name.endswith(".json"):
+                continue
+            with open(os.path.join(source, name), 'r') as file:
+                submission = json.load(file)
+            submission.setdefault("id", os.path.splitext(name)[0])
+            submissions.append(submission)
+    else:
+        with open(source, 'r') as file:
+            for line_number, line in enumerate(file, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                submission = json.loads(line)
+                submission.setdefault("id", f"line-{line_number}")
+                submissions.append(submission)
+    return submissions
+
+# Ids that already have a successful result in the output file
+def load_completed_ids(output_path):
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, 'r') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A partially written last line from an interrupted run
+                continue
+            if record.get("status") == "ok":
+                completed.add(record["id"])
+    return completed
+
+# Cut a partially written last line left by an interrupted run, so appended
+# records start on a line of their own
+def truncate_partial_line(output_path):
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, 'rb+') as file:
+        data = file.read()
+        if data and not data.endswith(b"\n"):
+            file.truncate(data.rfind(b"\n") + 1)
+
+# Selected criteria for a submission, resolving compact {criterion id: comment} input
+def resolve_selected_criteria(submission, rubric_index):
+    if "criteria" in submission:
+        return build_selected_criteria(rubric_index, submission["criteria"])
+    return submission.get("selected_criteria", [])
+
+# Prompt parts (prefix, suffix) for one submission
+def submission_prompt_parts(submission, feedback_examples, rubric_index=None):
+    return construct_prompt_parts(
+        resolve_selected_criteria(submission, rubric_index),
+        submission.get("failing_feedback", ""),
+        submission.get("learner_feedback", ""),
+        feedback_examples
+    )
+
+# Build the prompt for one submission and run it through the provider
+def grade_submission(submission, run_llm, feedback_examples, rubric_index=None):
+    prefix, suffix = submission_prompt_parts(submission, feedback_examples, rubric_index)
+    start_time = time.time()
+    record = {"id": submission["id"]}
+    try:
+        record["feedback"] = run_llm(suffix, prefix=prefix)
+        record["status"] = "ok"
+    except Exception as e:
+        # Any failure is recorded against this submission so the rest of the batch still runs
+        record["feedback"] = str(e)
+        record["status"] = "error"
+        record["error_class"] = type(e).__name__
+    record["latency_s"] = round(time.time() - start_time, 3)
+    record["prompt_chars"] = len(prefix) + len(suffix)
+    return record
+
+# One submission as a batch task: (records, submissions to retry, prompt chars sent)
+def grade_single(submission, run_llm, feedback_examples, rubric_index=None):
+    record = grade_submission(submission, run_llm, feedback_examples, rubric_index)
+    return [record], [], record["prompt_chars"]
+
+# Several submissions in one request under their shared prefix. Returns records
+# for the submissions answered, the ones to retry and the prompt chars sent.
+def grade_pack(pack, prompt_parts, run_llm, pack_sizer):
+    prefix = prompt_parts[0][0]
+    suffix = construct_packed_prompt_suffix(
+        [(submission["id"], parts[1]) for submission, parts in zip(pack, prompt_parts)]
+    )
+    prompt_chars = len(prefix) + len(suffix)
+    start_time = time.time()
+    try:
+        response = run_llm(suffix, prefix=prefix)
+    except FatalLLMError as e:
+        # Retrying would fail the same way (e.g. a missing API key), so the
+        # whole pack is recorded as failed at once
+        latency_s = round(time.time() - start_time, 3)
+        records = [
+            {
+                "id": submission["id"],
+                "feedback": str(e),
+                "status": "error",
+                "error_class": type(e).__name__,
+                "latency_s": latency_s,
+                "prompt_chars": prompt_chars // len(pack),
+                "pack_size": len(pack),
+            }
+            for submission in pack
+        ]
+        return records, [], prompt_chars
+    except Exception:
+        # Packed again, then on their own where errors are recorded. The pack
+        # size is kept, since the failure says nothing about it.
+        return [], list(pack), prompt_chars
+    latency_s = round(time.time() - start_time, 3)
+    results, retry_ids = parse_packed_response(response, [submission["id"] for submission in pack])
+    pack_sizer.record(len(pack), len(results), sum(len(feedback) for feedback in results.values()))
+
+    records = [
+        {
+            "id": submission_id,
+            "feedback": feedback,
+            "status": "ok",
+            "latency_s": latency_s,
+            "prompt_chars": prompt_chars // len(pack),
+            "pack_size": len(pack),
+        }
+        for submission_id, feedback in results.items()
+    ]
+    retry = [submission for submission in pack if submission["id"] in retry_ids]
+    return records, retry, prompt_chars
+
+# Run all pending submissions, writing each result as soon as it finishes.
+# With a pack_sizer, submissions are sent several to a request.
+def run_batch(submissions, run_llm, output_path, feedback_examples, workers=4, resume=True, progress=None,
+              rubric_index=None, pack_sizer=None):
+    completed_ids = load_completed_ids(output_path) if resume else set()
+    pending = [s for s in submissions if s["id"] not in completed_ids]
+
+    stats = {
+        "skipped": len(submissions) - len(pending), "ok": 0, "error": 0, "latency_s": 0.0,
+        "requests": 0, "prompt_chars": 0
+    }
+    start_time = time.time()
+
+    queue = deque(pending)
+    # Submissions that failed to come back from packs, graded one per request
+    solo = deque()
+    attempts = defaultdict(int)
+    prompt_parts = {}
+
+    def parts(submission):
+        key = id(submission)
+        if key not in prompt_parts:
+            prompt_parts[key] = submission_prompt_parts(submission, feedback_examples, rubric_index)
+        return prompt_parts[key]
+
+    if resume:
+        truncate_partial_line(output_path)
+    mode = 'a' if resume else 'w'
+    with open(output_path, mode) as out, ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = set()
+
+        # Keep at most 2x workers tasks queued so large batches stay bounded in memory
+        def fill():
+            while len(in_flight) < workers * 2 and (queue or solo):
+                if solo or pack_sizer is None:
+                    submission = (solo or queue).popleft()
+                    in_flight.add(pool.submit(grade_single, submission, run_llm, feedback_examples, rubric_index))
+                else:
+                    pack = pack_sizer.take(queue, lambda submission: len(parts(submission)[1]))
+                    pack_parts = [parts(submission) for submission in pack]
+                    in_flight.add(pool.submit(grade_pack, pack, pack_parts, run_llm, pack_sizer))
+
+        fill()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_flight.remove(future)
+                records, retry, prompt_chars = future.result()
+                stats["requests"] += 1
+                stats["prompt_chars"] += prompt_chars
+                for record in records:
+                    out.write(json.dumps(record) + "\n")
+                    stats[record["status"]] += 1
+                    stats["latency_s"] += record["latency_s"]
+                out.flush()
+                for submission in reversed(retry):
+                    attempts[submission["id"]] += 1
+                    if attempts[submission["id"]] >= PACK_MAX_ATTEMPTS:
+                        solo.append(submission)
+                    else:
+                        queue.appendleft(submission)
+                if progress:
+                    progress(stats, len(pending), time.time() - start_time)
+            fill()
+
+    stats["elapsed_s"] = time.time() - start_time
+    finished = stats["ok"] + stats["error"]
+    stats["throughput_per_min"] = finished / stats["elapsed_s"] * 60 if stats["elapsed_s"] > 0 else 0.0
+    stats["mean_latency_s"] = stats["latency_s"] / finished if finished else 0.0
+    return stats
+
+def print_progress(stats, total, elapsed):
+    finished = stats["ok"] + stats["error"]
+    rate = finished / elapsed * 60 if elapsed > 0 else 0.0
+    print(
+        f"\r[{finished}/{total}] ok={stats['ok']} error={stats['error']} {rate:.1f}/min",
+        end="", file=sys.stderr, flush=True
+    )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate feedback for a batch of submissions.")
+    parser.add_argument("source", help="JSONL file or directory of .json submissions")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="Output JSONL file (default: results.jsonl)")
+    parser.add_argument("--provider", choices=sorted(PROVIDERS), default="gemini")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent LLM calls (default: 4)")
+    parser.add_argument("--examples", default="feedback_examples.md", help="Feedback examples file")
+    parser.add_argument("--rubric", default="marking_criteria.md", help="Marking criteria file for criterion ids")
+    parser.add_argument("--no-resume", action="store_true", help="Overwrite the output instead of resuming")
+    parser.add_argument("--pack", action="store_true", help="Send several submissions per request")
+    parser.add_argument("--pack-max", type=int, default=PACK_MAX,
+                        help=f"Most submissions per packed request (default: {PACK_MAX})")
+    args = parser.parse_args(argv)
+
+    submissions = load_submissions(args.source)
+    feedback_examples = load_feedback_examples(args.examples)
+    if args.provider == "ollama":
+        # Load the model once up front instead of inside the first worker's request
+        load_s = warm_ollama()
+        if load_s is not None:
+            print(f"Ollama model loaded in {load_s:.1f}s", file=sys.stderr)
+    stats = run_batch(
+        submissions,
+        PROVIDERS[args.provider],
+        args.output,
+        feedback_examples,
+        workers=args.workers,
+        resume=not args.no_resume,
+        progress=print_progress,
+        rubric_index=load_rubric_index(args.rubric),
+        pack_sizer=PackSizer(args.provider, len(construct_prompt_prefix(feedback_examples)), args.pack_max)
+        if args.pack else None
+    )
+    print(file=sys.stderr)
+    print(
+        f"Done: {stats['ok']} ok, {stats['error']} errors, {stats['skipped']} already completed. "
+        f"{stats['elapsed_s']:.1f}s elapsed, {stats['throughput_per_min']:.1f} submissions/min, "
+        f"mean latency {stats['mean_latency_s']:.2f}s"
+    )
+    print(f"{stats['requests']} requests, about {stats['prompt_chars'] // 4} prompt tokens")
+    return 1 if stats["error"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
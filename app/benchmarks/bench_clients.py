@@ -0,0 +1,82 @@
+"""
+Per-call client overhead: a new SDK client for every call (the old behaviour)
+versus the shared clients from ``llm_inference.get_client``.
+
+Runs against the local fake server, so the numbers are the client-side cost
+(SDK client construction, HTTP pool setup and connection establishment) plus a
+fixed server latency. Against the real APIs the gap is larger, because every
+new connection also pays a TLS handshake.
+
+Usage (from the app directory):
+    python -m benchmarks.bench_clients --calls 50
+"""
+import argparse
+import os
+import statistics
+import time
+
+from benchmarks.fake_servers import start_fake_server, fake_provider_env
+
+PROMPT = "Generate feedback for: Part 1.1 Pass: Defines a relevant business problem statement."
+
+def gemini_fresh_client(prompt):
+    from google import genai
+    from google.genai import types
+    client = genai.Client(api_key=os.environ['GEMINI_API_KEY'])
+    response = client.models.generate_content(
+        model="gemini-2.5-flash",
+        contents=prompt,
+        config=types.GenerateContentConfig(temperature=0.4, max_output_tokens=4000)
+    )
+    return response.text
+
+def together_fresh_client(prompt):
+    from together import Together
+    client = Together()
+    response = client.chat.completions.create(
+        model="openai/gpt-oss-120b",
+        messages=[{"role": "user", "content": prompt}]
+    )
+    return response.choices[0].message.content
+
+def ollama_fresh_client(prompt):
+    from ollama import Client
+    response = Client().chat(model='gpt-oss:20b', messages=[{'role': 'user', 'content': prompt}])
+    return response['message']['content']
+
+def time_calls(fn, calls):
+    fn(PROMPT)  # warm up imports so they are not counted against either side
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        result = fn(PROMPT)
+        timings.append(time.perf_counter() - start)
+        if result.startswith("Error"):
+            raise RuntimeError(result)
+    return timings
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.0, help="Fake server latency in seconds")
+    args = parser.parse_args(argv)
+
+    server = start_fake_server(latency=args.latency)
+    os.environ.update(fake_provider_env(server))
+
+    from llm_inference import run_gemini_flash, run_deepseek_r1_together, run_ollama_gpt_oss
+
+    cases = [
+        ("Gemini", gemini_fresh_client, run_gemini_flash),
+        ("Together", together_fresh_client, run_deepseek_r1_together),
+        ("Ollama", ollama_fresh_client, run_ollama_gpt_oss),
+    ]
+    print(f"{'provider':<10} {'new client/call':>16} {'shared client':>14} {'saved/call':>11}")
+    for name, before, after in cases:
+        before_ms = statistics.mean(time_calls(before, args.calls)) * 1000
+        after_ms = statistics.mean(time_calls(after, args.calls)) * 1000
+        print(f"{name:<10} {before_ms:>14.2f}ms {after_ms:>12.2f}ms {before_ms - after_ms:>9.2f}ms")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
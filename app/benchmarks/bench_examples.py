@@ -0,0 +1,111 @@
+"""
+Example selection on a synthetic feedback example bank with thousands of examples.
+
+Builds a bank by varying the real ``feedback_examples.md`` sections with
+topic words, then reports the time to index it, the time to rank it for one
+request with the NumPy BM25 index versus a pure-Python BM25 loop, and the
+prompt tokens with the whole bank versus the budgeted selection.
+
+Usage (from the app directory):
+    python -m benchmarks.bench_examples --examples 5000
+"""
+import argparse
+import math
+import os
+import random
+import tempfile
+from collections import Counter
+
+import example_index
+from example_index import load_example_bank, split_examples, tokenize, BM25_K1, BM25_B
+from prompt_budget import count_tokens, select_examples, PROMPT_TOKEN_BUDGET
+from prompt_builder import construct_prompt_parts, examples_query
+
+from benchmarks.bench_rubric import best_of
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TOPICS = (
+    "regression", "time series", "data cleaning", "visualization", "outliers", "correlation",
+    "feature engineering", "model evaluation", "sampling", "hypothesis testing", "clustering",
+    "dashboard", "SQL queries", "problem statement", "success metrics", "recommendations",
+)
+
+def write_synthetic_bank(directory, count, seed=0):
+    rng = random.Random(seed)
+    with open(os.path.join(APP_DIR, "feedback_examples.md")) as file:
+        base = split_examples(file.read())
+    with open(os.path.join(directory, "synthetic.md"), 'w') as file:
+        for i in range(count):
+            topic = rng.choice(TOPICS)
+            example = rng.choice(base)
+            heading, _, body = example.partition("\n")
+            file.write(f"{heading} ({topic} #{i})\n{body} This applies to the {topic} section.\n\n")
+
+# BM25 scored one example at a time, as a baseline for the vectorized index
+def python_bm25_rank(examples, query):
+    documents = [Counter(tokenize(example)) for example in examples]
+    lengths = [sum(document.values()) for document in documents]
+    average = sum(lengths) / len(lengths)
+    terms = set(tokenize(query))
+    df = {term: sum(1 for document in documents if term in document) for term in terms}
+    scores = []
+    for document, length in zip(documents, lengths):
+        score = 0.0
+        for term in terms:
+            tf = document.get(term, 0)
+            if tf:
+                idf = math.log1p((len(documents) - df[term] + 0.5) / (df[term] + 0.5))
+                score += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / average))
+        scores.append(score)
+    return sorted(range(len(scores)), key=lambda i: -scores[i])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--examples", type=int, default=5000)
+    parser.add_argument("--provider", default="gemini")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    selected_criteria = [{
+        "id": "Part 2.1",
+        "title": "Time series analysis of monthly sales",
+        "selected_criteria": [{
+            "id": "Part 2.1_fail_0", "parent_id": "Part 2.1", "type": "fail",
+            "criteria": "Outliers are identified and their impact on the regression is explained",
+            "comment": "Outliers in the scatter plot are not discussed",
+        }],
+    }]
+    failing, learner = "The correlation results are not explained.", "How can I improve my visualization?"
+    query = examples_query(selected_criteria, failing, learner)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        write_synthetic_bank(tmp, args.examples)
+        examples_file = os.path.join(APP_DIR, "feedback_examples.md")
+
+        def build():
+            example_index._cache.clear()
+            return load_example_bank(examples_file, tmp)
+
+        bank = build()
+        print(f"Synthetic bank: {len(bank.examples)} examples, {len(bank.text) / 1024:.0f} KiB, "
+              f"{len(bank.index.weights)} index entries")
+        print(f"  {'load and index the bank':<36} {best_of(build, args.repeat) * 1000:9.3f} ms")
+        print(f"  {'cached load (Streamlit rerun)':<36} "
+              f"{best_of(lambda: load_example_bank(examples_file, tmp), args.repeat) * 1000:9.3f} ms")
+        print(f"  {'rank, pure-Python BM25':<36} "
+              f"{best_of(lambda: python_bm25_rank(bank.examples, query), args.repeat) * 1000:9.3f} ms")
+        print(f"  {'rank, NumPy BM25 index':<36} {best_of(lambda: bank.index.rank(query), args.repeat) * 1000:9.3f} ms")
+
+        prefix, suffix = construct_prompt_parts(selected_criteria, failing, learner, "")
+        fixed = count_tokens(prefix + suffix, args.provider)
+        bank.token_counts(args.provider, count_tokens)
+        seconds = best_of(lambda: select_examples(bank, query, args.provider, fixed), args.repeat)
+        _, report = select_examples(bank, query, args.provider, fixed)
+        print(f"Prompt for one request ({args.provider}, budget {PROMPT_TOKEN_BUDGET} tokens):")
+        print(f"  {'whole bank':<36} {fixed + count_tokens(bank.text, args.provider):9d} tokens")
+        print(f"  {'budgeted selection':<36} {report['prompt_tokens']:9d} tokens "
+              f"({report['examples']} examples, {report['tokens_saved']} saved, {seconds * 1000:.3f} ms)")
+
+if __name__ == "__main__":
+    main()
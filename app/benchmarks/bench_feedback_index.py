@@ -0,0 +1,87 @@
+"""
+Nearest-feedback lookup in the feedback similarity index with many stored records.
+
+Fills an index with synthetic requests (random sets of criteria from the real
+rubric, with comments), then reports the time to add a record, to reopen the
+index, and the lookup latency for near-duplicate queries. Each lookup is
+checked against an exact brute-force search over all vectors.
+
+Usage (from the app directory):
+    python -m benchmarks.bench_feedback_index --records 50000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from feedback_index import FeedbackIndex, request_vector
+from metrics import percentile
+from rubric import load_rubric_index
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = ("clear", "chart", "labels", "missing", "regression", "outliers", "good", "explain",
+         "results", "data", "cleaning", "metrics", "structure", "summary", "detail")
+
+def random_request(rng, criteria_ids):
+    selections = {}
+    for criteria_id in rng.sample(criteria_ids, rng.randint(3, 12)):
+        selections[criteria_id] = " ".join(rng.choices(WORDS, k=rng.randint(0, 6)))
+    return selections
+
+def near_duplicate(rng, selections, criteria_ids):
+    selections = dict(selections)
+    if rng.random() < 0.5:
+        selections.pop(rng.choice(list(selections)))
+    else:
+        selections[rng.choice(criteria_ids)] = ""
+    return selections
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    criteria_ids = list(load_rubric_index(os.path.join(APP_DIR, "marking_criteria.md"))["criteria"])
+    requests = [random_request(rng, criteria_ids) for _ in range(args.records)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = FeedbackIndex(tmp)
+        start = time.perf_counter()
+        vectors = np.stack([request_vector(selections) for selections in requests])
+        vector_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        for i, vector in enumerate(vectors):
+            index.add(vector, f"Synthetic feedback {i}", provider="fake")
+        add_seconds = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(tmp, name)) for name in os.listdir(tmp))
+        print(f"{len(index)} records, {size / 2**20:.1f} MiB on disk")
+        print(f"  request_vector: {vector_seconds / args.records * 1e6:.1f} us per request")
+        print(f"  add: {add_seconds / args.records * 1e6:.1f} us per record")
+
+        start = time.perf_counter()
+        index = FeedbackIndex(tmp)
+        print(f"  reopen: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        latencies = []
+        agree = 0
+        for _ in range(args.queries):
+            target = rng.randrange(args.records)
+            query = request_vector(near_duplicate(rng, requests[target], criteria_ids))
+            start = time.perf_counter()
+            found = index.nearest(query, threshold=0.0)
+            latencies.append(time.perf_counter() - start)
+            exact = int(np.argmax(vectors @ query))
+            agree += found is not None and found[1]["feedback"] == f"Synthetic feedback {exact}"
+        print(f"Lookup of {args.queries} near-duplicate requests:")
+        print(f"  p50 {percentile(latencies, 0.5) * 1000:.3f} ms, p99 {percentile(latencies, 0.99) * 1000:.3f} ms")
+        print(f"  same nearest record as brute force: {agree / args.queries:.1%}")
+
+if __name__ == "__main__":
+    main()
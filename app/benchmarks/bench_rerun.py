@@ -0,0 +1,77 @@
+"""
+Streamlit rerun latency as the rubric grows, measured with AppTest.
+
+For each rubric size a synthetic ``marking_criteria.md`` is written to a
+temporary working directory, the app is loaded with AppTest and a series of
+criteria are ticked one at a time, timing the rerun after each click.
+
+AppTest always reruns the whole script, so these are full-rerun numbers.
+In the browser a checkbox only reruns its own part's fragment, which is
+cheaper still. Pass ``--app`` with an older copy of app.py to compare
+against a previous version.
+
+Usage (from the app directory):
+    python -m benchmarks.bench_rerun --sizes 25 50 100 --toggles 10
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_rubric import write_synthetic_rubric
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def measure(app_path, parts, toggles, timeout):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(app_path, default_timeout=timeout)
+    start = time.perf_counter()
+    at.run()
+    first_run = time.perf_counter() - start
+
+    checkbox_keys = [cb.key for cb in at.checkbox if cb.key and cb.key.startswith("check_")]
+    step = max(1, len(checkbox_keys) // toggles)
+    rerun_times = []
+    for key in checkbox_keys[::step][:toggles]:
+        at.checkbox(key=key).check()
+        start = time.perf_counter()
+        at.run()
+        rerun_times.append(time.perf_counter() - start)
+        if at.exception:
+            raise RuntimeError(at.exception[0].value)
+    return len(checkbox_keys), first_run, rerun_times
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--app", default=os.path.join(APP_DIR, "app.py"), help="App script to measure")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[25, 50, 100], help="Rubric sizes in parts")
+    parser.add_argument("--toggles", type=int, default=10, help="Checkboxes ticked per size")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args(argv)
+
+    app_path = os.path.abspath(args.app)
+    sys.path.insert(0, os.path.dirname(app_path))
+    original_cwd = os.getcwd()
+
+    print(f"{'parts':>6} {'criteria':>9} {'first run':>10} {'rerun p50':>10} {'rerun max':>10}")
+    for parts in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            # The app reads its rubric and examples from the working directory
+            write_synthetic_rubric(os.path.join(tmp, "marking_criteria.md"), 1, parts)
+            shutil.copy(os.path.join(APP_DIR, "feedback_examples.md"), tmp)
+            os.chdir(tmp)
+            try:
+                criteria, first_run, rerun_times = measure(app_path, parts, args.toggles, args.timeout)
+            finally:
+                os.chdir(original_cwd)
+        print(
+            f"{parts:>6} {criteria:>9} {first_run * 1000:>8.0f}ms "
+            f"{statistics.median(rerun_times) * 1000:>8.0f}ms {max(rerun_times) * 1000:>8.0f}ms"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Rubric loading and lookup on a synthetic rubric with thousands of items.
+
+Compares the original per-rerun parser (uncompiled patterns, four re.match
+calls per line) with rubric.py: a cold parse, a cached load (what a Streamlit
+rerun now costs), a load from the JSON snapshot in a fresh process, and
+criterion lookup by id via the index versus scanning the parsed list.
+
+Usage (from the app directory):
+    python -m benchmarks.bench_rubric --sections 50 --parts 20
+"""
+import argparse
+import os
+import re
+import tempfile
+import time
+
+import rubric
+
+def write_synthetic_rubric(path, sections, parts_per_section, criteria_per_part=3):
+    with open(path, 'w') as file:
+        for s in range(1, sections + 1):
+            file.write(f"### **Part {s}**\n")
+            for p in range(1, parts_per_section + 1):
+                file.write(f"#### **Part {s}.{p}:** Synthetic criterion group {s}.{p}\n")
+                for c in range(criteria_per_part):
+                    file.write(f"- [ ] **Pass**: Meets synthetic requirement {c} for part {s}.{p} with supporting evidence  \n")
+                file.write(f"- [ ] **Fail**: Does not meet the synthetic requirements for part {s}.{p}  \n")
+            file.write("\n")
+
+# The parser as it was in app.py before rubric.py, kept here as the baseline
+def legacy_parse(file_path):
+    criteria = []
+    with open(file_path, 'r') as file:
+        lines = file.readlines()
+    current_section = current_part = current_id = current_title = None
+    pass_criteria, fail_criteria = [], []
+    for line in lines:
+        line = line.rstrip()
+        section_match = re.match(r'### \*\*Part (\d+)\*\*', line)
+        if section_match:
+            current_section = f"Part {section_match.group(1)}"
+            continue
+        part_match = re.match(r'#### \*\*Part (\d+)\.(\d+):\*\* (.*)', line)
+        if part_match:
+            if current_part is not None:
+                criteria.append({"id": current_id, "section": current_section, "title": current_title,
+                                 "pass_criteria": pass_criteria, "fail_criteria": fail_criteria,
+                                 "description": current_title})
+            current_part = f"{part_match.group(1)}.{part_match.group(2)}"
+            current_id = f"Part {current_part}"
+            current_title = part_match.group(3).strip()
+            current_section = f"Part {part_match.group(1)}"
+            pass_criteria, fail_criteria = [], []
+            continue
+        pass_match = re.match(r'- \[\s?\]\s*\*\*Pass\*\*:\s*(.*)', line)
+        if pass_match and current_part is not None:
+            pass_criteria.append(pass_match.group(1).strip())
+            continue
+        fail_match = re.match(r'- \[\s?\]\s*\*\*Fail\*\*:\s*(.*)', line)
+        if fail_match and current_part is not None:
+            fail_criteria.append(fail_match.group(1).strip())
+            continue
+    if current_part is not None:
+        criteria.append({"id": current_id, "section": current_section, "title": current_title,
+                         "pass_criteria": pass_criteria, "fail_criteria": fail_criteria,
+                         "description": current_title})
+    return criteria
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sections", type=int, default=50)
+    parser.add_argument("--parts", type=int, default=20, help="Parts per section")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        rubric_path = os.path.join(tmp, "rubric.md")
+        snapshot_path = os.path.join(tmp, "rubric.snapshot.json")
+        write_synthetic_rubric(rubric_path, args.sections, args.parts)
+
+        criteria = rubric.parse_marking_criteria(rubric_path)
+        index = rubric.build_rubric_index(criteria)
+        print(f"Synthetic rubric: {len(criteria)} parts, {len(index['criteria'])} criteria, "
+              f"{os.path.getsize(rubric_path) / 1024:.0f} KiB")
+
+        def snapshot_load():
+            rubric.clear_rubric_cache()
+            rubric.load_marking_criteria(rubric_path, snapshot_path)
+
+        rubric.load_marking_criteria(rubric_path, snapshot_path)  # writes the snapshot
+        results = [
+            ("legacy parse (old app.py)", best_of(lambda: legacy_parse(rubric_path), args.repeat)),
+            ("rubric.parse_marking_criteria", best_of(lambda: rubric.parse_marking_criteria(rubric_path), args.repeat)),
+            ("load from snapshot (fresh process)", best_of(snapshot_load, args.repeat)),
+            ("cached load (Streamlit rerun)", best_of(lambda: rubric.load_marking_criteria(rubric_path, snapshot_path), args.repeat)),
+        ]
+        for name, seconds in results:
+            print(f"  {name:<36} {seconds * 1000:9.3f} ms")
+
+        # Look up every 10th criterion by id
+        wanted = list(index["criteria"])[::10]
+        def linear_lookup():
+            for criteria_id in wanted:
+                part_id, kind, i = criteria_id.rsplit("_", 2)
+                part = next(p for p in criteria if p["id"] == part_id)
+                part[f"{kind}_criteria"][int(i)]
+        def index_lookup():
+            for criteria_id in wanted:
+                index["criteria"][criteria_id]["criteria"]
+        print(f"Lookup of {len(wanted)} criteria by id:")
+        print(f"  {'scan of parsed list':<36} {best_of(linear_lookup, args.repeat) * 1000:9.3f} ms")
+        print(f"  {'rubric index':<36} {best_of(index_lookup, args.repeat) * 1000:9.3f} ms")
+
+if __name__ == "__main__":
+    main()
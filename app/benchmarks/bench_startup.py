@@ -0,0 +1,124 @@
+"""
+Cold start latency: first paint and first generation in a fresh process.
+
+Each run starts a new Python process that loads the app with AppTest (the
+first paint, including importing Streamlit and the app), ticks a criterion,
+waits ``--think-time`` seconds as a marker would while choosing criteria, and
+then clicks Generate (the first generation) against the local fake provider
+server. Runs are repeated with the background warm-up on and off
+(``LLM_WARMUP``), so the time the warm-up takes off the first generation is
+visible. Set ``STARTUP_PROFILE=1`` to also get each child's import report.
+
+Exits with status 1 if the p50 first paint or first generation with warm-up
+is over its budget.
+
+Usage (from the app directory):
+    python -m benchmarks.bench_startup --runs 5 --provider gemini
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Taken before anything else is imported, so the first paint includes the imports
+_process_start = time.perf_counter()
+
+from benchmarks.fake_servers import start_fake_server, fake_provider_env
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def child(provider_label, think_time, timeout):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(APP_DIR, "app.py"), default_timeout=timeout)
+    at.run()
+    first_paint = time.perf_counter() - _process_start
+    at.selectbox[0].set_value(provider_label)
+    at.checkbox(key="check_Part 1.1_pass_0").check()
+    at.run()
+    time.sleep(max(0.0, think_time - (time.perf_counter() - _process_start - first_paint)))
+    start = time.perf_counter()
+    at.button[0].click()
+    at.run()
+    first_generation = time.perf_counter() - start
+    if at.exception or at.error:
+        raise RuntimeError((at.exception or at.error)[0].value)
+    print(json.dumps({"first_paint": first_paint, "first_generation": first_generation}))
+
+def run_child(env, args, label):
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_startup", "--child", label,
+         "--think-time", str(args.think_time), "--timeout", str(args.timeout)],
+        cwd=APP_DIR, env=env, capture_output=True, text=True, timeout=args.timeout * 2
+    )
+    if output.returncode:
+        raise RuntimeError(output.stderr.strip().splitlines()[-1] if output.stderr.strip() else "child failed")
+    if os.environ.get("STARTUP_PROFILE"):
+        print("\n".join(line for line in output.stderr.splitlines() if line.startswith(("Startup", "  "))))
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Fresh processes per variant")
+    parser.add_argument("--provider", default="gemini", help="Provider used for the first generation")
+    parser.add_argument("--think-time", type=float, default=1.5,
+                        help="Seconds between the first paint and clicking Generate")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake provider latency in seconds")
+    parser.add_argument("--first-paint-budget", type=float, default=2.0, help="Seconds")
+    parser.add_argument("--first-generation-budget", type=float, default=1.5, help="Seconds")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(args.child, args.think_time, args.timeout)
+        return
+
+    from metrics import percentile
+    from providers import provider_label
+
+    server = start_fake_server(latency=args.latency, chunk_delay=0.01)
+    label = provider_label(args.provider)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for variant, warmup in (("warm-up on", "1"), ("warm-up off", "0")):
+            runs = []
+            for i in range(args.runs):
+                env = dict(
+                    os.environ,
+                    **fake_provider_env(server),
+                    LLM_WARMUP=warmup,
+                    # Fresh cache and feedback index so every run really generates
+                    LLM_CACHE_PATH=os.path.join(tmp, f"cache-{variant}-{i}.sqlite3"),
+                    FEEDBACK_INDEX_DIR=os.path.join(tmp, f"index-{variant}-{i}"),
+                    LLM_METRICS_FILE="",
+                    PYTHONPATH=APP_DIR
+                )
+                runs.append(run_child(env, args, label))
+            results[variant] = runs
+
+    print(f"First paint and first generation ({label}, {args.runs} fresh processes each, "
+          f"{args.think_time}s think time, {args.latency}s fake latency):")
+    print(f"  {'':<14} {'paint p50':>10} {'paint max':>10} {'gen p50':>10} {'gen max':>10}")
+    for variant, runs in results.items():
+        paints = [run["first_paint"] for run in runs]
+        generations = [run["first_generation"] for run in runs]
+        print(f"  {variant:<14} {percentile(paints, 0.5) * 1000:>8.0f}ms {max(paints) * 1000:>8.0f}ms "
+              f"{percentile(generations, 0.5) * 1000:>8.0f}ms {max(generations) * 1000:>8.0f}ms")
+
+    runs = results["warm-up on"]
+    over_budget = []
+    for name, budget in (("first_paint", args.first_paint_budget), ("first_generation", args.first_generation_budget)):
+        p50 = percentile([run[name] for run in runs], 0.5)
+        if p50 > budget:
+            over_budget.append(f"{name.replace('_', ' ')} p50 {p50:.2f}s is over its {budget:.2f}s budget")
+    for message in over_budget:
+        print(f"Over budget: {message}")
+    if over_budget:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
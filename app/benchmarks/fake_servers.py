@@ -0,0 +1,318 @@
+"""
+Local stand-in servers for the LLM provider HTTP APIs.
+
+A single threaded HTTP server answers the Gemini ``generateContent`` and
+``streamGenerateContent`` (SSE), Together (OpenAI-style)
+``/v1/chat/completions`` (JSON or SSE) and Ollama ``/api/chat`` (JSON or
+NDJSON) endpoints with canned completions, so the real SDK clients can be
+exercised without API keys or network access. Point the SDKs at it with
+``fake_provider_env(server)``.
+
+Behaviour is set by attributes on the server, which can be changed while it
+runs:
+
+- ``latency``: seconds before the response headers are sent,
+- ``chunk_delay``: seconds between streamed chunks,
+- ``chunks``: how many chunks a streamed completion is split into,
+- ``error_rate``: fraction of requests answered with ``error_status``
+  (and a ``Retry-After`` header if ``retry_after`` is set),
+- ``load_time``: seconds the Ollama endpoint takes to "load the model" when
+  it is not loaded, i.e. on the first request, after its ``keep_alive`` has
+  expired or when ``num_ctx`` changes, as the real server does.
+
+Run it standalone to point the app at it by hand:
+    python -m benchmarks.fake_servers --port 8765 --latency 0.5 --chunk-delay 0.05
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKE_COMPLETION = (
+    "Your problem statement is clear and well motivated, and the success measures are "
+    "justified in business terms. The analysis would benefit from a deeper explanation "
+    "of the correlation results."
+)
+
+def split_completion(text, chunks):
+    """
+    Split `text` into about `chunks` pieces on word boundaries.
+    """
+    words = text.split(" ")
+    size = max(1, -(-len(words) // max(1, chunks)))
+    pieces = [" ".join(words[i:i + size]) for i in range(0, len(words), size)]
+    return [piece if i == 0 else " " + piece for i, piece in enumerate(pieces)]
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep connections alive between requests
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, content_type, events):
+        """
+        Send each encoded event as its own HTTP chunk, `chunk_delay` apart.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, event in enumerate(events):
+            if i and self.server.chunk_delay:
+                time.sleep(self.server.chunk_delay)
+            self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _send_error(self, path):
+        status = self.server.error_status
+        headers = {"Retry-After": str(self.server.retry_after)} if self.server.retry_after else None
+        message = f"injected error {status}"
+        if path == "/api/chat":
+            payload = {"error": message}
+        elif path.endswith("/chat/completions"):
+            payload = {"error": {"message": message, "type": "server_error", "code": status}}
+        else:
+            payload = {"error": {"code": status, "message": message, "status": "UNAVAILABLE"}}
+        self._send_json(payload, status=status, headers=headers)
+
+    def _inject_error(self):
+        with self.server.lock:
+            self.server.requests += 1
+            if self.server.error_rate and self.server.random.random() < self.server.error_rate:
+                self.server.errors += 1
+                return True
+        return False
+
+    def _ollama_load(self, request):
+        """
+        Simulate Ollama loading the model. Returns the load time in seconds.
+        """
+        now = time.monotonic()
+        num_ctx = (request.get("options") or {}).get("num_ctx")
+        keep_alive = request.get("keep_alive", "5m")
+        if isinstance(keep_alive, str):
+            units = {"s": 1, "m": 60, "h": 3600}
+            keep_alive = float(keep_alive[:-1]) * units[keep_alive[-1]] if keep_alive[-1] in units else float(keep_alive)
+        with self.server.lock:
+            model = self.server.ollama_model
+            load = 0.0
+            if model is None or model["until"] < now or model["num_ctx"] != num_ctx:
+                load = self.server.load_time
+            until = float("inf") if keep_alive < 0 else now + load + keep_alive
+            self.server.ollama_model = {"until": until, "num_ctx": num_ctx}
+        time.sleep(load)
+        return load
+
+    def do_POST(self):
+        request = self._read_json()
+        time.sleep(self.server.latency)
+        path = self.path.split("?")[0]
+        prompt_tokens = len(json.dumps(request)) // 4
+        output_tokens = len(FAKE_COMPLETION) // 4
+        pieces = split_completion(FAKE_COMPLETION, self.server.chunks)
+        if path.endswith("/cachedContents"):
+            # Gemini explicit context cache registration
+            with self.server.lock:
+                self.server.cached_contents += 1
+                name = f"cachedContents/fake-{self.server.cached_contents}"
+            self._send_json({
+                "name": name,
+                "model": request.get("model", "fake"),
+                "expireTime": "2099-01-01T00:00:00Z",
+            })
+        elif self._inject_error():
+            self._send_error(path)
+        elif path.endswith(":generateContent"):
+            self._send_json(self._gemini_response(FAKE_COMPLETION, prompt_tokens, output_tokens))
+        elif path.endswith(":streamGenerateContent"):
+            events = []
+            for i, piece in enumerate(pieces):
+                payload = self._gemini_response(piece, prompt_tokens, output_tokens * (i + 1) // len(pieces))
+                events.append(f"data: {json.dumps(payload)}\r\n\r\n".encode())
+            self._send_stream("text/event-stream", events)
+        elif path.endswith("/chat/completions") and request.get("stream"):
+            created = int(time.time())
+            events = []
+            for i, piece in enumerate(pieces):
+                last = i == len(pieces) - 1
+                payload = {
+                    "id": "fake-1",
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": request.get("model", "fake"),
+                    "choices": [{
+                        "index": 0,
+                        "delta": {"role": "assistant", "content": piece},
+                        "finish_reason": "stop" if last else None,
+                    }],
+                }
+                if last:
+                    payload["usage"] = self._openai_usage(prompt_tokens, output_tokens)
+                events.append(f"data: {json.dumps(payload)}\n\n".encode())
+            events.append(b"data: [DONE]\n\n")
+            self._send_stream("text/event-stream", events)
+        elif path.endswith("/chat/completions"):
+            self._send_json({
+                "id": "fake-1",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": FAKE_COMPLETION},
+                    "finish_reason": "stop",
+                }],
+                "usage": self._openai_usage(prompt_tokens, output_tokens),
+            })
+        elif path == "/api/chat" and not request.get("messages"):
+            # An empty chat only loads the model
+            response = self._ollama_response(request, "", done=True)
+            response.update(done_reason="load", load_duration=int(self._ollama_load(request) * 1e9))
+            self._send_json(response)
+        elif path == "/api/chat" and request.get("stream", True):
+            load = self._ollama_load(request)
+            events = []
+            for piece in pieces:
+                events.append(json.dumps(self._ollama_response(request, piece, done=False)).encode() + b"\n")
+            final = self._ollama_response(request, "", done=True)
+            final.update(self._ollama_usage(prompt_tokens, output_tokens, load))
+            events.append(json.dumps(final).encode() + b"\n")
+            self._send_stream("application/x-ndjson", events)
+        elif path == "/api/chat":
+            load = self._ollama_load(request)
+            response = self._ollama_response(request, FAKE_COMPLETION, done=True)
+            response.update(self._ollama_usage(prompt_tokens, output_tokens, load))
+            self._send_json(response)
+        else:
+            self._send_json({"error": f"unknown path {path}"}, status=404)
+
+    @staticmethod
+    def _gemini_response(text, prompt_tokens, output_tokens):
+        return {
+            "candidates": [{
+                "content": {"role": "model", "parts": [{"text": text}]},
+                "finishReason": "STOP",
+            }],
+            "usageMetadata": {
+                "promptTokenCount": prompt_tokens,
+                "candidatesTokenCount": output_tokens,
+                "totalTokenCount": prompt_tokens + output_tokens,
+            },
+        }
+
+    @staticmethod
+    def _openai_usage(prompt_tokens, output_tokens):
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": output_tokens,
+            "total_tokens": prompt_tokens + output_tokens,
+        }
+
+    @staticmethod
+    def _ollama_response(request, text, done):
+        response = {
+            "model": request.get("model", "fake"),
+            "created_at": "2025-01-01T00:00:00Z",
+            "message": {"role": "assistant", "content": text},
+            "done": done,
+        }
+        if done:
+            response["done_reason"] = "stop"
+        return response
+
+    def _ollama_usage(self, prompt_tokens, output_tokens, load):
+        # Durations are in nanoseconds, as reported by Ollama
+        return {
+            "prompt_eval_count": prompt_tokens,
+            "eval_count": output_tokens,
+            "load_duration": int(load * 1e9),
+            "total_duration": int((load + self.server.latency + self.server.chunk_delay * self.server.chunks) * 1e9),
+        }
+
+def start_fake_server(latency=0.0, port=0, chunk_delay=0.0, chunks=8, error_rate=0.0,
+                      error_status=503, retry_after=None, load_time=0.0, seed=0):
+    """
+    Start the fake server on a background thread and return it.
+    `latency` is the delay in seconds added to every response; see the module
+    docstring for the other settings. `seed` makes error injection repeatable.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeLLMHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.chunk_delay = chunk_delay
+    server.chunks = chunks
+    server.error_rate = error_rate
+    server.error_status = error_status
+    server.retry_after = retry_after
+    server.load_time = load_time
+    server.ollama_model = None
+    server.random = random.Random(seed)
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.errors = 0
+    server.cached_contents = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def server_url(server):
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
+
+def fake_provider_env(server):
+    """
+    Environment variables that point all three provider SDKs at `server`.
+    """
+    url = server_url(server)
+    return {
+        "GEMINI_API_KEY": "fake-key",
+        "GOOGLE_GEMINI_BASE_URL": url,
+        "TOGETHER_API_KEY": "fake-key",
+        "TOGETHER_BASE_URL": f"{url}/v1",
+        "OLLAMA_HOST": url,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the fake LLM provider server.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds before each response starts")
+    parser.add_argument("--chunk-delay", type=float, default=0.05, help="Seconds between streamed chunks")
+    parser.add_argument("--chunks", type=int, default=8, help="Chunks per streamed completion")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--load-time", type=float, default=0.0, help="Seconds to load the Ollama model when cold")
+    args = parser.parse_args(argv)
+
+    server = start_fake_server(
+        latency=args.latency, port=args.port, chunk_delay=args.chunk_delay, chunks=args.chunks,
+        error_rate=args.error_rate, error_status=args.error_status, load_time=args.load_time
+    )
+    print(f"Fake LLM server on {server_url(server)}. Point the app at it with:")
+    for name, value in fake_provider_env(server).items():
+        print(f"  export {name}={value}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+"""
+Multi-user load test: concurrent marking sessions against a running app.py.
+
+Starts the local fake provider server (see ``fake_servers.py``) and a real
+``streamlit run app.py`` server pointed at it, then, for each session count
+N, connects N simulated browsers over Streamlit's websocket and lets them
+mark at the same time. Each session marks a submission the way a marker
+would: for a random share of the parts in ``marking_criteria.md`` it ticks
+the pass or (less often) the fail criterion, types a comment on fails, fills
+in the free-text fields and clicks Generate, then changes a few selections
+and generates again (``--generations``). A session that ticked nothing does
+not click Generate, since the app would only ask for a selection. Ticking and typing rerun only the
+part's fragment, as in the browser. Prompts differ between sessions and the
+cache is bypassed, so every click reaches the provider.
+
+For each N it reports page load, rerun and generation latency percentiles,
+generations per second, errors and the growth of the server's resident
+memory per session, and then the saturation point: the session count after
+which adding sessions no longer raises throughput by ``--min-gain``, or where
+the p95 generation latency first exceeds ``--slo``.
+
+The driver speaks the websocket protocol of the installed Streamlit version
+(its ``streamlit.proto`` messages, with the ``websockets`` package Streamlit
+depends on). AppTest cannot be used here because it swaps process-wide
+Streamlit state on every run, so sessions cannot run concurrently.
+
+Usage (from the app directory):
+    python -m benchmarks.load_test --sessions 1 2 4 8 16 --latency 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.fake_servers import start_fake_server, fake_provider_env
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMENTS = (
+    "The chart is missing axis labels.",
+    "Only the summary statistics are shown, without any interpretation.",
+    "The recommendation does not follow from the analysis.",
+    "Good start, but the assumptions are not stated.",
+    "The code runs but the output is not explained.",
+)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def rss_bytes(pid):
+    """
+    Resident memory of process `pid`, or None where /proc is not available.
+    """
+    try:
+        with open(f"/proc/{pid}/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+def start_app_server(port, env, log_path, timeout=60):
+    """
+    Run ``streamlit run app.py`` on `port` and wait until it is healthy.
+    """
+    log = open(log_path, 'w')
+    process = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", "app.py",
+         "--server.headless", "true",
+         "--server.port", str(port),
+         "--server.enableXsrfProtection", "false",
+         "--server.fileWatcherType", "none",
+         "--browser.gatherUsageStats", "false"],
+        cwd=APP_DIR, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1) as response:
+                if response.status == 200:
+                    return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    with open(log_path) as file:
+        raise RuntimeError(f"Streamlit server did not start:\n{file.read()[-2000:]}")
+
+def marking_plan(index, rng, coverage):
+    """
+    (criterion id, comment) pairs for one submission: for about `coverage` of
+    the parts, the pass criterion, or a fail criterion with a comment.
+    """
+    by_part = {}
+    for criterion in index["criteria"].values():
+        by_part.setdefault(criterion["parent_id"], {}).setdefault(criterion["type"], []).append(criterion["id"])
+    plan = []
+    for kinds in by_part.values():
+        if rng.random() > coverage:
+            continue
+        if kinds.get("fail") and (rng.random() < 0.25 or not kinds.get("pass")):
+            plan.append((rng.choice(kinds["fail"]), rng.choice(COMMENTS)))
+        elif kinds.get("pass"):
+            plan.append((rng.choice(kinds["pass"]), ""))
+    return plan
+
+class BrowserSession:
+    """
+    One simulated browser tab: keeps the widgets the server has sent and their
+    values, and sends reruns over the websocket like the Streamlit frontend.
+    """
+
+    def __init__(self, number, args, index, url):
+        self.rng = random.Random(args.seed * 1000 + number)
+        self.number = number
+        self.args = args
+        self.index = index
+        self.url = url
+        # Widget key (or label for widgets without one) -> (widget id, fragment id)
+        self.widgets = {}
+        # Widget id -> (value field, value) of every widget this session has set
+        self.values = {}
+        self.load_times = []
+        self.rerun_times = []
+        self.generation_times = []
+        # Generate clicks left out because no criterion was ticked
+        self.skipped_generations = 0
+        self.errors = []
+
+    def _collect(self, message):
+        delta = message.delta
+        if delta.WhichOneof("type") != "new_element":
+            return
+        element = delta.new_element
+        kind = element.WhichOneof("type")
+        if kind in ("checkbox", "text_area", "selectbox", "button"):
+            widget = getattr(element, kind)
+            # Ids end with "-<key>", or "-None" for widgets without a key
+            key = widget.id.rsplit("-", 1)[-1]
+            self.widgets[widget.label if key == "None" else key] = (widget.id, delta.fragment_id)
+        elif kind == "exception":
+            self.errors.append(f"{element.exception.type}: {element.exception.message}")
+        elif kind == "alert" and element.alert.format == element.alert.ERROR:
+            self.errors.append(element.alert.body)
+
+    async def _rerun(self, timings, fragment_id="", trigger=None):
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        message = BackMsg()
+        state = message.rerun_script
+        state.query_string = ""
+        state.page_script_hash = ""
+        state.fragment_id = fragment_id
+        for widget_id, (field, value) in self.values.items():
+            widget = state.widget_states.widgets.add()
+            widget.id = widget_id
+            setattr(widget, field, value)
+        if trigger is not None:
+            widget = state.widget_states.widgets.add()
+            widget.id = trigger
+            widget.trigger_value = True
+        start = time.perf_counter()
+        await self.ws.send(message.SerializeToString())
+        while True:
+            reply = ForwardMsg()
+            reply.ParseFromString(await self.ws.recv())
+            kind = reply.WhichOneof("type")
+            if kind == "delta":
+                self._collect(reply)
+            elif kind == "script_finished":
+                if reply.script_finished == ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    continue
+                break
+        timings.append(time.perf_counter() - start)
+
+    async def _set(self, name, field, value, timings):
+        widget_id, fragment_id = self.widgets[name]
+        self.values[widget_id] = (field, value)
+        await self._rerun(timings, fragment_id)
+
+    async def _think(self):
+        if self.args.think_time:
+            await asyncio.sleep(self.rng.uniform(0, 2 * self.args.think_time))
+
+    async def _tick(self, criteria_id, comment):
+        await self._set(f"check_{criteria_id}", "bool_value", True, self.rerun_times)
+        if comment:
+            await self._set(f"comment_{criteria_id}", "string_value", f"{comment} (session {self.number})",
+                            self.rerun_times)
+
+    async def run(self):
+        import websockets
+
+        try:
+            async with websockets.connect(self.url, subprotocols=["streamlit"], max_size=None) as self.ws:
+                await self._rerun(self.load_times)
+                if self.args.provider_label != self.args.default_label:
+                    await self._set("Choose LLM", "string_value", self.args.provider_label, self.rerun_times)
+                await self._set("Bypass cache / regenerate", "bool_value", True, self.rerun_times)
+                ticked = []
+                for criteria_id, comment in marking_plan(self.index, self.rng, self.args.coverage):
+                    await self._think()
+                    await self._tick(criteria_id, comment)
+                    ticked.append(criteria_id)
+                await self._set("failing_feedback", "string_value",
+                                f"Session {self.number}: {self.rng.choice(COMMENTS)}", self.rerun_times)
+                for generation in range(self.args.generations):
+                    if generation:
+                        # Revise the marking: untick one criterion and tick another
+                        if ticked:
+                            criteria_id = ticked.pop(self.rng.randrange(len(ticked)))
+                            await self._set(f"check_{criteria_id}", "bool_value", False, self.rerun_times)
+                        unticked = [c for c in self.index["criteria"] if c not in ticked]
+                        if unticked:
+                            criteria_id = self.rng.choice(unticked)
+                            await self._tick(criteria_id, self.rng.choice(COMMENTS))
+                            ticked.append(criteria_id)
+                    if not ticked:
+                        # The app would only ask for a selection, which is not load on the server
+                        self.skipped_generations += 1
+                        continue
+                    await self._think()
+                    widget_id, _ = self.widgets["Generate Feedback"]
+                    await self._rerun(self.generation_times, trigger=widget_id)
+        except Exception as e:
+            self.errors.append(f"{type(e).__name__}: {e}")
+
+async def run_sessions(sessions, server_pid):
+    """
+    Run every session at once; returns (wall time, server memory growth in bytes).
+    """
+    memory_before = rss_bytes(server_pid)
+    start = time.perf_counter()
+    await asyncio.gather(*(session.run() for session in sessions))
+    wall_time = time.perf_counter() - start
+    memory_after = rss_bytes(server_pid)
+    growth = memory_after - memory_before if memory_before is not None and memory_after is not None else None
+    return wall_time, growth
+
+def run_level(count, args, index, url, server_pid):
+    """
+    Run `count` sessions at once and summarize them.
+    """
+    from metrics import percentile
+
+    sessions = [BrowserSession(number, args, index, url) for number in range(count)]
+    wall_time, memory_growth = asyncio.run(run_sessions(sessions, server_pid))
+
+    loads = [t for session in sessions for t in session.load_times]
+    reruns = [t for session in sessions for t in session.rerun_times]
+    generations = [t for session in sessions for t in session.generation_times]
+    errors = [error for session in sessions for error in session.errors]
+
+    def ms(values, q):
+        return round(percentile(values, q) * 1000, 1) if values else None
+
+    return {
+        "sessions": count,
+        "wall_s": round(wall_time, 3),
+        "load_p50_ms": ms(loads, 0.5),
+        "load_p95_ms": ms(loads, 0.95),
+        "reruns": len(reruns),
+        "rerun_p50_ms": ms(reruns, 0.5),
+        "rerun_p95_ms": ms(reruns, 0.95),
+        "rerun_p99_ms": ms(reruns, 0.99),
+        "generations": len(generations),
+        "skipped_generations": sum(session.skipped_generations for session in sessions),
+        "generation_p50_ms": ms(generations, 0.5),
+        "generation_p95_ms": ms(generations, 0.95),
+        "generation_p99_ms": ms(generations, 0.99),
+        "generations_per_s": round(len(generations) / wall_time, 3) if wall_time else None,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "memory_per_session_mib": round(memory_growth / count / 2**20, 2) if memory_growth is not None else None,
+    }
+
+def cell(value, width, unit=""):
+    # A table cell, "-" where nothing was measured
+    return f"{'-' if value is None else f'{value}{unit}':>{width}}"
+
+def saturation_point(levels, min_gain, slo):
+    """
+    (session count, reason) where the app saturates, or (None, None) if it did not.
+    """
+    for previous, level in zip([None] + levels, levels):
+        if not level["generations"] and not level["errors"]:
+            # Nothing was ticked, so nothing was measured
+            continue
+        p95 = level["generation_p95_ms"]
+        if level["errors"]:
+            return level["sessions"], f"{level['errors']} errors"
+        if p95 is not None and p95 > slo * 1000:
+            return level["sessions"], f"p95 generation {p95 / 1000:.2f}s is over the {slo:.1f}s SLO"
+        if previous is not None and previous["generations_per_s"]:
+            gain = level["generations_per_s"] / previous["generations_per_s"] - 1
+            if gain < min_gain:
+                return previous["sessions"], (
+                    f"going to {level['sessions']} sessions raised throughput by only {gain:.0%}"
+                )
+    return None, None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="Concurrent session counts")
+    parser.add_argument("--generations", type=int, default=2, help="Generate clicks per session")
+    parser.add_argument("--coverage", type=float, default=0.6, help="Share of rubric parts each session marks")
+    parser.add_argument("--think-time", type=float, default=0.0,
+                        help="Mean seconds between a session's actions (0 for maximum load)")
+    parser.add_argument("--provider", default="gemini", help="Provider key selected in every session")
+    parser.add_argument("--latency", type=float, default=0.5, help="Fake provider seconds before each response")
+    parser.add_argument("--chunk-delay", type=float, default=0.05, help="Fake provider seconds between chunks")
+    parser.add_argument("--min-gain", type=float, default=0.1,
+                        help="Throughput gain below which adding sessions counts as saturated")
+    parser.add_argument("--slo", type=float, default=10.0, help="p95 generation latency limit in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    from providers import provider_keys, provider_label
+    from rubric import load_rubric_index
+
+    args.provider_label = provider_label(args.provider)
+    args.default_label = provider_label(provider_keys()[0])
+    index = load_rubric_index(os.path.join(APP_DIR, "marking_criteria.md"))
+
+    fake_server = start_fake_server(latency=args.latency, chunk_delay=args.chunk_delay)
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            **fake_provider_env(fake_server),
+            # A fresh cache and feedback index, and no metrics file, so earlier runs do not interfere
+            LLM_CACHE_PATH=os.path.join(tmp, "cache.sqlite3"),
+            FEEDBACK_INDEX_DIR=os.path.join(tmp, "feedback_index"),
+            LLM_METRICS_FILE="",
+            OLLAMA_PRELOAD="0"
+        )
+        port = free_port()
+        server = start_app_server(port, env, os.path.join(tmp, "streamlit.log"))
+        url = f"ws://127.0.0.1:{port}/_stcore/stream"
+        levels = []
+        try:
+            print(f"{len(index['criteria'])} criteria in {len(index['parts'])} parts; provider {args.provider_label}, "
+                  f"fake latency {args.latency}s, think time {args.think_time}s")
+            print(f"{'sessions':>8} {'load p50':>9} {'rerun p50':>10} {'rerun p95':>10} {'gen p50':>9} "
+                  f"{'gen p95':>9} {'gen p99':>9} {'gen/s':>7} {'errors':>7} {'MiB/session':>12}")
+            # One session first, unreported, so SDK imports, client set-up and
+            # the first script compile do not count against the smallest level
+            run_level(1, args, index, url, server.pid)
+            for count in args.sessions:
+                level = run_level(count, args, index, url, server.pid)
+                levels.append(level)
+                print(f"{count:>8} {cell(level['load_p50_ms'], 9, 'ms')} {cell(level['rerun_p50_ms'], 10, 'ms')} "
+                      f"{cell(level['rerun_p95_ms'], 10, 'ms')} {cell(level['generation_p50_ms'], 9, 'ms')} "
+                      f"{cell(level['generation_p95_ms'], 9, 'ms')} {cell(level['generation_p99_ms'], 9, 'ms')} "
+                      f"{cell(level['generations_per_s'], 7)} {level['errors']:>7} "
+                      f"{cell(level['memory_per_session_mib'], 12)}")
+                if level["skipped_generations"]:
+                    print(f"         {level['skipped_generations']} Generate clicks skipped with no criteria ticked")
+                if level["first_error"]:
+                    print(f"         first error: {level['first_error']}")
+        finally:
+            server.terminate()
+            server.wait(timeout=10)
+
+    sessions, reason = saturation_point(levels, args.min_gain, args.slo)
+    if not any(level["generations"] for level in levels):
+        print("No session ticked any criteria, so nothing was generated; raise --coverage.")
+    elif sessions is None:
+        print(f"Not saturated up to {args.sessions[-1]} sessions.")
+    else:
+        print(f"Saturation at about {sessions} sessions: {reason}.")
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({"levels": levels, "saturation": {"sessions": sessions, "reason": reason}}, file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+"""
+Offline end-to-end benchmark suite.
+
+Starts the fake provider server (see ``fake_servers.py``) and measures:
+
+- ``construct_prompt`` on the real rubric and feedback examples,
+- every ``run_*`` and ``stream_*`` function in ``llm_inference.py`` through
+  the real SDK clients, with a configurable number of concurrent callers,
+- the ``arun_*`` functions with the same concurrency on one event loop,
+- the Streamlit flow through AppTest: first load, rerun after ticking a
+  criterion, and generating feedback with each provider.
+
+Each benchmark reports throughput, p50/p95/p99 latency (and time to first
+chunk for streams) and the peak memory allocated by one pass, measured
+separately with tracemalloc so it does not slow down the timed runs.
+
+Results are written as JSON keyed by the git commit, so two runs can be
+compared. ``--compare`` prints the change against an earlier result and
+exits with status 1 if anything got slower, or used more memory, by more than
+``--tolerance``.
+
+Usage (from the app directory):
+    python -m benchmarks.run_suite --requests 50 --concurrency 4
+    python -m benchmarks.run_suite --compare benchmarks/results/<commit>.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fake_servers import start_fake_server, fake_provider_env
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(APP_DIR, "benchmarks", "results")
+
+# Metrics where a larger value is an improvement; for everything else smaller is better
+HIGHER_IS_BETTER = {"throughput_per_s"}
+COMPARED_METRICS = ("throughput_per_s", "p50_ms", "p95_ms", "p99_ms", "ttft_p50_ms", "ttft_p95_ms", "peak_kib")
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=APP_DIR,
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, dirty
+
+def summarize(latencies, wall_time, errors=0, ttfts=None):
+    from metrics import percentile
+
+    result = {
+        "count": len(latencies) + errors,
+        "errors": errors,
+        "throughput_per_s": round(len(latencies) / wall_time, 2) if wall_time else None,
+    }
+    for q in (0.5, 0.95, 0.99):
+        value = percentile(latencies, q)
+        result[f"p{int(q * 100)}_ms"] = None if value is None else round(value * 1000, 3)
+    if ttfts is not None:
+        for q in (0.5, 0.95):
+            value = percentile(ttfts, q)
+            result[f"ttft_p{int(q * 100)}_ms"] = None if value is None else round(value * 1000, 3)
+    return result
+
+def peak_memory(fn, repeat=1):
+    """
+    Peak memory in KiB allocated while calling `fn` `repeat` times.
+    """
+    tracemalloc.start()
+    try:
+        for _ in range(repeat):
+            fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024, 1)
+
+def timed_call(fn, streaming):
+    """
+    Call `fn` once. Returns (latency, time to first chunk or None, failed).
+    """
+    from llm_inference import LLMError
+
+    start = time.perf_counter()
+    first = None
+    try:
+        if streaming:
+            for _ in fn():
+                if first is None:
+                    first = time.perf_counter() - start
+        else:
+            fn()
+    except LLMError:
+        return None, None, True
+    return time.perf_counter() - start, first, False
+
+def bench_calls(fn, requests, concurrency, streaming):
+    """
+    Run `requests` calls of `fn` from `concurrency` threads.
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(lambda _: timed_call(fn, streaming), range(requests)))
+    wall_time = time.perf_counter() - start
+    latencies = [latency for latency, _, failed in outcomes if not failed]
+    ttfts = [first for _, first, failed in outcomes if not failed and first is not None]
+    errors = sum(1 for _, _, failed in outcomes if failed)
+    return summarize(latencies, wall_time, errors, ttfts if streaming else None)
+
+def prompt_fixture():
+    """
+    Arguments for construct_prompt: a quarter of the real rubric's criteria, with comments.
+    """
+    from prompt_builder import load_feedback_examples
+    from rubric import load_rubric_index, build_selected_criteria
+
+    index = load_rubric_index(os.path.join(APP_DIR, "marking_criteria.md"))
+    selections = {criterion_id: f"Comment {i}" for i, criterion_id in enumerate(list(index["criteria"])[::4])}
+    selected_criteria = build_selected_criteria(index, selections)
+    feedback_examples = load_feedback_examples(os.path.join(APP_DIR, "feedback_examples.md"))
+    return selected_criteria, "Missing the correlation matrix.", "Please check the chart labels.", feedback_examples
+
+def bench_prompt(iterations):
+    from prompt_builder import construct_prompt, construct_prompt_parts
+
+    args = prompt_fixture()
+    results = {}
+    for name, fn in (("construct_prompt", construct_prompt), ("construct_prompt_parts", construct_prompt_parts)):
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(iterations):
+            call_start = time.perf_counter()
+            fn(*args)
+            latencies.append(time.perf_counter() - call_start)
+        result = summarize(latencies, time.perf_counter() - start)
+        result["peak_kib"] = peak_memory(lambda: fn(*args))
+        results[name] = result
+    return results
+
+def bench_providers(requests, concurrency):
+    import llm_inference
+    from prompt_builder import construct_prompt_parts
+
+    prefix, suffix = construct_prompt_parts(*prompt_fixture())
+    results = {}
+    for name in ("run_gemini_flash", "run_deepseek_r1_together", "run_ollama_gpt_oss",
+                 "stream_gemini_flash", "stream_deepseek_r1_together", "stream_ollama_gpt_oss"):
+        provider_fn = getattr(llm_inference, name)
+        streaming = name.startswith("stream_")
+        fn = lambda: provider_fn(suffix, prefix=prefix)
+        timed_call(fn, streaming)  # warm up the client and its connections
+        result = bench_calls(fn, requests, concurrency, streaming)
+        result["peak_kib"] = peak_memory(lambda: timed_call(fn, streaming), repeat=min(requests, 10))
+        results[name] = result
+    return results
+
+def bench_async(requests, concurrency):
+    import asyncio
+    import llm_inference
+    from prompt_builder import construct_prompt_parts
+
+    prefix, suffix = construct_prompt_parts(*prompt_fixture())
+
+    async def timed(fn, semaphore):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await fn(suffix, prefix=prefix)
+            except llm_inference.LLMError:
+                return None
+            return time.perf_counter() - start
+
+    async def run(fn):
+        semaphore = asyncio.Semaphore(concurrency)
+        await timed(fn, semaphore)  # warm up the client and its connections
+        start = time.perf_counter()
+        outcomes = await asyncio.gather(*(timed(fn, semaphore) for _ in range(requests)))
+        wall_time = time.perf_counter() - start
+        await llm_inference.aclose_async_clients()
+        latencies = [latency for latency in outcomes if latency is not None]
+        return summarize(latencies, wall_time, len(outcomes) - len(latencies))
+
+    results = {}
+    for name in ("arun_gemini_flash", "arun_deepseek_r1_together", "arun_ollama_gpt_oss"):
+        fn = getattr(llm_inference, name)
+        results[name] = asyncio.run(run(fn))
+        results[name]["peak_kib"] = peak_memory(
+            lambda: llm_inference.run_prompts(fn, [suffix] * min(requests, 10), prefix=prefix, limit=concurrency)
+        )
+    return results
+
+def bench_app(runs, toggles, timeout):
+    from streamlit.testing.v1 import AppTest
+    from providers import PROVIDERS
+
+    app_path = os.path.join(APP_DIR, "app.py")
+    results = {}
+
+    def first_run():
+        at = AppTest.from_file(app_path, default_timeout=timeout)
+        at.run()
+        return at
+
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        first_run()
+        latencies.append(time.perf_counter() - start)
+    results["app_first_run"] = summarize(latencies, sum(latencies))
+    results["app_first_run"]["peak_kib"] = peak_memory(first_run)
+
+    at = first_run()
+    checkbox_keys = [cb.key for cb in at.checkbox if cb.key and cb.key.startswith("check_")]
+    latencies = []
+    for key in checkbox_keys[:toggles]:
+        at.checkbox(key=key).check()
+        start = time.perf_counter()
+        at.run()
+        latencies.append(time.perf_counter() - start)
+    results["app_rerun_toggle"] = summarize(latencies, sum(latencies))
+
+    # Bypass the response cache so every click reaches the (fake) provider
+    next(cb for cb in at.checkbox if cb.label.startswith("Bypass cache")).check()
+    for provider, config in PROVIDERS.items():
+        label = config["label"]
+        at.selectbox[0].set_value(label)
+        at.run()
+        def generate():
+            at.button[0].click()
+            at.run()
+            if at.exception or at.error:
+                raise RuntimeError(f"{label}: {(at.exception or at.error)[0].value}")
+        latencies = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            generate()
+            latencies.append(time.perf_counter() - start)
+        result = summarize(latencies, sum(latencies))
+        result["peak_kib"] = peak_memory(generate)
+        results[f"app_generate_{provider}"] = result
+    return results
+
+def compare(results, baseline, tolerance):
+    """
+    Print the change against `baseline` and return the regressions beyond `tolerance`.
+    """
+    regressions = []
+    if baseline.get("config") != results["config"]:
+        print("Warning: the baseline was run with different settings; differences may not be meaningful.")
+    print(f"\nCompared with {baseline.get('commit')} ({'dirty' if baseline.get('dirty') else 'clean'}):")
+    for name, result in results["benchmarks"].items():
+        before = baseline.get("benchmarks", {}).get(name)
+        if before is None:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            flag = ""
+            if worse > tolerance:
+                flag = "  REGRESSION"
+                regressions.append((name, metric, old, new))
+            print(f"  {name:<30} {metric:<17} {old:>11.2f} -> {new:>11.2f} {change:>+8.1%}{flag}")
+    return regressions
+
+def print_results(benchmarks):
+    print(f"{'benchmark':<30} {'count':>6} {'errors':>6} {'per s':>9} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'ttft p50':>9} {'peak KiB':>9}")
+    def cell(value):
+        return f"{value:>9.2f}" if isinstance(value, (int, float)) else f"{'-':>9}"
+    for name, result in benchmarks.items():
+        print(
+            f"{name:<30} {result['count']:>6} {result['errors']:>6} {cell(result.get('throughput_per_s'))} "
+            f"{cell(result.get('p50_ms'))} {cell(result.get('p95_ms'))} {cell(result.get('p99_ms'))} "
+            f"{cell(result.get('ttft_p50_ms'))} {cell(result.get('peak_kib'))}"
+        )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=50, help="Calls per provider function")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent callers per provider function")
+    parser.add_argument("--prompt-iterations", type=int, default=2000)
+    parser.add_argument("--app-runs", type=int, default=5, help="AppTest runs per step (0 to skip the app)")
+    parser.add_argument("--app-toggles", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake server seconds before each response")
+    parser.add_argument("--chunk-delay", type=float, default=0.01, help="Fake server seconds between chunks")
+    parser.add_argument("--chunks", type=int, default=8, help="Chunks per streamed completion")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of fake server requests that fail")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("-o", "--output", help="Results file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before flagging a regression")
+    args = parser.parse_args(argv)
+
+    server = start_fake_server(
+        latency=args.latency, chunk_delay=args.chunk_delay, chunks=args.chunks,
+        error_rate=args.error_rate, error_status=args.error_status
+    )
+    # Set before llm_inference and metrics are imported, since they read it at import time.
+    # Rate limits are lifted so the numbers measure the client stack, not the token buckets.
+    os.environ.update(fake_provider_env(server))
+    os.environ.update({"GEMINI_RPM": "0", "GEMINI_TPM": "0", "TOGETHER_RPM": "0", "TOGETHER_TPM": "0"})
+    os.environ["LLM_METRICS_FILE"] = ""
+    tmp = tempfile.TemporaryDirectory()
+    os.environ["LLM_CACHE_PATH"] = os.path.join(tmp.name, "responses.sqlite3")
+    sys.path.insert(0, APP_DIR)
+
+    commit, dirty = git_revision()
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "compare", "tolerance")}
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "benchmarks": {},
+    }
+    results["benchmarks"].update(bench_prompt(args.prompt_iterations))
+    results["benchmarks"].update(bench_providers(args.requests, args.concurrency))
+    results["benchmarks"].update(bench_async(args.requests, args.concurrency))
+    if args.app_runs:
+        original_cwd = os.getcwd()
+        # The app reads its rubric and examples from the working directory
+        os.chdir(APP_DIR)
+        try:
+            results["benchmarks"].update(bench_app(args.app_runs, args.app_toggles, timeout=120))
+        finally:
+            os.chdir(original_cwd)
+    server.shutdown()
+    tmp.cleanup()
+
+    print_results(results["benchmarks"])
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+import os
+import tempfile
+
+# Keep test runs away from the app's own cache, metrics log and feedback index.
+# Set before any app module is imported, since they read these at import time.
+_tmp = tempfile.mkdtemp(prefix="app-tests-")
+os.environ.setdefault("LLM_CACHE_PATH", os.path.join(_tmp, "llm_cache.sqlite3"))
+os.environ.setdefault("LLM_METRICS_FILE", "")
+os.environ.setdefault("FEEDBACK_INDEX_DIR", os.path.join(_tmp, "feedback_index"))
+os.environ.setdefault("FAKE_LLM_LATENCY", "0")
+os.environ.setdefault("LLM_WARMUP", "0")
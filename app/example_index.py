@@ -0,0 +1,159 @@
+"""
+Feedback example bank with a BM25 relevance index.
+
+The bank is ``feedback_examples.md`` plus every ``*.md`` file in
+``FEEDBACK_EXAMPLES_DIR``, split into one example per ``### `` section. It is
+loaded and indexed once and kept until one of the files changes.
+
+The index is a bag-of-words BM25 model held in flat NumPy arrays: one entry
+per (example, term) pair with its precomputed BM25 weight. Scoring a query is
+a single ``np.isin`` over the entries and a ``np.bincount`` into per-example
+scores, so it stays fast as the bank grows to thousands of examples without
+needing a search library.
+"""
+import glob
+import os
+import re
+import threading
+
+import numpy as np
+
+FEEDBACK_EXAMPLES_FILE = os.environ.get("FEEDBACK_EXAMPLES_FILE", "feedback_examples.md")
+FEEDBACK_EXAMPLES_DIR = os.environ.get("FEEDBACK_EXAMPLES_DIR", "feedback_examples")
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by can could for from has have in into is it its of on or "
+    "so that the their this to was were which while will with would you your".split()
+)
+EXAMPLE_SEPARATOR = "\n\n"
+
+def tokenize(text):
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+# Split a markdown examples file into one example per "### " section
+def split_examples(text):
+    examples = []
+    current = []
+    for line in text.splitlines():
+        if line.startswith("### ") and current:
+            examples.append("\n".join(current).strip())
+            current = []
+        current.append(line)
+    if current:
+        examples.append("\n".join(current).strip())
+    return [example for example in examples if example]
+
+class ExampleIndex:
+    """
+    BM25 index over a list of example texts.
+    """
+
+    def __init__(self, examples):
+        self.size = len(examples)
+        vocabulary = {}
+        doc_ids = []
+        term_ids = []
+        for doc_id, example in enumerate(examples):
+            for token in tokenize(example):
+                term_ids.append(vocabulary.setdefault(token, len(vocabulary)))
+                doc_ids.append(doc_id)
+        self.vocabulary = vocabulary
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        vocabulary_size = max(1, len(vocabulary))
+
+        # One entry per (example, term) with its term frequency
+        pairs, tf = np.unique(doc_ids * vocabulary_size + term_ids, return_counts=True)
+        self.doc_ids = pairs // vocabulary_size
+        self.term_ids = pairs % vocabulary_size
+
+        lengths = np.bincount(doc_ids, minlength=self.size).astype(np.float64)
+        average_length = lengths.mean() if self.size and lengths.mean() > 0 else 1.0
+        df = np.bincount(self.term_ids, minlength=vocabulary_size)
+        idf = np.log1p((self.size - df + 0.5) / (df + 0.5))
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / average_length)
+        self.weights = idf[self.term_ids] * tf * (BM25_K1 + 1) / (tf + norm[self.doc_ids])
+
+    def scores(self, query):
+        """
+        BM25 score of every example for `query`.
+        """
+        terms = [self.vocabulary[token] for token in set(tokenize(query)) if token in self.vocabulary]
+        if not terms:
+            return np.zeros(self.size)
+        mask = np.isin(self.term_ids, terms)
+        return np.bincount(self.doc_ids[mask], weights=self.weights[mask], minlength=self.size)
+
+    def rank(self, query):
+        """
+        Example positions, most relevant first. Ties keep the bank's order.
+        """
+        return np.argsort(-self.scores(query), kind="stable")
+
+class ExampleBank:
+    """
+    The examples, their index and, per provider, each example's token count.
+    `text` is the whole bank as it was sent before examples were selected.
+    """
+
+    def __init__(self, texts):
+        self.text = EXAMPLE_SEPARATOR.join(texts)
+        self.examples = [example for text in texts for example in split_examples(text)]
+        self.index = ExampleIndex(self.examples)
+        self._token_counts = {}
+
+    def token_counts(self, provider, count_tokens):
+        counts = self._token_counts.get(provider)
+        if counts is None:
+            counts = self._token_counts[provider] = [count_tokens(example, provider) for example in self.examples]
+        return counts
+
+    def join(self, positions):
+        """
+        The examples at `positions`, in bank order.
+        """
+        if len(positions) == len(self.examples):
+            return self.text
+        return EXAMPLE_SEPARATOR.join(self.examples[i] for i in sorted(positions))
+
+# --- Cached loading ---
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+def example_sources(file_path=FEEDBACK_EXAMPLES_FILE, directory=FEEDBACK_EXAMPLES_DIR):
+    sources = [file_path] if os.path.isfile(file_path) else []
+    if directory and os.path.isdir(directory):
+        sources += sorted(glob.glob(os.path.join(directory, "*.md")))
+    return sources
+
+def load_example_bank(file_path=FEEDBACK_EXAMPLES_FILE, directory=FEEDBACK_EXAMPLES_DIR):
+    """
+    The example bank for `file_path` and `directory`, rebuilt only when a file
+    is added, removed or changed (by mtime and size).
+    """
+    sources = example_sources(file_path, directory)
+    signature = []
+    for path in sources:
+        stat = os.stat(path)
+        signature.append((os.path.abspath(path), stat.st_mtime_ns, stat.st_size))
+    key = (os.path.abspath(file_path), os.path.abspath(directory) if directory else None)
+    entry = _cache.get(key)
+    if entry is not None and entry[0] == signature:
+        return entry[1]
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+        texts = []
+        for path in sources:
+            with open(path, 'r') as file:
+                texts.append(file.read())
+        bank = ExampleBank(texts)
+        _cache[key] = (signature, bank)
+        return bank
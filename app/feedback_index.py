@@ -0,0 +1,198 @@
+"""
+Similarity index over previously generated feedback.
+
+Every generated feedback is stored with a vector describing the request: the
+ids of the ticked criteria plus the words of the comments and free-text
+fields, hashed into ``VECTOR_DIM`` dimensions and normalised, so the cosine
+similarity of two vectors says how alike two requests are.
+
+Storage is three append-only files in ``FEEDBACK_INDEX_DIR``:
+
+- ``vectors.f32``: one float32 row per record, memory-mapped,
+- ``sketches.u64``: a 128-bit random-hyperplane sketch of each vector,
+- ``records.jsonl``: the feedback text and metadata, one line per record.
+
+A lookup computes the Hamming distance from the query's sketch to every
+stored sketch (16 bytes per record, held in memory), picks the closest
+``CANDIDATES`` with a histogram of the distances instead of a sort, and
+computes the exact cosine for those rows only, read through the memory map.
+This keeps lookups under a millisecond with tens of thousands of records.
+Only one process should write to an index directory.
+"""
+import json
+import os
+import threading
+import time
+import zlib
+
+import numpy as np
+
+FEEDBACK_INDEX_DIR = os.environ.get("FEEDBACK_INDEX_DIR", "feedback_index")
+# Cosine similarity from which a previous feedback is offered for reuse
+FEEDBACK_REUSE_THRESHOLD = float(os.environ.get("FEEDBACK_REUSE_THRESHOLD", "0.9"))
+
+VECTOR_DIM = 512
+SKETCH_BITS = 128
+# Rows whose exact similarity is computed after the sketch comparison
+CANDIDATES = 32
+# Weight of a ticked criterion relative to one word of comment or free text
+CRITERION_WEIGHT = 3.0
+
+_projection = np.random.default_rng(20240601).standard_normal((SKETCH_BITS, VECTOR_DIM)).astype(np.float32)
+SKETCH_WORDS = SKETCH_BITS // 64
+# Set bits per byte, for NumPy versions without np.bitwise_count
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def _bucket(feature):
+    h = zlib.crc32(feature.encode("utf-8"))
+    return h % VECTOR_DIM, 1.0 if h & 0x80000000 else -1.0
+
+def request_vector(selections, failing_feedback="", learner_feedback=""):
+    """
+    Normalised vector for {criterion id: comment} selections and the free-text fields.
+    """
+    vector = np.zeros(VECTOR_DIM, dtype=np.float32)
+    for criteria_id, comment in selections.items():
+        index, sign = _bucket(f"id:{criteria_id}")
+        vector[index] += sign * CRITERION_WEIGHT
+        for word in (comment or "").lower().split():
+            index, sign = _bucket(f"w:{word}")
+            vector[index] += sign
+    for prefix, text in (("f", failing_feedback), ("l", learner_feedback)):
+        for word in (text or "").lower().split():
+            index, sign = _bucket(f"{prefix}:{word}")
+            vector[index] += sign
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def sketch(vectors):
+    """
+    Random-hyperplane sketches of a (n, VECTOR_DIM) array as (n, SKETCH_WORDS) uint64.
+    """
+    return np.packbits(vectors @ _projection.T > 0, axis=-1).view("<u8")
+
+def hamming_distances(columns, query_sketch):
+    """
+    Hamming distance from `query_sketch` to each sketch, with the sketches
+    stored column-wise as (SKETCH_WORDS, n) so each word is one contiguous pass.
+    """
+    distances = None
+    for column, word in zip(columns, query_sketch):
+        diff = np.bitwise_xor(column, word)
+        if hasattr(np, "bitwise_count"):
+            counts = np.bitwise_count(diff)
+        else:
+            counts = _POPCOUNT[diff.view(np.uint8)].reshape(len(diff), 8).sum(axis=1, dtype=np.uint8)
+        # At most SKETCH_BITS in total, so the sum fits in uint8
+        distances = counts if distances is None else distances + counts
+    return distances
+
+def closest(distances, count):
+    """
+    Positions of the `count` smallest distances, in position order. Distances
+    are small integers, so a histogram finds the cut-off without sorting.
+    """
+    if len(distances) <= count:
+        return np.arange(len(distances))
+    cutoff = int(np.searchsorted(np.cumsum(np.bincount(distances)), count))
+    below = np.flatnonzero(distances < cutoff)
+    tied = np.flatnonzero(distances == cutoff)[:count - len(below)]
+    return np.sort(np.concatenate([below, tied]))
+
+class FeedbackIndex:
+    """
+    Append-only store of generated feedback with nearest-neighbour lookup.
+    """
+
+    def __init__(self, directory=FEEDBACK_INDEX_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._sketches_path = os.path.join(directory, "sketches.u64")
+        self._records_path = os.path.join(directory, "records.jsonl")
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        offsets = []
+        # End of the last complete line
+        end = 0
+        if os.path.exists(self._records_path):
+            with open(self._records_path, 'rb') as file:
+                position = 0
+                for line in file:
+                    if line.endswith(b"\n"):
+                        offsets.append(position)
+                        end = position + len(line)
+                    position += len(line)
+        row_bytes = VECTOR_DIM * 4
+        sketch_bytes = SKETCH_WORDS * 8
+        vector_rows = os.path.getsize(self._vectors_path) // row_bytes if os.path.exists(self._vectors_path) else 0
+        sketch_rows = os.path.getsize(self._sketches_path) // sketch_bytes if os.path.exists(self._sketches_path) else 0
+        count = min(len(offsets), vector_rows, sketch_rows)
+        # Drop a partly written last record, e.g. after a crash while appending
+        for path, size in ((self._vectors_path, count * row_bytes), (self._sketches_path, count * sketch_bytes),
+                           (self._records_path, offsets[count] if count < len(offsets) else end)):
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                with open(path, 'r+b') as file:
+                    file.truncate(size)
+        self._offsets = offsets[:count]
+        if count:
+            with open(self._sketches_path, 'rb') as file:
+                rows = np.frombuffer(file.read(), dtype="<u8").reshape(count, SKETCH_WORDS)
+            self._sketches = np.ascontiguousarray(rows.T)
+        else:
+            self._sketches = np.zeros((SKETCH_WORDS, 0), dtype="<u8")
+        self._map_vectors()
+
+    def _map_vectors(self):
+        count = len(self._offsets)
+        self._vectors = (
+            np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(count, VECTOR_DIM))
+            if count else np.zeros((0, VECTOR_DIM), dtype=np.float32)
+        )
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def add(self, vector, feedback, **metadata):
+        """
+        Store `feedback` for the request described by `vector`.
+        `metadata` (provider, model, ...) is kept with the text.
+        """
+        vector = np.asarray(vector, dtype=np.float32).reshape(VECTOR_DIM)
+        line = (json.dumps({"ts": time.time(), "feedback": feedback, **metadata}) + "\n").encode("utf-8")
+        row_sketch = sketch(vector[None, :])
+        with self._lock:
+            with open(self._records_path, 'ab') as file:
+                offset = file.tell()
+                file.write(line)
+            with open(self._vectors_path, 'ab') as file:
+                file.write(vector.tobytes())
+            with open(self._sketches_path, 'ab') as file:
+                file.write(row_sketch.tobytes())
+            self._offsets.append(offset)
+            self._sketches = np.concatenate([self._sketches, row_sketch.T], axis=1)
+            self._map_vectors()
+
+    def nearest(self, vector, threshold=FEEDBACK_REUSE_THRESHOLD):
+        """
+        (similarity, record) for the most similar stored request, or None if
+        there is none with a cosine similarity of at least `threshold`.
+        """
+        with self._lock:
+            # The offsets list is only appended to, so it can be read without copying
+            sketches, vectors, offsets = self._sketches, self._vectors, self._offsets
+        if not sketches.shape[1]:
+            return None
+        vector = np.asarray(vector, dtype=np.float32).reshape(VECTOR_DIM)
+        candidates = closest(hamming_distances(sketches, sketch(vector[None, :])[0]), CANDIDATES)
+        similarities = vectors[candidates] @ vector
+        best = int(np.argmax(similarities))
+        similarity = float(similarities[best])
+        if similarity < threshold:
+            return None
+        with open(self._records_path, 'rb') as file:
+            file.seek(offsets[candidates[best]])
+            record = json.loads(file.readline())
+        return similarity, record
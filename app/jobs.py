@@ -0,0 +1,211 @@
+"""
+Process-wide background jobs for feedback generation.
+
+Generating inside the Streamlit script ties the work to one script run: any
+widget interaction or a browser refresh stops the script and throws away a
+half-written answer. Instead the app submits a job, which runs on a shared
+worker pool independent of any session, and then follows the job's output.
+A rerun, or a new session opened with the job id in the URL, reattaches to
+the same job and shows what has been written so far.
+
+- Identical requests that are still queued or running share one job
+  (single flight), so two markers asking for the same thing pay once.
+- Each provider has its own concurrency bound. Jobs over the bound wait in
+  that provider's queue without holding a worker thread, so a backlog on one
+  provider does not delay jobs for another.
+- Speculative jobs (started before the marker asked for them) are marked
+  as such until a real request for the same key adopts them, so they can be
+  cancelled when superseded without cancelling anyone's real request.
+- Finished jobs are kept for ``JOB_RETENTION_SECONDS`` so they can still be
+  reattached to, then dropped.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "32"))
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", "900"))
+# Concurrent jobs per provider when no limit is given for it
+DEFAULT_PROVIDER_LIMIT = 4
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+class Job:
+    """
+    One generation. Its output is a list of parts (one per paragraph, or a
+    single part), filled in by (part index, chunk) events as they arrive.
+    """
+
+    def __init__(self, key, provider, work, parts, on_done, speculative=False):
+        self.id = uuid.uuid4().hex[:12]
+        self.key = key
+        self.provider = provider
+        self.work = work
+        self.on_done = on_done
+        self.speculative = speculative
+        self.status = QUEUED
+        self.texts = [""] * parts
+        self.events = []
+        self.error = None
+        # Provider keys that produced the output, set by the work function
+        self.providers = []
+        self.created = time.time()
+        self.started = None
+        self.first_chunk = None
+        self.finished = None
+        self._cancelled = threading.Event()
+        self._changed = threading.Condition()
+
+    @property
+    def active(self):
+        return self.status in (QUEUED, RUNNING)
+
+    @property
+    def result(self):
+        return self.texts[0] if len(self.texts) == 1 else self.texts
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _append(self, index, chunk):
+        with self._changed:
+            if self.first_chunk is None:
+                self.first_chunk = time.time()
+            self.texts[index] += chunk
+            self.events.append((index, chunk))
+            self._changed.notify_all()
+
+    def _finish(self, status, error=None):
+        with self._changed:
+            self.status = status
+            self.error = error
+            self.finished = time.time()
+            self._changed.notify_all()
+
+    def follow(self, start=0, poll_seconds=0.25):
+        """
+        Yield (part index, chunk) events from position `start` until the job
+        finishes. Closing this generator only detaches; the job keeps running.
+        """
+        position = start
+        while True:
+            with self._changed:
+                while position >= len(self.events) and self.active:
+                    self._changed.wait(poll_seconds)
+                events = self.events[position:]
+                finished = not self.active
+            for event in events:
+                yield event
+            position += len(events)
+            if finished and position >= len(self.events):
+                return
+
+    def snapshot(self):
+        """
+        (texts so far, number of events) for rendering before following the rest.
+        """
+        with self._changed:
+            return list(self.texts), len(self.events)
+
+class JobQueue:
+    """
+    Worker pool with single flight and per-provider concurrency bounds.
+    `limits` maps a provider key to the number of its jobs that may run at once.
+    """
+
+    def __init__(self, limits=None, workers=JOB_WORKERS):
+        self.limits = dict(limits or {})
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._active_by_key = {}
+        self._running = {}
+        self._waiting = {}
+
+    def submit(self, key, provider, work, parts=1, on_done=None, speculative=False):
+        """
+        Start a job running `work(job)`, a generator of (part index, chunk)
+        events, or return the queued or running job with the same `key`.
+        `on_done(job)` is called from the worker when the job finishes.
+        A non-speculative submit adopts a speculative job with the same key.
+        """
+        with self._lock:
+            self._prune()
+            job = self._active_by_key.get(key)
+            if job is not None and job.active and not job._cancelled.is_set():
+                if not speculative:
+                    job.speculative = False
+                return job
+            job = Job(key, provider, work, parts, on_done, speculative)
+            self._jobs[job.id] = job
+            self._active_by_key[key] = job
+            if self._running.get(provider, 0) < self.limits.get(provider, DEFAULT_PROVIDER_LIMIT):
+                self._start(job)
+            else:
+                self._waiting.setdefault(provider, deque()).append(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "jobs": len(self._jobs),
+                "running": dict(self._running),
+                "waiting": {provider: len(jobs) for provider, jobs in self._waiting.items() if jobs},
+            }
+
+    # Called with self._lock held
+    def _start(self, job):
+        self._running[job.provider] = self._running.get(job.provider, 0) + 1
+        self._executor.submit(self._run, job)
+
+    # Called with self._lock held
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished < cutoff]:
+            job = self._jobs.pop(job_id)
+            if self._active_by_key.get(job.key) is job:
+                del self._active_by_key[job.key]
+
+    def _run(self, job):
+        job.started = time.time()
+        job.status = RUNNING
+        events = None
+        try:
+            if job._cancelled.is_set():
+                job._finish(CANCELLED)
+                return
+            events = job.work(job)
+            for index, chunk in events:
+                if job._cancelled.is_set():
+                    job._finish(CANCELLED)
+                    return
+                if chunk:
+                    job._append(index, chunk)
+            job._finish(DONE)
+        except Exception as e:
+            job._finish(FAILED, e)
+        finally:
+            close = getattr(events, "close", None)
+            if close is not None:
+                # Closes the provider streams of a cancelled job
+                close()
+            self._release(job)
+            if job.on_done is not None and job.status == DONE:
+                try:
+                    job.on_done(job)
+                except Exception:
+                    pass
+
+    def _release(self, job):
+        with self._lock:
+            self._running[job.provider] -= 1
+            waiting = self._waiting.get(job.provider)
+            while waiting and self._running[job.provider] < self.limits.get(job.provider, DEFAULT_PROVIDER_LIMIT):
+                self._start(waiting.popleft())
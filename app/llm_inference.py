@@ -1,55 +1,623 @@
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
 import os
 import re
+import threading
+import time
+import weakref
 from dotenv import load_dotenv
-import streamlit as st
+
+from scheduler import get_scheduler
+from metrics import record_call
 
 # Load environment variables
 load_dotenv('secrets.env')
 
+# HTTP connection pool size for each provider client
+POOL_SIZE = int(os.environ.get("LLM_POOL_SIZE", "10"))
+# Per-request timeout in seconds; a timed-out request is retried by the scheduler
+REQUEST_TIMEOUT = float(os.environ.get("LLM_REQUEST_TIMEOUT", "120"))
+
+# Provider clients, created once per process and shared by every Streamlit
+# session and batch worker so keep-alive connections are reused between calls
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _http_limits():
+    import httpx
+    return httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE)
+
+def _create_gemini_client():
+    from google import genai
+    from google.genai import types
+    return genai.Client(
+        api_key=os.environ['GEMINI_API_KEY'],
+        http_options=types.HttpOptions(
+            timeout=int(REQUEST_TIMEOUT * 1000),
+            client_args={"limits": _http_limits()}
+        )
+    )
+
+def _create_together_client():
+    import httpx
+    from together import Together
+    # Retries are done by the scheduler, which also shares rate limits between callers
+    return Together(
+        http_client=httpx.Client(limits=_http_limits()),
+        timeout=REQUEST_TIMEOUT,
+        max_retries=0
+    )
+
+def _create_ollama_client():
+    from ollama import Client
+    return Client(host=os.environ.get("OLLAMA_HOST"), limits=_http_limits(), timeout=REQUEST_TIMEOUT)
+
+CLIENT_FACTORIES = {
+    "gemini": _create_gemini_client,
+    "together": _create_together_client,
+    "ollama": _create_ollama_client,
+}
+
+def get_client(provider):
+    """
+    Return the shared client for a provider, creating it on first use.
+    """
+    client = _clients.get(provider)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(provider)
+            if client is None:
+                client = CLIENT_FACTORIES[provider]()
+                _clients[provider] = client
+    return client
+
+def reset_clients():
+    """
+    Drop the shared clients so the next call creates new ones (e.g. after changing API keys).
+    """
+    with _clients_lock:
+        _clients.clear()
+        _async_clients.clear()
+
+def warm_clients(providers=None):
+    """
+    Import the SDKs and create the shared clients ahead of the first call, e.g.
+    from a background thread at startup. Providers that are not configured
+    (no API key) are skipped. Returns {provider: seconds taken}.
+    """
+    timings = {}
+    for provider in providers or list(CLIENT_FACTORIES):
+        start = time.perf_counter()
+        try:
+            client = get_client(provider)
+            if provider == "together":
+                # Together imports its resource modules on first access
+                client.chat.completions
+        except Exception:
+            continue
+        timings[provider] = time.perf_counter() - start
+    return timings
+
+# Async clients hold connections bound to the event loop that created them, so
+# each loop gets its own set. They are dropped when the loop is garbage collected.
+_async_clients = weakref.WeakKeyDictionary()
+
+def _create_async_gemini_client():
+    import httpx
+    from google import genai
+    from google.genai import types
+    return genai.Client(
+        api_key=os.environ['GEMINI_API_KEY'],
+        http_options=types.HttpOptions(
+            timeout=int(REQUEST_TIMEOUT * 1000),
+            httpx_async_client=httpx.AsyncClient(limits=_http_limits(), timeout=REQUEST_TIMEOUT)
+        )
+    ).aio
+
+def _create_async_together_client():
+    import httpx
+    from together import AsyncTogether
+    return AsyncTogether(
+        http_client=httpx.AsyncClient(limits=_http_limits()),
+        timeout=REQUEST_TIMEOUT,
+        max_retries=0
+    )
+
+def _create_async_ollama_client():
+    from ollama import AsyncClient
+    return AsyncClient(host=os.environ.get("OLLAMA_HOST"), limits=_http_limits(), timeout=REQUEST_TIMEOUT)
+
+ASYNC_CLIENT_FACTORIES = {
+    "gemini": _create_async_gemini_client,
+    "together": _create_async_together_client,
+    "ollama": _create_async_ollama_client,
+}
+
+def get_async_client(provider):
+    """
+    Return the async client for a provider on the running event loop, creating it on first use.
+    """
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+    client = clients.get(provider)
+    if client is None:
+        client = clients[provider] = ASYNC_CLIENT_FACTORIES[provider]()
+    return client
+
+async def aclose_async_clients():
+    """
+    Close the async clients of the running event loop. Call before the loop is closed.
+    """
+    with _clients_lock:
+        clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        close = getattr(client, "aclose", None) or getattr(client, "close", None)
+        if close is not None:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+
+# --- Errors ---
+# Provider failures are raised as LLMError subclasses so callers (the UI, batch
+# mode and the router) can tell a transient failure worth retrying elsewhere
+# from one that will keep failing.
+
+# HTTP statuses worth retrying: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+
+class LLMError(Exception):
+    """
+    A provider call failed. `provider` is the display name of the model,
+    `status_code` the HTTP status if there was one and `retry_after` the
+    server's requested delay in seconds, if it sent one.
+    """
+    retryable = False
+
+    def __init__(self, provider, message, status_code=None, retry_after=None):
+        super().__init__(f"Error with {provider}: {message}")
+        self.provider = provider
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class RetryableLLMError(LLMError):
+    """Timeouts, connection failures, rate limits and 5xx responses."""
+    retryable = True
+
+class FatalLLMError(LLMError):
+    """Errors that will not go away by retrying, e.g. a missing API key or a rejected request."""
+    retryable = False
+
+class GenerationCancelled(Exception):
+    """Recorded in metrics when a stream is closed before it finished."""
+
+def _status_code(error):
+    for attribute in ("status_code", "code", "status"):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int) and value > 0:
+            return value
+    return None
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+def classify_error(provider, error):
+    """
+    Wrap an SDK exception in a RetryableLLMError or FatalLLMError.
+    """
+    if isinstance(error, LLMError):
+        return error
+    status_code = _status_code(error)
+    name = type(error).__name__
+    if status_code is not None:
+        retryable = status_code in RETRYABLE_STATUS_CODES
+    else:
+        # No HTTP status: network-level failures are transient, anything else
+        # (bad configuration, missing key, programming errors) is not
+        retryable = (
+            isinstance(error, (TimeoutError, ConnectionError))
+            or "Timeout" in name
+            or "Connect" in name
+            or "Network" in name
+            or "RemoteProtocol" in name
+        )
+    error_class = RetryableLLMError if retryable else FatalLLMError
+    return error_class(provider, str(error), status_code=status_code, retry_after=_retry_after(error))
+
+# Model ids and generation parameters for each provider. These are also part
+# of the response cache key, so changing them invalidates cached answers.
+GEMINI_MODEL = "gemini-2.5-flash"
+GEMINI_GENERATION_CONFIG = {
+    "temperature": 0.4,
+    "top_p": 0.95,
+    "top_k": 20,
+    "candidate_count": 1,
+    "max_output_tokens": 4000,
+}
+TOGETHER_MODEL = "openai/gpt-oss-120b"
+OLLAMA_MODEL = "gpt-oss:20b"
+
+MODEL_SETTINGS = {
+    "gemini": {"model": GEMINI_MODEL, "params": GEMINI_GENERATION_CONFIG},
+    "together": {"model": TOGETHER_MODEL, "params": {}},
+    "ollama": {"model": OLLAMA_MODEL, "params": {}},
+}
+
+# Display names used in error messages
+PROVIDER_LABELS = {
+    "gemini": "Gemini 2.5 Flash",
+    "together": "GPT-OSS 120B (Together)",
+    "ollama": "Ollama GPT-OSS 20B",
+}
+
+# --- Rate limits and retries ---
+# Every call goes through the provider's scheduler (see scheduler.py), so all
+# sessions and batch workers in this process share one budget per provider.
+# A limit of 0 means unlimited.
+
+RATE_LIMITS = {
+    "gemini": {
+        "requests_per_minute": int(os.environ.get("GEMINI_RPM", "60")),
+        "tokens_per_minute": int(os.environ.get("GEMINI_TPM", "250000")),
+        "max_in_flight": int(os.environ.get("GEMINI_MAX_IN_FLIGHT", "8")),
+    },
+    "together": {
+        "requests_per_minute": int(os.environ.get("TOGETHER_RPM", "60")),
+        "tokens_per_minute": int(os.environ.get("TOGETHER_TPM", "0")),
+        "max_in_flight": int(os.environ.get("TOGETHER_MAX_IN_FLIGHT", "8")),
+    },
+    "ollama": {
+        "requests_per_minute": 0,
+        "tokens_per_minute": 0,
+        # Requests beyond the server's OLLAMA_NUM_PARALLEL only queue inside Ollama
+        "max_in_flight": int(os.environ.get("OLLAMA_MAX_IN_FLIGHT", os.environ.get("OLLAMA_NUM_PARALLEL", "4"))),
+    },
+}
+MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "3"))
+# Output tokens assumed per call when charging the tokens-per-minute bucket
+EXPECTED_OUTPUT_TOKENS = 1000
+
+def estimate_tokens(prompt, prefix=None):
+    """
+    Rough token count (about four characters per token) for rate limiting.
+    """
+    return (len(prefix or "") + len(prompt)) // 4
+
+def provider_scheduler(provider):
+    return get_scheduler(provider, max_retries=MAX_RETRIES, **RATE_LIMITS[provider])
+
+def _record_call(provider, prompt, prefix, stats, start, output_chars, error):
+    record_call(
+        provider=provider,
+        model=MODEL_SETTINGS[provider]["model"],
+        prompt_chars=len(prefix or "") + len(prompt),
+        prompt_tokens=stats.get("prompt_tokens") or estimate_tokens(prompt, prefix),
+        output_tokens=stats.get("output_tokens") or output_chars // 4,
+        queue_wait_s=stats.get("queue_wait"),
+        ttft_s=stats.get("ttft"),
+        latency_s=time.time() - start,
+        cache_hit=False,
+        retries=stats.get("retries", 0),
+        error_class=None if error is None else type(error).__name__,
+        load_s=stats.get("load_s"),
+        cold_start=stats.get("cold_start"),
+        cached_prefix_tokens=stats.get("cached_prefix_tokens")
+    )
+
+def scheduled(provider):
+    """
+    Run a run_*/stream_*/arun_* function through the provider's scheduler and
+    record its metrics. The wrapped function receives a `usage` dict it can
+    fill with the provider's reported prompt_tokens and output_tokens.
+    Async functions also take an overall `timeout` in seconds, retries included.
+    """
+    def decorator(fn):
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def wrapper(prompt, prefix=None):
+                tokens = estimate_tokens(prompt, prefix) + EXPECTED_OUTPUT_TOKENS
+                stats = {}
+                start = time.time()
+                def instrumented():
+                    output_chars = 0
+                    error = None
+                    stream = provider_scheduler(provider).stream(
+                        lambda: fn(prompt, prefix=prefix, usage=stats), tokens=tokens, stats=stats
+                    )
+                    try:
+                        for chunk in stream:
+                            if "ttft" not in stats:
+                                stats["ttft"] = time.time() - start
+                            output_chars += len(chunk)
+                            yield chunk
+                    except Exception as e:
+                        error = e
+                        raise
+                    except GeneratorExit:
+                        # The consumer stopped reading, e.g. the router cancelled a losing request
+                        error = GenerationCancelled()
+                        raise
+                    finally:
+                        stream.close()
+                        _record_call(provider, prompt, prefix, stats, start, output_chars, error)
+                return instrumented()
+        elif inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(prompt, prefix=None, timeout=None):
+                tokens = estimate_tokens(prompt, prefix) + EXPECTED_OUTPUT_TOKENS
+                stats = {}
+                start = time.time()
+                call = provider_scheduler(provider).acall(
+                    lambda: fn(prompt, prefix=prefix, usage=stats), tokens=tokens, stats=stats
+                )
+                try:
+                    result = await asyncio.wait_for(call, timeout)
+                except asyncio.TimeoutError as e:
+                    error = classify_error(PROVIDER_LABELS[provider], TimeoutError(f"no response within {timeout} seconds"))
+                    _record_call(provider, prompt, prefix, stats, start, 0, error)
+                    raise error from e
+                except asyncio.CancelledError:
+                    _record_call(provider, prompt, prefix, stats, start, 0, GenerationCancelled())
+                    raise
+                except Exception as e:
+                    _record_call(provider, prompt, prefix, stats, start, 0, e)
+                    raise
+                _record_call(provider, prompt, prefix, stats, start, len(result or ""), None)
+                return result
+        else:
+            @functools.wraps(fn)
+            def wrapper(prompt, prefix=None):
+                tokens = estimate_tokens(prompt, prefix) + EXPECTED_OUTPUT_TOKENS
+                stats = {}
+                start = time.time()
+                try:
+                    result = provider_scheduler(provider).call(
+                        lambda: fn(prompt, prefix=prefix, usage=stats), tokens=tokens, stats=stats
+                    )
+                except Exception as e:
+                    _record_call(provider, prompt, prefix, stats, start, 0, e)
+                    raise
+                _record_call(provider, prompt, prefix, stats, start, len(result or ""), None)
+                return result
+        return wrapper
+    return decorator
+
+# --- Gemini explicit context caching of the stable prompt prefix ---
+# The instructions + feedback examples block is registered once as a cached
+# content handle, and each call then only sends the per-submission suffix.
+# Ollama and Together get the prefix at the front of the prompt unchanged,
+# which is what their automatic prefix (KV) caches reuse.
+
+PREFIX_CACHE_TTL_SECONDS = int(os.environ.get("GEMINI_PREFIX_CACHE_TTL", "3600"))
+# Gemini rejects cached contents below a minimum size; skip smaller prefixes
+PREFIX_CACHE_MIN_TOKENS = int(os.environ.get("GEMINI_PREFIX_CACHE_MIN_TOKENS", "1024"))
+PREFIX_CACHE_MAX_HANDLES = 8
+
+_prefix_caches = {}
+_prefix_caches_lock = threading.Lock()
+_prefix_create_lock = threading.Lock()
+
+def _prefix_digest(prefix):
+    return hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+
+def _forget_prefix_cache(digest):
+    with _prefix_caches_lock:
+        _prefix_caches.pop(digest, None)
+
+def get_gemini_prefix_cache(prefix):
+    """
+    Name of a live Gemini cached-content handle for `prefix`, or None if the
+    prefix cannot be cached. Handles are created on first use, renewed when
+    they are close to their TTL and replaced when the prefix changes.
+    """
+    if len(prefix) // 4 < PREFIX_CACHE_MIN_TOKENS:
+        return None
+    from google.genai import types
+
+    digest = _prefix_digest(prefix)
+    now = time.time()
+    with _prefix_caches_lock:
+        entry = _prefix_caches.get(digest)
+        if entry is not None:
+            if entry["name"] is None:
+                # Creation failed before (e.g. prefix below the minimum size); retry after the TTL
+                if entry["expires"] > now:
+                    return None
+                entry = None
+            elif entry["expires"] - now > max(60, PREFIX_CACHE_TTL_SECONDS * 0.1):
+                entry["last_used"] = now
+                return entry["name"]
+
+    client = get_client("gemini")
+    ttl = f"{PREFIX_CACHE_TTL_SECONDS}s"
+    name = None
+    # One creation at a time so concurrent first calls register the prefix once
+    with _prefix_create_lock:
+        current = _prefix_caches.get(digest)
+        if current is not None and current is not entry and current["expires"] - now > 60:
+            return current["name"]
+        if entry is not None and entry["expires"] > now:
+            try:
+                client.caches.update(name=entry["name"], config=types.UpdateCachedContentConfig(ttl=ttl))
+                name = entry["name"]
+            except Exception:
+                name = None
+        if name is None:
+            try:
+                cached = client.caches.create(
+                    model=GEMINI_MODEL,
+                    config=types.CreateCachedContentConfig(
+                        contents=[prefix],
+                        ttl=ttl,
+                        display_name=f"feedback-prefix-{digest[:12]}"
+                    )
+                )
+                name = cached.name
+            except Exception:
+                name = None
+
+        evicted = []
+        with _prefix_caches_lock:
+            _prefix_caches[digest] = {"name": name, "expires": now + PREFIX_CACHE_TTL_SECONDS, "last_used": now}
+            while len(_prefix_caches) > PREFIX_CACHE_MAX_HANDLES:
+                oldest = min(_prefix_caches, key=lambda key: _prefix_caches[key]["last_used"])
+                evicted.append(_prefix_caches.pop(oldest)["name"])
+
+    # Stale handles would otherwise keep billing storage until their TTL
+    for old_name in evicted:
+        if old_name:
+            try:
+                client.caches.delete(name=old_name)
+            except Exception:
+                pass
+    return name
+
+def _gemini_request(prompt, prefix):
+    """
+    Contents and config for a Gemini call, using the cached prefix when possible.
+    Returns (contents, config, prefix digest or None).
+    """
+    from google.genai import types
+
+    if prefix:
+        cache_name = get_gemini_prefix_cache(prefix)
+        if cache_name:
+            config = types.GenerateContentConfig(cached_content=cache_name, **GEMINI_GENERATION_CONFIG)
+            return prompt, config, _prefix_digest(prefix)
+    return (prefix or "") + prompt, types.GenerateContentConfig(**GEMINI_GENERATION_CONFIG), None
+
+def _gemini_usage(response, usage):
+    metadata = getattr(response, "usage_metadata", None)
+    if usage is None or metadata is None:
+        return
+    usage["prompt_tokens"] = metadata.prompt_token_count or usage.get("prompt_tokens")
+    usage["output_tokens"] = metadata.candidates_token_count or usage.get("output_tokens")
+    usage["cached_prefix_tokens"] = metadata.cached_content_token_count
+
+def _is_missing_cache_error(error):
+    # A handle deleted or expired on the server side
+    return getattr(error, "code", None) in (403, 404) and "cach" in str(error).lower()
+
+# --- Ollama runtime profile ---
+# A local model is loaded on the first request after an idle period, which on
+# CPU-only machines takes longer than the generation itself. Requests keep the
+# model loaded for OLLAMA_KEEP_ALIVE, size the context window to the prompt and
+# cap the output length. warm_ollama() loads the model ahead of the first request.
+
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_NUM_PREDICT = int(os.environ.get("OLLAMA_NUM_PREDICT", "4000"))
+OLLAMA_MIN_CTX = int(os.environ.get("OLLAMA_MIN_CTX", "4096"))
+OLLAMA_MAX_CTX = int(os.environ.get("OLLAMA_MAX_CTX", "32768"))
+# Tokens for the chat template around the prompt
+OLLAMA_TEMPLATE_TOKENS = 256
+# A load_duration above this many seconds means the model was not loaded yet
+OLLAMA_COLD_START_SECONDS = 0.5
+
+_ollama_num_ctx = 0
+_ollama_num_ctx_lock = threading.Lock()
+
+def _keep_alive_value(value):
+    # Ollama takes a number of seconds or a duration string such as "30m"
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+def ollama_num_ctx(prompt_chars):
+    """
+    Context window for a prompt of `prompt_chars` characters plus the output
+    cap, rounded up to a power of two. It never shrinks within a process,
+    because a request with a different num_ctx makes Ollama reload the model.
+    """
+    global _ollama_num_ctx
+    # About three characters per token, which overestimates for English text
+    needed = prompt_chars // 3 + OLLAMA_NUM_PREDICT + OLLAMA_TEMPLATE_TOKENS
+    num_ctx = OLLAMA_MIN_CTX
+    while num_ctx < needed and num_ctx < OLLAMA_MAX_CTX:
+        num_ctx *= 2
+    with _ollama_num_ctx_lock:
+        _ollama_num_ctx = max(_ollama_num_ctx, min(num_ctx, OLLAMA_MAX_CTX))
+        return _ollama_num_ctx
+
+def ollama_request_options(prompt_chars):
+    """
+    Keyword arguments for Ollama chat calls: context size, output cap and keep_alive.
+    """
+    return {
+        "options": {"num_ctx": ollama_num_ctx(prompt_chars), "num_predict": OLLAMA_NUM_PREDICT},
+        "keep_alive": _keep_alive_value(OLLAMA_KEEP_ALIVE),
+    }
+
+def _ollama_usage(response, usage):
+    if usage is None:
+        return
+    usage["prompt_tokens"] = response.get('prompt_eval_count')
+    usage["output_tokens"] = response.get('eval_count')
+    load_s = (response.get('load_duration') or 0) / 1e9
+    usage["load_s"] = load_s
+    usage["cold_start"] = load_s >= OLLAMA_COLD_START_SECONDS
+
+def warm_ollama(prompt_chars=4000):
+    """
+    Load the Ollama model without generating anything, using the same context
+    size and keep_alive as real requests so they do not reload it. Returns the
+    model load time in seconds, or None if Ollama could not be reached.
+    """
+    try:
+        response = get_client("ollama").chat(model=OLLAMA_MODEL, messages=[], **ollama_request_options(prompt_chars))
+    except Exception:
+        return None
+    return (response.get('load_duration') or 0) / 1e9
+
 # Gemini 2.5 Flash inference
-def run_gemini_flash(prompt):
+@scheduled("gemini")
+def run_gemini_flash(prompt, prefix=None, usage=None):
     """
     Run inference with Gemini 2.5 Flash model.
+    If `prefix` is given it is sent through the prefix cache and `prompt` is the rest of the prompt.
     """
     try:
-        from google import genai
-        from google.genai import types
-        
-        # Create a client
-        client = genai.Client(api_key=os.environ['GEMINI_API_KEY'])
-        
-        # Model configuration
-        MODEL_ID = "gemini-2.5-flash"
+        client = get_client("gemini")
         
         # Generate content
-        response = client.models.generate_content(
-            model=MODEL_ID,
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                temperature=0.4,
-                top_p=0.95,
-                top_k=20,
-                candidate_count=1,
-                max_output_tokens=4000,
-            )
-        )
+        contents, config, digest = _gemini_request(prompt, prefix)
+        try:
+            response = client.models.generate_content(model=GEMINI_MODEL, contents=contents, config=config)
+        except Exception as e:
+            if digest is None or not _is_missing_cache_error(e):
+                raise
+            _forget_prefix_cache(digest)
+            contents, config, _ = _gemini_request(prompt, prefix)
+            response = client.models.generate_content(model=GEMINI_MODEL, contents=contents, config=config)
         
+        _gemini_usage(response, usage)
         return response.text
     except Exception as e:
-        return f"Error with Gemini 2.5 Flash: {str(e)}"
+        raise classify_error("Gemini 2.5 Flash", e) from e
 
 # GPT-OSS 120B via Together API inference
-def run_deepseek_r1_together(prompt):
+@scheduled("together")
+def run_deepseek_r1_together(prompt, prefix=None, usage=None):
     """
     Run inference with GPT-OSS 120B model via Together API.
     """
     try:
-        from together import Together
-        
-        client = Together()
+        client = get_client("together")
+        prompt = (prefix or "") + prompt
         
         response = client.chat.completions.create(
-            model="openai/gpt-oss-120b",
+            model=TOGETHER_MODEL,
             messages=[
                 {
                     "role": "user",
@@ -58,32 +626,316 @@ def run_deepseek_r1_together(prompt):
             ]
         )
         
+        if usage is not None and getattr(response, "usage", None) is not None:
+            usage["prompt_tokens"] = response.usage.prompt_tokens
+            usage["output_tokens"] = response.usage.completion_tokens
         return response.choices[0].message.content
     except Exception as e:
-        return f"Error with GPT-OSS 120B (Together): {str(e)}"
+        raise classify_error("GPT-OSS 120B (Together)", e) from e
 
 # Ollama GPT-OSS inference
 
-def run_ollama_gpt_oss(prompt):
+@scheduled("ollama")
+def run_ollama_gpt_oss(prompt, prefix=None, usage=None):
     """
     Run inference with Ollama gpt-oss:20b model.
     """
     try:
-        from ollama import chat
+        client = get_client("ollama")
+        prompt = (prefix or "") + prompt
+        
+        response = client.chat(model=OLLAMA_MODEL, messages=[
+            {
+                'role': 'user',
+                'content': prompt,
+            },
+        ], **ollama_request_options(len(prompt)))
+        
+        _ollama_usage(response, usage)
+        return remove_thinking_tags(response['message']['content'])
+    except Exception as e:
+        raise classify_error("Ollama GPT-OSS 20B", e) from e
+
+def remove_thinking_tags(text):
+    """
+    Remove <think>...</think> blocks from a complete response.
+    """
+    if '<think>' not in text:
+        return text
+    cleaned_text = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL)
+    return cleaned_text.strip()
+
+# Streaming variants. Each yields text chunks as they arrive so the UI can
+# render them with st.write_stream, and raises LLMError like the blocking ones.
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+def _partial_tag_length(text, tag):
+    """
+    Length of the longest suffix of `text` that is a prefix of `tag`.
+    """
+    for length in range(min(len(text), len(tag) - 1), 0, -1):
+        if text.endswith(tag[:length]):
+            return length
+    return 0
+
+def strip_thinking_stream(chunks):
+    """
+    Remove <think>...</think> blocks from a stream of text chunks, including
+    tags split across chunk boundaries. Leading whitespace is dropped, as
+    run_ollama_gpt_oss does for the blocking response.
+    """
+    buffer = ""
+    in_think = False
+    started = False
+    for chunk in chunks:
+        buffer += chunk
+        output = []
+        while buffer:
+            if in_think:
+                end = buffer.find(THINK_CLOSE)
+                if end == -1:
+                    # Only keep what could be the start of a closing tag
+                    buffer = buffer[len(buffer) - _partial_tag_length(buffer, THINK_CLOSE):]
+                    break
+                buffer = buffer[end + len(THINK_CLOSE):]
+                in_think = False
+            else:
+                start = buffer.find(THINK_OPEN)
+                if start == -1:
+                    # Hold back a possible partial opening tag until the next chunk
+                    keep = _partial_tag_length(buffer, THINK_OPEN)
+                    output.append(buffer[:len(buffer) - keep])
+                    buffer = buffer[len(buffer) - keep:]
+                    break
+                output.append(buffer[:start])
+                buffer = buffer[start + len(THINK_OPEN):]
+                in_think = True
+        text = "".join(output)
+        if not started:
+            text = text.lstrip()
+            started = bool(text)
+        if text:
+            yield text
+    if buffer and not in_think:
+        yield buffer if started else buffer.lstrip()
+
+@scheduled("gemini")
+def stream_gemini_flash(prompt, prefix=None, usage=None):
+    """
+    Stream inference with Gemini 2.5 Flash model.
+    """
+    try:
+        client = get_client("gemini")
+        
+        contents, config, digest = _gemini_request(prompt, prefix)
+        try:
+            stream = client.models.generate_content_stream(model=GEMINI_MODEL, contents=contents, config=config)
+            first = next(stream, None)
+        except Exception as e:
+            if digest is None or not _is_missing_cache_error(e):
+                raise
+            _forget_prefix_cache(digest)
+            contents, config, _ = _gemini_request(prompt, prefix)
+            stream = client.models.generate_content_stream(model=GEMINI_MODEL, contents=contents, config=config)
+            first = next(stream, None)
+        
+        if first is not None:
+            _gemini_usage(first, usage)
+            if first.text:
+                yield first.text
+        for chunk in stream:
+            # Usage metadata is cumulative; the last chunk has the totals
+            _gemini_usage(chunk, usage)
+            if chunk.text:
+                yield chunk.text
+    except Exception as e:
+        raise classify_error("Gemini 2.5 Flash", e) from e
+
+@scheduled("together")
+def stream_deepseek_r1_together(prompt, prefix=None, usage=None):
+    """
+    Stream inference with GPT-OSS 120B model via Together API.
+    """
+    try:
+        client = get_client("together")
+        prompt = (prefix or "") + prompt
+        
+        stream = client.chat.completions.create(
+            model=TOGETHER_MODEL,
+            messages=[
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            stream=True
+        )
+        for chunk in stream:
+            if usage is not None and getattr(chunk, "usage", None) is not None:
+                usage["prompt_tokens"] = chunk.usage.prompt_tokens
+                usage["output_tokens"] = chunk.usage.completion_tokens
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    except Exception as e:
+        raise classify_error("GPT-OSS 120B (Together)", e) from e
+
+@scheduled("ollama")
+def stream_ollama_gpt_oss(prompt, prefix=None, usage=None):
+    """
+    Stream inference with Ollama gpt-oss:20b model, with thinking tags removed.
+    """
+    try:
+        client = get_client("ollama")
+        prompt = (prefix or "") + prompt
+        
+        stream = client.chat(model=OLLAMA_MODEL, messages=[
+            {
+                'role': 'user',
+                'content': prompt,
+            },
+        ], stream=True, **ollama_request_options(len(prompt)))
+        
+        def contents():
+            for part in stream:
+                if part.get('done'):
+                    _ollama_usage(part, usage)
+                yield part['message']['content']
+        
+        yield from strip_thinking_stream(contents())
+    except Exception as e:
+        raise classify_error("Ollama GPT-OSS 20B", e) from e
+
+# --- Async API ---
+# Counterparts of the run_* functions for asyncio callers, built on the SDKs'
+# async clients. They share the providers' schedulers and metrics with the
+# sync functions, take an optional overall `timeout` in seconds and can be
+# cancelled like any other task, which closes the HTTP request.
+
+async def _gemini_request_async(prompt, prefix):
+    # Registering or renewing the prefix cache uses the sync client; keep it off the event loop
+    if prefix and len(prefix) // 4 >= PREFIX_CACHE_MIN_TOKENS:
+        return await asyncio.to_thread(_gemini_request, prompt, prefix)
+    return _gemini_request(prompt, prefix)
+
+@scheduled("gemini")
+async def arun_gemini_flash(prompt, prefix=None, usage=None):
+    """
+    Async inference with Gemini 2.5 Flash model.
+    """
+    try:
+        client = get_async_client("gemini")
+        
+        contents, config, digest = await _gemini_request_async(prompt, prefix)
+        try:
+            response = await client.models.generate_content(model=GEMINI_MODEL, contents=contents, config=config)
+        except Exception as e:
+            if digest is None or not _is_missing_cache_error(e):
+                raise
+            _forget_prefix_cache(digest)
+            contents, config, _ = await _gemini_request_async(prompt, prefix)
+            response = await client.models.generate_content(model=GEMINI_MODEL, contents=contents, config=config)
+        
+        _gemini_usage(response, usage)
+        return response.text
+    except Exception as e:
+        raise classify_error("Gemini 2.5 Flash", e) from e
+
+@scheduled("together")
+async def arun_deepseek_r1_together(prompt, prefix=None, usage=None):
+    """
+    Async inference with GPT-OSS 120B model via Together API.
+    """
+    try:
+        client = get_async_client("together")
+        prompt = (prefix or "") + prompt
         
-        response = chat(model='gpt-oss:20b', messages=[
+        response = await client.chat.completions.create(
+            model=TOGETHER_MODEL,
+            messages=[
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ]
+        )
+        
+        if usage is not None and getattr(response, "usage", None) is not None:
+            usage["prompt_tokens"] = response.usage.prompt_tokens
+            usage["output_tokens"] = response.usage.completion_tokens
+        return response.choices[0].message.content
+    except Exception as e:
+        raise classify_error("GPT-OSS 120B (Together)", e) from e
+
+@scheduled("ollama")
+async def arun_ollama_gpt_oss(prompt, prefix=None, usage=None):
+    """
+    Async inference with Ollama gpt-oss:20b model.
+    """
+    try:
+        client = get_async_client("ollama")
+        prompt = (prefix or "") + prompt
+        
+        response = await client.chat(model=OLLAMA_MODEL, messages=[
             {
                 'role': 'user',
                 'content': prompt,
             },
-        ])
-        
-        response_content = response['message']['content']
-        def remove_thinking_tags(text):
-            cleaned_text = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL)
-            return cleaned_text.strip()
-        if '<think>' in response_content:
-            response_content = remove_thinking_tags(response_content)
-        return response_content
+        ], **ollama_request_options(len(prompt)))
+        
+        _ollama_usage(response, usage)
+        return remove_thinking_tags(response['message']['content'])
     except Exception as e:
-        return f"Error with Ollama GPT-OSS 20B: {str(e)}"
+        raise classify_error("Ollama GPT-OSS 20B", e) from e
+
+async def gather_prompts(run, prompts, prefix=None, limit=None, timeout=None):
+    """
+    Run `run` (an arun_* function) on every prompt concurrently on the running
+    event loop, at most `limit` at a time if given (the provider's scheduler
+    applies its own limits too). Returns the results in prompt order; a prompt
+    that failed gets its LLMError in place of the text, so one failure does
+    not cancel the others.
+    """
+    semaphore = asyncio.Semaphore(limit) if limit else None
+
+    async def run_one(prompt):
+        try:
+            if semaphore is None:
+                return await run(prompt, prefix=prefix, timeout=timeout)
+            async with semaphore:
+                return await run(prompt, prefix=prefix, timeout=timeout)
+        except LLMError as e:
+            return e
+
+    return await asyncio.gather(*(run_one(prompt) for prompt in prompts))
+
+def run_prompts(run, prompts, prefix=None, limit=None, timeout=None):
+    """
+    Blocking wrapper around gather_prompts for code without an event loop.
+    """
+    async def main():
+        try:
+            return await gather_prompts(run, prompts, prefix=prefix, limit=limit, timeout=timeout)
+        finally:
+            await aclose_async_clients()
+    return asyncio.run(main())
+
+# Local fake provider (no network, for batch runs and benchmarks)
+def run_fake_llm(prompt, prefix=None):
+    """
+    Return canned feedback after a configurable delay, without calling any API.
+    The delay in seconds is read from the FAKE_LLM_LATENCY environment variable.
+    """
+    time.sleep(float(os.environ.get("FAKE_LLM_LATENCY", "0.05")))
+    def feedback(text):
+        checked = sum(1 for line in text.splitlines() if line.startswith("    - "))
+        return (
+            f"This is placeholder feedback generated locally for {checked} checked criteria. "
+            "No language model was called."
+        )
+    # A packed prompt (see packing.py) is answered with a JSON object keyed by submission id
+    sections = re.split(r'^=== Submission (.+) ===$', prompt, flags=re.MULTILINE)
+    if len(sections) > 1:
+        return json.dumps({sections[i]: feedback(sections[i + 1]) for i in range(1, len(sections), 2)})
+    return feedback(prompt)
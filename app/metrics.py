@@ -0,0 +1,387 @@
+"""
+Per-call instrumentation for LLM requests.
+
+Every provider call (and every response-cache hit) produces one record with
+provider, model, prompt size, token counts, queue wait, time to first token,
+total latency, cache hit, retries and error class, plus the model load time
+and whether it was a cold start for local (Ollama) models. Records are appended to a
+JSONL file and aggregated in memory for a Prometheus text exposition, which
+can be served over HTTP (``LLM_METRICS_PORT``) or written to a file for the
+node_exporter textfile collector (``LLM_METRICS_PROM_FILE``).
+
+Speculative pre-generation is counted separately (started, hit, discarded,
+over budget and the tokens spent on discarded speculations), in memory only,
+as are routing decisions and per-provider gauges set by the router. Other
+modules can ``subscribe`` to every call record, e.g. to track provider health.
+"""
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_FILE = os.environ.get("LLM_METRICS_FILE", "llm_metrics.jsonl")
+# The JSONL file is moved to <file>.1 (replacing the previous one) once it
+# reaches this size, so at most twice this much is kept; 0 disables rotation
+METRICS_MAX_BYTES = int(float(os.environ.get("LLM_METRICS_MAX_MB", "20")) * 1024 * 1024)
+PROM_FILE = os.environ.get("LLM_METRICS_PROM_FILE")
+# Minimum seconds between rewrites of the Prometheus textfile
+PROM_FILE_INTERVAL = float(os.environ.get("LLM_METRICS_PROM_INTERVAL", "5"))
+
+# Histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120)
+
+RECORD_FIELDS = (
+    "ts", "provider", "model", "prompt_chars", "prompt_tokens", "output_tokens",
+    "queue_wait_s", "ttft_s", "latency_s", "cache_hit", "retries", "error_class",
+    "load_s", "cold_start"
+)
+
+class MetricsRegistry:
+    """
+    In-memory counters and histograms, labelled by provider and model.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = defaultdict(int)
+        self.retries = defaultdict(int)
+        self.tokens = defaultdict(int)
+        self.cold_starts = defaultdict(int)
+        self.speculation = defaultdict(int)
+        self.speculation_wasted_tokens = 0
+        self.routing = defaultdict(int)
+        self.gauges = {}
+        self.histograms = {}
+
+    def _observe(self, name, labels, value):
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+    def observe(self, record):
+        labels = (record.get("provider") or "unknown", record.get("model") or "unknown")
+        status = record.get("error_class") or "ok"
+        with self._lock:
+            self.calls[labels + (status, "true" if record.get("cache_hit") else "false")] += 1
+            self.retries[labels] += record.get("retries") or 0
+            self.tokens[labels + ("prompt",)] += record.get("prompt_tokens") or 0
+            self.tokens[labels + ("output",)] += record.get("output_tokens") or 0
+            if record.get("cache_hit"):
+                return
+            if record.get("cold_start"):
+                self.cold_starts[labels] += 1
+            for field, name in (("latency_s", "llm_request_duration_seconds"),
+                                ("ttft_s", "llm_time_to_first_token_seconds"),
+                                ("queue_wait_s", "llm_queue_wait_seconds"),
+                                ("load_s", "llm_model_load_seconds")):
+                if record.get(field) is not None:
+                    self._observe(name, labels, record[field])
+
+    def render(self):
+        """
+        Prometheus text exposition format.
+        """
+        def fmt(labels, **extra):
+            pairs = dict(zip(("provider", "model"), labels[:2]), **extra)
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs.items()) + "}"
+
+        lines = []
+        with self._lock:
+            lines.append("# HELP llm_calls_total LLM calls by outcome.")
+            lines.append("# TYPE llm_calls_total counter")
+            for labels, value in sorted(self.calls.items()):
+                lines.append(f"llm_calls_total{fmt(labels, status=labels[2], cache_hit=labels[3])} {value}")
+            lines.append("# HELP llm_retries_total Retried LLM requests.")
+            lines.append("# TYPE llm_retries_total counter")
+            for labels, value in sorted(self.retries.items()):
+                lines.append(f"llm_retries_total{fmt(labels)} {value}")
+            lines.append("# HELP llm_tokens_total Prompt and output tokens.")
+            lines.append("# TYPE llm_tokens_total counter")
+            for labels, value in sorted(self.tokens.items()):
+                lines.append(f"llm_tokens_total{fmt(labels, kind=labels[2])} {value}")
+            lines.append("# HELP llm_cold_starts_total Calls that had to load the model first.")
+            lines.append("# TYPE llm_cold_starts_total counter")
+            for labels, value in sorted(self.cold_starts.items()):
+                lines.append(f"llm_cold_starts_total{fmt(labels)} {value}")
+            lines.append("# HELP llm_speculation_total Speculative generations by outcome.")
+            lines.append("# TYPE llm_speculation_total counter")
+            for outcome, value in sorted(self.speculation.items()):
+                lines.append(f'llm_speculation_total{{outcome="{outcome}"}} {value}')
+            lines.append("# HELP llm_speculation_wasted_tokens_total Estimated tokens spent on discarded speculations.")
+            lines.append("# TYPE llm_speculation_wasted_tokens_total counter")
+            lines.append(f"llm_speculation_wasted_tokens_total {self.speculation_wasted_tokens}")
+            lines.append("# HELP llm_routing_decisions_total Requests routed to each provider by objective and reason.")
+            lines.append("# TYPE llm_routing_decisions_total counter")
+            for (provider, objective, reason), value in sorted(self.routing.items()):
+                lines.append(f'llm_routing_decisions_total{{provider="{provider}",objective="{objective}",reason="{reason}"}} {value}')
+            for name in sorted({name for name, _ in self.gauges}):
+                lines.append(f"# TYPE {name} gauge")
+                for (metric, provider), value in sorted(self.gauges.items()):
+                    if metric == name:
+                        lines.append(f'{name}{{provider="{provider}"}} {value}')
+            for name in ("llm_request_duration_seconds", "llm_time_to_first_token_seconds",
+                         "llm_queue_wait_seconds", "llm_model_load_seconds"):
+                lines.append(f"# TYPE {name} histogram")
+                for (metric, labels), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                        lines.append(f"{name}_bucket{fmt(labels, le=bound)} {count}")
+                    lines.append(f"{name}_bucket{fmt(labels, le='+Inf')} {histogram['count']}")
+                    lines.append(f"{name}_sum{fmt(labels)} {histogram['sum']:.6f}")
+                    lines.append(f"{name}_count{fmt(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+_file_lock = threading.Lock()
+_listeners = []
+_prom_lock = threading.Lock()
+_prom_timer = None
+_prom_written = 0.0
+
+def subscribe(listener):
+    """
+    Call `listener(record)` for every record from now on.
+    """
+    _listeners.append(listener)
+
+def record_call(**fields):
+    """
+    Record one LLM call (or cache hit). Unknown fields are kept in the JSONL record.
+    """
+    record = {field: None for field in RECORD_FIELDS}
+    record.update(fields)
+    record["ts"] = record["ts"] or time.time()
+    for field in ("queue_wait_s", "ttft_s", "latency_s", "load_s"):
+        if record[field] is not None:
+            record[field] = round(record[field], 4)
+    registry.observe(record)
+    for listener in _listeners:
+        try:
+            listener(record)
+        except Exception:
+            pass
+    if METRICS_FILE:
+        line = json.dumps(record) + "\n"
+        with _file_lock:
+            with open(METRICS_FILE, 'a') as file:
+                file.write(line)
+                size = file.tell()
+            if METRICS_MAX_BYTES and size >= METRICS_MAX_BYTES:
+                os.replace(METRICS_FILE, f"{METRICS_FILE}.1")
+    if PROM_FILE:
+        _schedule_prometheus_file()
+    return record
+
+# Rewrite the Prometheus textfile at most every PROM_FILE_INTERVAL seconds.
+# Calls in between share one pending write, so the last record is always included.
+def _schedule_prometheus_file():
+    global _prom_timer
+    with _prom_lock:
+        if _prom_timer is not None:
+            return
+        delay = max(0.0, _prom_written + PROM_FILE_INTERVAL - time.monotonic())
+        _prom_timer = threading.Timer(delay, _flush_prometheus_file)
+        _prom_timer.daemon = True
+        _prom_timer.start()
+
+def _flush_prometheus_file():
+    global _prom_timer, _prom_written
+    with _prom_lock:
+        _prom_timer = None
+        _prom_written = time.monotonic()
+    write_prometheus_file(PROM_FILE)
+
+def record_speculation(outcome, wasted_tokens=0):
+    """
+    Count a speculative generation outcome: "started", "hit", "discarded" or "over_budget".
+    """
+    with registry._lock:
+        registry.speculation[outcome] += 1
+        registry.speculation_wasted_tokens += wasted_tokens
+
+def speculation_stats():
+    """
+    Speculation counters for this process, with the hit rate (hits / started).
+    """
+    with registry._lock:
+        stats = {outcome: registry.speculation.get(outcome, 0) for outcome in ("started", "hit", "discarded", "over_budget")}
+        stats["wasted_tokens"] = registry.speculation_wasted_tokens
+    stats["hit_rate"] = stats["hit"] / stats["started"] if stats["started"] else None
+    return stats
+
+def record_routing(provider, objective, reason):
+    """
+    Count a routing decision: `reason` is "best", "explore" (no history yet) or "fallback".
+    """
+    with registry._lock:
+        registry.routing[(provider, objective, reason)] += 1
+
+def routing_stats():
+    """
+    Routing decisions per provider, by reason.
+    """
+    stats = defaultdict(lambda: defaultdict(int))
+    with registry._lock:
+        for (provider, _, reason), value in registry.routing.items():
+            stats[provider][reason] += value
+    return {provider: dict(reasons) for provider, reasons in stats.items()}
+
+def set_provider_gauge(name, provider, value):
+    with registry._lock:
+        registry.gauges[(name, provider)] = value
+
+def render_prometheus():
+    return registry.render()
+
+def write_prometheus_file(path):
+    tmp_path = f"{path}.tmp"
+    with _file_lock:
+        with open(tmp_path, 'w') as file:
+            file.write(registry.render())
+        os.replace(tmp_path, path)
+
+# --- Reading records back ---
+
+def _parse_lines(lines, since=None):
+    records = []
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if since is None or (record.get("ts") or 0) >= since:
+            records.append(record)
+    return records
+
+def _load_file(file_path, since=None):
+    if not os.path.exists(file_path):
+        return []
+    with open(file_path, 'r') as file:
+        return _parse_lines(file, since)
+
+def load_records(path=METRICS_FILE, since=None):
+    """
+    Records from the JSONL sink and its rotated predecessor, oldest first,
+    optionally only those after the `since` timestamp.
+    """
+    if not path:
+        return []
+    return _load_file(f"{path}.1", since) + _load_file(path, since)
+
+def _stat(file_path):
+    try:
+        return os.stat(file_path)
+    except OSError:
+        return None
+
+class RecordLog:
+    """
+    The JSONL sink's records kept in memory for repeated reads, e.g. by the
+    admin page on every rerun. Each refresh only parses the lines appended
+    since the last one, and starts over after the file is rotated.
+    """
+
+    def __init__(self, path=METRICS_FILE):
+        self.path = path
+        self._records = []
+        self._files = None
+        self._offset = 0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """
+        All records so far, oldest first. The list must not be modified.
+        """
+        with self._lock:
+            if not self.path:
+                return self._records
+            stat, rotated = (_stat(file_path) for file_path in (self.path, f"{self.path}.1"))
+            files = (stat and stat.st_ino, rotated and rotated.st_ino)
+            if files != self._files or (stat and stat.st_size < self._offset):
+                # First read, or the file was rotated: the old file is now <path>.1
+                self._records = _load_file(f"{self.path}.1")
+                self._files = files
+                self._offset = 0
+            if stat and stat.st_size > self._offset:
+                with open(self.path, 'rb') as file:
+                    file.seek(self._offset)
+                    data = file.read()
+                # Leave a partly written last line for the next refresh
+                complete = data[:data.rfind(b"\n") + 1]
+                self._offset += len(complete)
+                self._records = self._records + _parse_lines(complete.decode("utf-8").splitlines())
+            return self._records
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def summarize_by_provider(records):
+    """
+    Per-provider call counts, error rate, cache hit rate and p50/p95/p99 latency
+    and TTFT, plus cold starts and the median latency of cold and warm calls.
+    """
+    groups = defaultdict(list)
+    for record in records:
+        groups[record.get("provider") or "unknown"].append(record)
+    summary = []
+    for provider, group in sorted(groups.items()):
+        calls = [r for r in group if not r.get("cache_hit")]
+        ok = [r for r in calls if not r.get("error_class") and r.get("latency_s") is not None]
+        latencies = [r["latency_s"] for r in ok]
+        ttfts = [r["ttft_s"] for r in ok if r.get("ttft_s") is not None]
+        row = {
+            "provider": provider,
+            "calls": len(calls),
+            "cache_hits": len(group) - len(calls),
+            "error_rate": (len(calls) - len(ok)) / len(calls) if calls else 0.0,
+            "retries": sum(r.get("retries") or 0 for r in calls),
+        }
+        for q in (0.5, 0.95, 0.99):
+            row[f"latency_p{int(q * 100)}"] = percentile(latencies, q)
+            row[f"ttft_p{int(q * 100)}"] = percentile(ttfts, q)
+        row["cold_starts"] = sum(1 for r in calls if r.get("cold_start"))
+        row["cold_latency_p50"] = percentile([r["latency_s"] for r in ok if r.get("cold_start")], 0.5)
+        row["warm_latency_p50"] = percentile([r["latency_s"] for r in ok if r.get("cold_start") is False], 0.5)
+        summary.append(row)
+    return summary
+
+# --- Optional HTTP exporter ---
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+_server = None
+_server_lock = threading.Lock()
+
+def start_metrics_server(port):
+    """
+    Serve the Prometheus exposition on `port` from a background thread (once per process).
+    """
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
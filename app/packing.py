@@ -0,0 +1,136 @@
+"""
+Packing several submissions into one LLM request for batch marking.
+
+Every prompt starts with the same instructions and feedback examples, so
+sending N submissions under one copy of that prefix saves N - 1 copies of it
+and N - 1 round trips. The model is asked for a JSON object keyed by
+submission id. The response is validated and split, and submissions that
+are missing from it or have an empty or malformed entry are handed back to
+be packed again (and eventually graded on their own).
+
+The pack size adapts: it is bounded by what fits in the model's context
+window and output cap, halved when a pack comes back incomplete and grown by
+one after each complete pack.
+"""
+import json
+import os
+import re
+import threading
+
+from llm_inference import GEMINI_GENERATION_CONFIG, OLLAMA_MAX_CTX, OLLAMA_NUM_PREDICT
+
+# Largest number of submissions in one request
+PACK_MAX = int(os.environ.get("PACK_MAX", "16"))
+# Output tokens assumed per submission until real responses have been measured
+PACK_OUTPUT_TOKENS_PER_SUBMISSION = int(os.environ.get("PACK_OUTPUT_TOKENS_PER_SUBMISSION", "400"))
+# Output tokens left free for reasoning models' thinking and the JSON syntax
+PACK_OUTPUT_RESERVE = 1000
+# Use at most this fraction of the context window, since token counts are estimates
+CONTEXT_SAFETY = 0.8
+# Packed attempts per submission before it is graded on its own
+PACK_MAX_ATTEMPTS = 2
+
+# Context window and output cap in tokens for each batch provider (None = no cap)
+PACK_LIMITS = {
+    "gemini": {"context": 1_048_576, "output": GEMINI_GENERATION_CONFIG["max_output_tokens"]},
+    "together": {"context": 131_072, "output": None},
+    "ollama": {"context": OLLAMA_MAX_CTX, "output": OLLAMA_NUM_PREDICT},
+    "fake": {"context": 1_048_576, "output": None},
+}
+# "fastest" may end up on any provider, so it gets the tightest limits
+PACK_LIMITS["fastest"] = {
+    "context": min(limits["context"] for limits in PACK_LIMITS.values()),
+    "output": min(limits["output"] for limits in PACK_LIMITS.values() if limits["output"]),
+}
+
+JSON_STRING = r'"((?:[^"\\]|\\.)*)"'
+ENTRY_PATTERN = re.compile(JSON_STRING + r'\s*:\s*' + JSON_STRING, re.DOTALL)
+
+def estimate_tokens(chars):
+    return chars // 4
+
+def parse_packed_response(text, expected_ids):
+    """
+    Split a packed response into {submission id: feedback}. Returns (feedback
+    by id, ids to retry). Unknown ids and empty entries are ignored. If the
+    JSON is cut off or invalid, the complete entries before the damage are kept.
+    """
+    results = {}
+    start, end = text.find("{"), text.rfind("}")
+    entries = None
+    if start != -1 and end > start:
+        try:
+            entries = json.loads(text[start:end + 1])
+        except json.JSONDecodeError:
+            entries = None
+    if not isinstance(entries, dict):
+        # Salvage the "id": "feedback" pairs that did come through
+        entries = {}
+        for match in ENTRY_PATTERN.finditer(text[start:] if start != -1 else text):
+            try:
+                entries[json.loads(f'"{match.group(1)}"')] = json.loads(f'"{match.group(2)}"')
+            except json.JSONDecodeError:
+                continue
+    for submission_id in expected_ids:
+        feedback = entries.get(str(submission_id))
+        if isinstance(feedback, str) and feedback.strip():
+            results[submission_id] = feedback.strip()
+    retry = [submission_id for submission_id in expected_ids if submission_id not in results]
+    return results, retry
+
+class PackSizer:
+    """
+    Chooses how many submissions go into the next packed request for one provider.
+    """
+
+    def __init__(self, provider, prefix_chars, max_pack=PACK_MAX):
+        limits = PACK_LIMITS.get(provider, PACK_LIMITS["fastest"])
+        self.context_tokens = limits["context"]
+        self.output_tokens = limits["output"]
+        self.prefix_tokens = estimate_tokens(prefix_chars)
+        self.max_pack = max_pack
+        self.size = max_pack
+        self.output_per_submission = PACK_OUTPUT_TOKENS_PER_SUBMISSION
+        self._lock = threading.Lock()
+
+    def fits(self, count, suffix_chars):
+        """
+        Whether `count` submissions with `suffix_chars` characters of prompt in total
+        fit the context window and the output cap.
+        """
+        output = count * self.output_per_submission
+        if self.output_tokens is not None and output + PACK_OUTPUT_RESERVE > self.output_tokens and count > 1:
+            return False
+        prompt = self.prefix_tokens + estimate_tokens(suffix_chars)
+        return count == 1 or prompt + output <= self.context_tokens * CONTEXT_SAFETY
+
+    def take(self, queue, suffix_chars):
+        """
+        Pop the next pack from the left of `queue` (a deque of submissions).
+        `suffix_chars(submission)` is the length of its part of the prompt.
+        """
+        with self._lock:
+            size = self.size
+        pack = []
+        total = 0
+        while queue and len(pack) < size:
+            chars = suffix_chars(queue[0])
+            if pack and not self.fits(len(pack) + 1, total + chars):
+                break
+            pack.append(queue.popleft())
+            total += chars
+        return pack
+
+    def record(self, requested, returned, output_chars):
+        """
+        Adapt the pack size after a response: shrink on an incomplete pack,
+        grow after a complete one, and track the measured output per submission.
+        """
+        with self._lock:
+            if returned:
+                measured = estimate_tokens(output_chars) / returned
+                self.output_per_submission = max(1, int(0.7 * self.output_per_submission + 0.3 * measured))
+            if returned < requested:
+                self.size = max(1, min(self.size, requested) // 2)
+            elif requested >= self.size:
+                self.size = min(self.max_pack, self.size + 1)
@@ -0,0 +1,107 @@
+import os
+import time
+
+import streamlit as st
+
+from metrics import (
+    METRICS_FILE,
+    RecordLog,
+    summarize_by_provider,
+    render_prometheus,
+    speculation_stats,
+    routing_stats
+)
+from router import health, ROUTING_OBJECTIVE
+
+# Admin page with LLM latency percentiles per provider. Hidden unless
+# FEEDBACK_ADMIN is set, since it exposes usage across all markers.
+ADMIN_ENABLED = os.environ.get("FEEDBACK_ADMIN", "").lower() in ("1", "true", "yes")
+
+# Time windows offered for the summary, in hours
+WINDOWS = {"Last hour": 1, "Last 24 hours": 24, "Last 7 days": 24 * 7, "All time": None}
+
+# Records are read once per server process and then only the newly appended
+# lines, instead of the whole file on every rerun
+@st.cache_resource
+def get_record_log():
+    return RecordLog(METRICS_FILE)
+
+def main():
+    st.set_page_config(page_title="LLM Metrics", page_icon="📈", layout="wide")
+    st.title("LLM Metrics")
+    
+    if not ADMIN_ENABLED:
+        st.info("The metrics page is disabled. Set FEEDBACK_ADMIN=1 to enable it.")
+        return
+    
+    window = st.selectbox("Window", list(WINDOWS))
+    hours = WINDOWS[window]
+    since = time.time() - hours * 3600 if hours else None
+    records = [r for r in get_record_log().refresh() if since is None or (r.get("ts") or 0) >= since]
+    st.caption(f"{len(records)} records from `{METRICS_FILE}`")
+    
+    if not records:
+        st.write("No LLM calls recorded yet.")
+        return
+    
+    rows = summarize_by_provider(records)
+    st.subheader("Latency by provider (seconds)")
+    st.dataframe(
+        [
+            {
+                "Provider": row["provider"],
+                "Calls": row["calls"],
+                "Cache hits": row["cache_hits"],
+                "Error rate": f"{row['error_rate']:.1%}",
+                "Retries": row["retries"],
+                "p50": row["latency_p50"],
+                "p95": row["latency_p95"],
+                "p99": row["latency_p99"],
+                "TTFT p50": row["ttft_p50"],
+                "TTFT p95": row["ttft_p95"],
+                "TTFT p99": row["ttft_p99"],
+                "Cold starts": row["cold_starts"],
+                "Cold p50": row["cold_latency_p50"],
+                "Warm p50": row["warm_latency_p50"],
+            }
+            for row in rows
+        ],
+        use_container_width=True
+    )
+    
+    speculation = speculation_stats()
+    if speculation["started"] or speculation["over_budget"]:
+        st.subheader("Speculative pre-generation (this server process)")
+        columns = st.columns(4)
+        columns[0].metric("Started", speculation["started"])
+        columns[1].metric("Hit rate", f"{speculation['hit_rate']:.0%}" if speculation["hit_rate"] is not None else "-")
+        columns[2].metric("Wasted tokens (est.)", speculation["wasted_tokens"])
+        columns[3].metric("Over budget", speculation["over_budget"])
+    
+    st.subheader(f"Provider health and routing (this server process, objective: {ROUTING_OBJECTIVE})")
+    decisions = routing_stats()
+    st.dataframe(
+        [
+            {
+                "Provider": entry["provider"],
+                "Breaker": entry["state"],
+                "Samples": entry["samples"],
+                "Latency EWMA (s)": round(entry["latency"], 3) if entry["latency"] is not None else None,
+                "Error rate EWMA": f"{entry['error_rate']:.1%}",
+                "Cost EWMA ($)": round(entry["cost"], 6) if entry["cost"] is not None else None,
+                "Routed": sum(decisions.get(entry["provider"], {}).values()),
+                "Fallbacks": decisions.get(entry["provider"], {}).get("fallback", 0),
+            }
+            for entry in health.snapshot()
+        ],
+        use_container_width=True
+    )
+    
+    st.subheader("Recent calls")
+    st.dataframe(records[-50:][::-1], use_container_width=True)
+    
+    with st.expander("Prometheus exposition (this server process)"):
+        st.code(render_prometheus(), language="text")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Parallel per-paragraph generation.
+
+Instead of one call writing the general, failing-criteria and learner-requested
+paragraphs one after another, each paragraph gets its own smaller prompt (see
+``prompt_builder.construct_paragraph_prompts``) and the calls run at the same
+time, so the total time is close to that of the slowest paragraph. Chunks are
+yielded as they arrive, tagged with their paragraph's position, so the caller
+can show every paragraph while it is being written and assemble them in order.
+"""
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+PARAGRAPH_SEPARATOR = "\n\n"
+
+# Shared by all sessions; each generation uses one worker per paragraph
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("PARAGRAPH_WORKERS", "16")),
+    thread_name_prefix="paragraph"
+)
+
+def _produce(index, make_stream, prefix, suffix, events, cancel_event):
+    stream = None
+    try:
+        stream = make_stream(prefix, suffix)
+        for chunk in stream:
+            if cancel_event.is_set():
+                return
+            if chunk:
+                events.put((index, chunk, None))
+    except Exception as e:
+        events.put((index, None, e))
+        return
+    finally:
+        # Closing the generator closes the SDK stream and its HTTP response
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+    events.put((index, None, None))
+
+def stream_paragraphs(make_stream, prompts):
+    """
+    Run `make_stream(prefix, suffix)` for every (name, prefix, suffix) in
+    `prompts` concurrently and yield (paragraph index, chunk) as chunks arrive.
+    The first error is raised and the other paragraphs are cancelled; closing
+    this generator early cancels them as well.
+    """
+    events = queue.Queue()
+    cancel_event = threading.Event()
+    for index, (_, prefix, suffix) in enumerate(prompts):
+        _executor.submit(_produce, index, make_stream, prefix, suffix, events, cancel_event)
+    remaining = len(prompts)
+    try:
+        while remaining:
+            index, chunk, error = events.get()
+            if error is not None:
+                raise error
+            if chunk is None:
+                remaining -= 1
+                continue
+            yield index, chunk
+    finally:
+        cancel_event.set()
+
+def join_paragraphs(texts):
+    """
+    The paragraphs in order as one feedback text, skipping empty ones.
+    """
+    return PARAGRAPH_SEPARATOR.join(text.strip() for text in texts if text and text.strip())
@@ -0,0 +1,80 @@
+"""
+Prompt token counting and the input token budget.
+
+``count_tokens`` counts with the provider's tokenizer when one is available
+locally (``tiktoken``'s o200k encoding for the GPT-OSS models on Together and
+Ollama, if installed) and otherwise estimates from the provider's typical
+characters per token.
+
+``select_examples`` keeps a prompt within ``PROMPT_TOKEN_BUDGET`` input tokens.
+While the whole example bank fits and has no more than ``EXAMPLES_TOP_K``
+examples it is sent unchanged, which keeps the prompt prefix stable for the
+providers' prefix caches. Otherwise the ``EXAMPLES_TOP_K`` examples most
+relevant to the request are chosen with the BM25 index (see
+``example_index``), skipping any that would overrun the budget. Such a
+selection goes into the per-request part of the prompt rather than the
+prefix (see ``prompt_builder.split_prompt_prefix``), so the prefix stays the
+same and the Gemini context cache is not re-created for every request.
+"""
+import functools
+import math
+import os
+
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "8000"))
+EXAMPLES_TOP_K = int(os.environ.get("EXAMPLES_TOP_K", "8"))
+
+# Typical characters per token of English text, used when no tokenizer is available
+CHARS_PER_TOKEN = {"gemini": 4.0, "together": 4.2, "ollama": 4.2}
+DEFAULT_CHARS_PER_TOKEN = 4.0
+# Providers serving GPT-OSS, whose tokenizer is o200k based
+O200K_PROVIDERS = ("together", "ollama")
+
+@functools.lru_cache(maxsize=None)
+def _encoding(provider):
+    if provider not in O200K_PROVIDERS:
+        return None
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # Not installed, or the encoding cannot be downloaded
+        return None
+
+def count_tokens(text, provider=None):
+    """
+    Number of input tokens `text` takes for `provider` (exact or estimated).
+    """
+    encoding = _encoding(provider)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN.get(provider, DEFAULT_CHARS_PER_TOKEN))
+
+def select_examples(bank, query, provider, fixed_tokens, budget=PROMPT_TOKEN_BUDGET, top_k=EXAMPLES_TOP_K):
+    """
+    Choose examples from `bank` for a prompt whose other parts take
+    `fixed_tokens`. Returns (examples text, report) where the report has the
+    prompt's token count, how many examples were used out of how many, and the
+    tokens saved compared with sending the whole bank.
+    """
+    counts = bank.token_counts(provider, count_tokens)
+    all_tokens = count_tokens(bank.text, provider)
+    if len(counts) <= top_k and fixed_tokens + all_tokens <= budget:
+        chosen = list(range(len(counts)))
+    else:
+        chosen = []
+        used = fixed_tokens
+        for position in bank.index.rank(query).tolist():
+            if len(chosen) == top_k:
+                break
+            if used + counts[position] <= budget:
+                chosen.append(position)
+                used += counts[position]
+    text = bank.join(chosen)
+    tokens = count_tokens(text, provider)
+    return text, {
+        "prompt_tokens": fixed_tokens + tokens,
+        "budget": budget,
+        "examples": len(chosen),
+        "available": len(counts),
+        "tokens_saved": all_tokens - tokens,
+    }
@@ -0,0 +1,171 @@
+from prompt_budget import count_tokens, select_examples
+
+# Load feedback examples for prompt construction
+def load_feedback_examples(file_path="feedback_examples.md"):
+    with open(file_path, 'r') as file:
+        return file.read()
+
+PROMPT_INSTRUCTIONS = (
+    "You are an expert course project marker. Generate professional, concise feedback for a course project, following these best practices:\n\n"
+)
+
+# Stable instructions + examples that start every prompt. Providers can
+# cache this block because it only changes when the examples file does.
+def construct_prompt_prefix(feedback_examples):
+    return PROMPT_INSTRUCTIONS + feedback_examples + "\n\n"
+
+# The prefix to send separately and the examples block that goes in front of
+# the suffix. Examples chosen for one request would make every prefix different
+# and defeat the providers' prefix caches, so they go into the suffix and only
+# the instructions stay in the prefix. The full prompt text is the same either way.
+def split_prompt_prefix(feedback_examples, per_request_examples):
+    prefix = construct_prompt_prefix(feedback_examples)
+    if per_request_examples:
+        return PROMPT_INSTRUCTIONS, prefix[len(PROMPT_INSTRUCTIONS):]
+    return prefix, ""
+
+# Section asking for the general feedback paragraph, with the checked criteria
+def general_feedback_section(selected_criteria):
+    lines = [
+        "---\n"
+        "Paragraph 1: General Feedback (Strengths and Areas for Improvement)\n"
+        "Summarize the strengths and areas for improvement based on the selected marking criteria and comments below. Combine strengths and improvements in a single paragraph. Do not include any final thoughts or use lists.\n"
+    ]
+    if selected_criteria:
+        lines.append("Checked Marking Criteria and Comments:\n")
+        for part_item in selected_criteria:
+            lines.append(f"- {part_item['id']}: {part_item['title']}\n")
+            for criteria_item in part_item.get("selected_criteria") or ():
+                type_indicator = "Pass" if criteria_item["type"] == "pass" else "Fail"
+                line = f"    - {type_indicator}: {criteria_item['criteria']}"
+                if criteria_item["comment"]:
+                    line += f" | Comment: {criteria_item['comment']}"
+                lines.append(line + "\n")
+    else:
+        lines.append("No marking criteria selected.\n")
+    return "".join(lines)
+
+# Section asking for the failing criteria paragraph
+def failing_feedback_section(failing_feedback):
+    if failing_feedback:
+        return (
+            "---\n"
+            "Paragraph 2: Failing Criteria Feedback\n"
+            "If the following text is not empty, generate a second paragraph explaining why the submission failed these items, focusing only on the failed criteria. Do not use lists.\n"
+            f"Failing Criteria Feedback:\n{failing_feedback}\n"
+        )
+    return (
+        "---\n"
+        "Paragraph 2: Failing Criteria Feedback\n"
+        "No failing criteria feedback provided. Omit this paragraph.\n"
+    )
+
+# Section asking for the learner-requested items paragraph
+def learner_feedback_section(learner_feedback):
+    if learner_feedback:
+        return (
+            "---\n"
+            "Paragraph 3: Learner-Requested Items Feedback\n"
+            "If the following text is not empty, generate a third paragraph with advice or responses to the learner's specific requests. Do not use lists.\n"
+            f"Learner-Requested Items Feedback:\n{learner_feedback}\n"
+        )
+    return (
+        "---\n"
+        "Paragraph 3: Learner-Requested Items Feedback\n"
+        "No learner-requested feedback provided. Omit this paragraph.\n"
+    )
+
+# Text the feedback examples are ranked against: the selected criteria, their
+# comments and the free-text feedback
+def examples_query(selected_criteria, failing_feedback, learner_feedback):
+    parts = [failing_feedback or "", learner_feedback or ""]
+    for part_item in selected_criteria:
+        parts.append(part_item["title"])
+        for criteria_item in part_item.get("selected_criteria") or ():
+            parts.append(criteria_item["criteria"])
+            parts.append(criteria_item["comment"] or "")
+    return "\n".join(parts)
+
+# Feedback examples from the example bank that fit the provider's input token
+# budget, with a report of the prompt size and the tokens saved
+def select_feedback_examples(selected_criteria, failing_feedback, learner_feedback, bank, provider=None):
+    prefix, suffix = construct_prompt_parts(selected_criteria, failing_feedback, learner_feedback, "")
+    return select_examples(
+        bank,
+        examples_query(selected_criteria, failing_feedback, learner_feedback),
+        provider,
+        count_tokens(prefix + suffix, provider)
+    )
+
+# Construct the prompt for the LLM as (stable prefix, per-submission suffix).
+# Set `per_request_examples` when the examples were selected for this request.
+def construct_prompt_parts(selected_criteria, failing_feedback, learner_feedback, feedback_examples,
+                           per_request_examples=False):
+    prefix, examples = split_prompt_prefix(feedback_examples, per_request_examples)
+    prompt = (
+        examples
+        + general_feedback_section(selected_criteria)
+        + failing_feedback_section(failing_feedback)
+        + learner_feedback_section(learner_feedback)
+        + "---\n"
+        "Output only the paragraphs as described above, in order. If a paragraph is to be omitted, do not mention it. Each paragraph should be clearly separated. Do not use lists or headings.\n"
+    )
+    return prefix, prompt
+
+# One (name, prefix, suffix) prompt per paragraph to be written, so the
+# paragraphs can be generated in parallel. Omitted paragraphs get no prompt.
+def construct_paragraph_prompts(selected_criteria, failing_feedback, learner_feedback, feedback_examples,
+                                per_request_examples=False):
+    prefix, examples = split_prompt_prefix(feedback_examples, per_request_examples)
+    sections = [("general", general_feedback_section(selected_criteria))]
+    if failing_feedback:
+        sections.append(("failing", failing_feedback_section(failing_feedback)))
+    if learner_feedback:
+        sections.append(("learner", learner_feedback_section(learner_feedback)))
+    return [
+        (
+            name,
+            prefix,
+            examples + section + "---\n"
+            "Output only this one paragraph. Do not mention any other paragraphs. Do not use lists or headings.\n"
+        )
+        for name, section in sections
+    ]
+
+# Prompt parts asking the LLM to adapt feedback written for a very similar
+# submission instead of writing it from scratch. It is shorter than the full
+# prompt (no examples) and the answer mostly copies the draft.
+def construct_adapt_prompt_parts(draft, selected_criteria, failing_feedback, learner_feedback):
+    prefix = (
+        "You are an expert course project marker. Below is feedback written for a very similar submission, "
+        "followed by the marking criteria and comments for this submission. Adapt the feedback to this "
+        "submission: keep sentences that still apply, change what differs and remove what no longer applies.\n\n"
+    )
+    _, sections = construct_prompt_parts(selected_criteria, failing_feedback, learner_feedback, "")
+    suffix = (
+        f"Feedback for the similar submission:\n{draft}\n\n"
+        + sections
+        + "Output only the adapted feedback.\n"
+    )
+    return prefix, suffix
+
+# Construct the full prompt for the LLM
+def construct_prompt(selected_criteria, failing_feedback, learner_feedback, feedback_examples):
+    prefix, suffix = construct_prompt_parts(selected_criteria, failing_feedback, learner_feedback, feedback_examples)
+    return prefix + suffix
+
+# Construct the per-request part of a packed prompt: several submissions'
+# suffixes under one shared prefix, answered with one JSON object
+def construct_packed_prompt_suffix(items):
+    prompt = (
+        f"You will write feedback for {len(items)} separate submissions. Each submission starts with a line "
+        "\"=== Submission <id> ===\" followed by its own instructions. Write the feedback for each submission "
+        "independently, exactly as you would if it were the only one.\n"
+        "Return only a JSON object that maps each submission id to its feedback text, with no other text before "
+        "or after it, for example {\"id-1\": \"First paragraph.\\n\\nSecond paragraph.\"}. Use the ids exactly as "
+        "given and separate the paragraphs of a feedback text with a blank line.\n"
+    )
+    for submission_id, suffix in items:
+        prompt += f"=== Submission {submission_id} ===\n{suffix}"
+    prompt += f"=== End of submissions ===\nReturn the JSON object with {len(items)} entries now.\n"
+    return prompt
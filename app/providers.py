@@ -0,0 +1,90 @@
+"""
+Registry of LLM providers.
+
+Each provider is registered once with its display label, its streaming
+function and, optionally, blocking and async functions, the model settings
+that go into the response cache key, its price and its concurrency bound.
+The app's model list, the router and batch mode all read from here, so adding
+a provider means registering it rather than editing each of them.
+
+Built-in providers are registered below. Further providers can be added from
+modules listed in ``LLM_PROVIDER_PLUGINS`` (comma separated), which are
+imported after the built-ins and call ``register_provider`` themselves.
+"""
+import importlib
+import os
+
+from llm_inference import (
+    run_gemini_flash,
+    run_deepseek_r1_together,
+    run_ollama_gpt_oss,
+    stream_gemini_flash,
+    stream_deepseek_r1_together,
+    stream_ollama_gpt_oss,
+    arun_gemini_flash,
+    arun_deepseek_r1_together,
+    arun_ollama_gpt_oss,
+    MODEL_SETTINGS,
+    PROVIDER_LABELS,
+    RATE_LIMITS
+)
+
+# Provider key -> provider dict, in registration order (also the fallback order)
+PROVIDERS = {}
+
+def register_provider(key, label, stream, run=None, arun=None, model=None, params=None,
+                      input_cost=0.0, output_cost=0.0, max_in_flight=4):
+    """
+    Register (or replace) a provider. `stream(prompt, prefix=None)` yields text
+    chunks; `run` returns the whole text and defaults to joining the stream.
+    Costs are in dollars per million input and output tokens.
+    """
+    PROVIDERS[key] = {
+        "key": key,
+        "label": label,
+        "stream": stream,
+        "run": run or (lambda prompt, prefix=None: "".join(stream(prompt, prefix=prefix))),
+        "arun": arun,
+        "model": model or key,
+        "params": params or {},
+        "input_cost": input_cost,
+        "output_cost": output_cost,
+        "max_in_flight": max_in_flight,
+    }
+    return PROVIDERS[key]
+
+def get_provider(key):
+    return PROVIDERS[key]
+
+def provider_keys():
+    return list(PROVIDERS)
+
+def provider_label(key):
+    provider = PROVIDERS.get(key)
+    return provider["label"] if provider else key
+
+def _price(name, default):
+    return float(os.environ.get(name, default))
+
+# Built-in providers. Prices are list prices per million tokens and can be
+# overridden, e.g. GEMINI_INPUT_COST=0.3; the local Ollama model costs nothing.
+for _key, _stream, _run, _arun, _input_cost, _output_cost in (
+    ("gemini", stream_gemini_flash, run_gemini_flash, arun_gemini_flash, "0.30", "2.50"),
+    ("together", stream_deepseek_r1_together, run_deepseek_r1_together, arun_deepseek_r1_together, "0.15", "0.60"),
+    ("ollama", stream_ollama_gpt_oss, run_ollama_gpt_oss, arun_ollama_gpt_oss, "0", "0"),
+):
+    register_provider(
+        _key,
+        PROVIDER_LABELS[_key],
+        _stream,
+        run=_run,
+        arun=_arun,
+        model=MODEL_SETTINGS[_key]["model"],
+        params=MODEL_SETTINGS[_key]["params"],
+        input_cost=_price(f"{_key.upper()}_INPUT_COST", _input_cost),
+        output_cost=_price(f"{_key.upper()}_OUTPUT_COST", _output_cost),
+        max_in_flight=RATE_LIMITS[_key]["max_in_flight"]
+    )
+
+for _module in filter(None, (name.strip() for name in os.environ.get("LLM_PROVIDER_PLUGINS", "").split(","))):
+    importlib.import_module(_module)
@@ -0,0 +1,449 @@
+"""
+Routing requests across providers.
+
+"Fastest available": the request goes to the first provider in order. If it
+has not finished after a hedge delay (a percentile of that provider's recent
+latencies) the same request is also sent to the next provider, and whichever
+finishes first wins. The other request is cancelled: its stream is closed,
+which closes the HTTP response, at the next chunk. When a provider fails the
+next one in order is tried. ``stream_fastest`` does the same for the UI, but
+hedges on the time to the first chunk and the first provider to produce
+output wins, so its text can be streamed as it is written.
+
+"Auto": every call record (see ``metrics.subscribe``) updates an EWMA of each
+provider's latency, error rate and cost. Each request goes to the provider
+with the best score under ``ROUTING_OBJECTIVE`` ("latency", "cost" or
+"balanced"), falling back to the next best if it fails before producing any
+output. Providers without history are tried first so every one gets measured.
+
+Both modes skip providers whose circuit breaker is open. It opens after
+``BREAKER_FAILURES`` failures in a row, or at once on a fatal error (e.g. a
+missing API key), since retrying would fail the same way. A background thread
+then probes the provider with a tiny request after the cool-down, doubling the
+cool-down after each failed probe, and closes the breaker when a probe (or
+any other call) succeeds. Routing decisions, breaker states and the EWMAs are
+exported as metrics.
+"""
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from llm_inference import LLMError
+from metrics import subscribe, record_routing, set_provider_gauge
+from providers import PROVIDERS, get_provider, provider_keys
+
+# Hedge after the primary has been running longer than this percentile of its recent latencies
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "0.9"))
+# Hedge delay to use until a provider has enough latency history
+DEFAULT_HEDGE_DELAY = float(os.environ.get("HEDGE_DEFAULT_DELAY", "8.0"))
+MIN_SAMPLES = 5
+# How long a provider is skipped after a fatal error
+FATAL_COOLDOWN_SECONDS = 300
+
+# "latency", "cost" or "balanced" (a weighted mix of the two)
+ROUTING_OBJECTIVE = os.environ.get("ROUTING_OBJECTIVE", "balanced")
+ROUTING_OBJECTIVES = ("latency", "cost", "balanced")
+if ROUTING_OBJECTIVE not in ROUTING_OBJECTIVES:
+    raise ValueError(f"ROUTING_OBJECTIVE must be one of {', '.join(ROUTING_OBJECTIVES)}, not {ROUTING_OBJECTIVE!r}")
+# Weight of cost against latency for the balanced objective
+ROUTING_COST_WEIGHT = float(os.environ.get("ROUTING_COST_WEIGHT", "0.5"))
+# Weight of the newest observation in the moving averages
+ROUTING_EWMA_ALPHA = float(os.environ.get("ROUTING_EWMA_ALPHA", "0.2"))
+BREAKER_FAILURES = int(os.environ.get("BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN_SECONDS = float(os.environ.get("BREAKER_COOLDOWN_SECONDS", "30"))
+BREAKER_MAX_COOLDOWN_SECONDS = 600
+PROBE_PROMPT = "Reply with the single word OK."
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+class NoProviderAvailable(LLMError):
+    """Every provider failed or is cooling down after a fatal error."""
+
+class LatencyTracker:
+    """
+    Recent successful latencies per provider, used to pick the hedge delay.
+    """
+
+    def __init__(self, window=100):
+        self._latencies = {}
+        self._window = window
+        self._lock = threading.Lock()
+
+    def record(self, provider, seconds):
+        with self._lock:
+            self._latencies.setdefault(provider, deque(maxlen=self._window)).append(seconds)
+
+    def percentile(self, provider, q):
+        with self._lock:
+            samples = sorted(self._latencies.get(provider, ()))
+        if len(samples) < MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+latency_tracker = LatencyTracker()
+# Time to the first chunk, for hedging streamed requests
+first_chunk_tracker = LatencyTracker()
+
+class ProviderHealth:
+    """
+    Moving averages and circuit breaker state per provider, fed by call records.
+    """
+
+    def __init__(self):
+        self._providers = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, provider):
+        entry = self._providers.get(provider)
+        if entry is None:
+            entry = self._providers[provider] = {
+                "samples": 0,
+                "latency": None,
+                "error_rate": 0.0,
+                "cost": None,
+                "failures": 0,
+                "state": CLOSED,
+                "open_until": 0.0,
+                "cooldown": BREAKER_COOLDOWN_SECONDS,
+                "probing": False,
+            }
+        return entry
+
+    @staticmethod
+    def _ewma(current, value):
+        return value if current is None else current + ROUTING_EWMA_ALPHA * (value - current)
+
+    def observe(self, record):
+        """
+        Update a provider's averages from one call record (a metrics listener).
+        """
+        provider = record.get("provider")
+        error_class = record.get("error_class")
+        if record.get("cache_hit") or provider not in PROVIDERS or error_class == "GenerationCancelled":
+            return
+        with self._lock:
+            entry = self._entry(provider)
+            entry["samples"] += 1
+            entry["error_rate"] = self._ewma(entry["error_rate"], 1.0 if error_class else 0.0)
+            if error_class:
+                entry["failures"] += 1
+                if entry["state"] == CLOSED:
+                    if error_class == "FatalLLMError":
+                        self._open(provider, entry, FATAL_COOLDOWN_SECONDS)
+                    elif entry["failures"] >= BREAKER_FAILURES:
+                        self._open(provider, entry, entry["cooldown"])
+            else:
+                config = PROVIDERS[provider]
+                cost = ((record.get("prompt_tokens") or 0) * config["input_cost"]
+                        + (record.get("output_tokens") or 0) * config["output_cost"]) / 1e6
+                entry["latency"] = self._ewma(entry["latency"], record.get("latency_s") or 0.0)
+                entry["cost"] = self._ewma(entry["cost"], cost)
+                entry["failures"] = 0
+                if entry["state"] != CLOSED:
+                    entry["state"] = CLOSED
+                    entry["cooldown"] = BREAKER_COOLDOWN_SECONDS
+            self._publish(provider, entry)
+
+    # Called with self._lock held
+    def _open(self, provider, entry, cooldown):
+        entry["state"] = OPEN
+        entry["open_until"] = time.time() + cooldown
+        if not entry["probing"]:
+            entry["probing"] = True
+            threading.Thread(target=self._probe, args=(provider,), name=f"probe-{provider}", daemon=True).start()
+
+    # Called with self._lock held
+    def _publish(self, provider, entry):
+        set_provider_gauge("llm_circuit_breaker_open", provider, 0 if entry["state"] == CLOSED else 1)
+        set_provider_gauge("llm_provider_error_rate_ewma", provider, round(entry["error_rate"], 4))
+        if entry["latency"] is not None:
+            set_provider_gauge("llm_provider_latency_ewma_seconds", provider, round(entry["latency"], 4))
+            set_provider_gauge("llm_provider_cost_ewma_dollars", provider, round(entry["cost"], 8))
+
+    def _probe(self, provider):
+        """
+        Background recovery: after each cool-down, send a tiny request until one succeeds.
+        """
+        while True:
+            with self._lock:
+                entry = self._entry(provider)
+                if entry["state"] == CLOSED:
+                    entry["probing"] = False
+                    return
+                wait_seconds = entry["open_until"] - time.time()
+                if wait_seconds <= 0:
+                    entry["state"] = HALF_OPEN
+            if wait_seconds > 0:
+                time.sleep(wait_seconds)
+                continue
+            try:
+                get_provider(provider)["run"](PROBE_PROMPT)
+                ok = True
+            except Exception:
+                ok = False
+            with self._lock:
+                entry = self._entry(provider)
+                if ok:
+                    # The probe's own call record has usually closed it already
+                    entry["state"] = CLOSED
+                    entry["failures"] = 0
+                    entry["cooldown"] = BREAKER_COOLDOWN_SECONDS
+                elif entry["state"] != CLOSED:
+                    entry["cooldown"] = min(entry["cooldown"] * 2, BREAKER_MAX_COOLDOWN_SECONDS)
+                    entry["state"] = OPEN
+                    entry["open_until"] = time.time() + entry["cooldown"]
+                self._publish(provider, entry)
+
+    def available(self, order=None):
+        with self._lock:
+            return [p for p in (order or provider_keys()) if self._entry(p)["state"] == CLOSED]
+
+    def rank(self, order=None, objective=ROUTING_OBJECTIVE):
+        """
+        Available providers, best first under `objective`, as (provider, reason)
+        where reason is "explore" for providers without history, else "best".
+        """
+        with self._lock:
+            entries = {p: dict(self._entry(p)) for p in (order or provider_keys()) if self._entry(p)["state"] == CLOSED}
+        unexplored = [p for p, entry in entries.items() if entry["samples"] == 0]
+        measured = {p: entry for p, entry in entries.items() if entry["samples"]}
+        latencies = [entry["latency"] for entry in measured.values() if entry["latency"] is not None]
+        costs = [entry["cost"] for entry in measured.values() if entry["cost"] is not None]
+        max_latency = max(latencies, default=0.0) or 1.0
+        max_cost = max(costs, default=0.0)
+
+        def score(entry):
+            # Only failures so far: assume it is as slow and as expensive as the worst
+            latency = entry["latency"] if entry["latency"] is not None else max_latency
+            cost = entry["cost"] if entry["cost"] is not None else max_cost
+            success = max(0.05, 1.0 - entry["error_rate"])
+            if objective == "latency":
+                value = latency
+            elif objective == "cost":
+                # Latency only breaks ties between equally priced providers
+                value = cost + 1e-9 * latency
+            else:
+                value = (1 - ROUTING_COST_WEIGHT) * latency / max_latency
+                if max_cost:
+                    value += ROUTING_COST_WEIGHT * cost / max_cost
+            return value / success
+
+        ranked = sorted(measured, key=lambda p: score(measured[p]))
+        return [(p, "explore") for p in unexplored] + [(p, "best") for p in ranked]
+
+    def snapshot(self):
+        with self._lock:
+            return [dict(self._entry(p), provider=p) for p in provider_keys()]
+
+health = ProviderHealth()
+subscribe(health.observe)
+
+# Shared so losing requests can finish closing in the background without blocking the caller
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="router")
+
+def available_providers(order=None):
+    return health.available(order)
+
+def hedge_delay(provider, percentile=HEDGE_PERCENTILE, tracker=None):
+    delay = (tracker or latency_tracker).percentile(provider, percentile)
+    return DEFAULT_HEDGE_DELAY if delay is None else delay
+
+def _run_provider(provider, prompt, prefix, cancel_event, events=None):
+    """
+    Read one provider's stream. Returns the whole text, or with `events` puts
+    (provider, chunk, error) on it for every chunk, then (provider, None, None)
+    when the stream ends or (provider, None, error) if it fails.
+    """
+    start = time.time()
+    chunks = []
+    try:
+        stream = get_provider(provider)["stream"](prompt, prefix=prefix)
+        try:
+            for chunk in stream:
+                if cancel_event.is_set():
+                    return None
+                if not chunks:
+                    first_chunk_tracker.record(provider, time.time() - start)
+                chunks.append(chunk)
+                if events is not None:
+                    events.put((provider, chunk, None))
+        finally:
+            # Closing the generator closes the SDK stream and its HTTP response
+            stream.close()
+    except Exception as e:
+        if events is None:
+            raise
+        events.put((provider, None, e))
+        return None
+    latency_tracker.record(provider, time.time() - start)
+    if events is not None:
+        events.put((provider, None, None))
+    return "".join(chunks)
+
+def generate_fastest(prompt, prefix=None, order=None, percentile=HEDGE_PERCENTILE):
+    """
+    Run `prompt` on the fastest available provider with hedging and fallback.
+    Returns (feedback, provider key). Raises NoProviderAvailable if all fail.
+    """
+    queue = available_providers(order)
+    if not queue:
+        raise NoProviderAvailable("all providers", "every provider's circuit breaker is open")
+
+    cancel_events = {}
+    running = {}
+    errors = []
+
+    def start_next():
+        provider = queue.pop(0)
+        cancel_events[provider] = threading.Event()
+        future = _executor.submit(_run_provider, provider, prompt, prefix, cancel_events[provider])
+        running[future] = provider
+        return provider
+
+    primary = start_next()
+    timeout = hedge_delay(primary, percentile)
+    try:
+        while running:
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # Primary is slower than usual: hedge with the next provider
+                if queue:
+                    start_next()
+                timeout = None
+                continue
+            for future in done:
+                provider = running.pop(future)
+                try:
+                    return future.result(), provider
+                except LLMError as e:
+                    errors.append(e)
+            # Fall back to the next provider if nothing else is still running
+            if not running and queue:
+                start_next()
+                timeout = None
+    finally:
+        for event in cancel_events.values():
+            event.set()
+        for future in running:
+            future.cancel()
+
+    messages = "; ".join(str(e) for e in errors)
+    raise NoProviderAvailable("all providers", messages or "no provider returned a result")
+
+def run_fastest(prompt, prefix=None):
+    """
+    Blocking "fastest available" call with the same signature as the run_* functions.
+    """
+    feedback, _ = generate_fastest(prompt, prefix=prefix)
+    return feedback
+
+def stream_fastest(prompt, prefix=None, order=None, percentile=HEDGE_PERCENTILE, on_provider=None):
+    """
+    Streaming "fastest available": hedge and fall back like generate_fastest,
+    but the first provider to produce output wins and its chunks are yielded
+    as they arrive. The hedge delay is a percentile of the provider's time to
+    the first chunk. `on_provider(key)` is called with the provider that
+    answers. A failure after output has started is raised, not retried.
+    Raises NoProviderAvailable if all fail.
+    """
+    waiting = available_providers(order)
+    if not waiting:
+        raise NoProviderAvailable("all providers", "every provider's circuit breaker is open")
+
+    events = queue.Queue()
+    cancel_events = {}
+    errors = []
+    winner = None
+
+    def start_next():
+        provider = waiting.pop(0)
+        cancel_events[provider] = threading.Event()
+        _executor.submit(_run_provider, provider, prompt, prefix, cancel_events[provider], events)
+        return provider
+
+    primary = start_next()
+    running = {primary}
+    timeout = hedge_delay(primary, percentile, first_chunk_tracker)
+    try:
+        while winner is not None or running:
+            try:
+                provider, chunk, error = events.get(timeout=timeout)
+            except queue.Empty:
+                # No output yet: hedge with the next provider
+                if waiting:
+                    running.add(start_next())
+                timeout = None
+                continue
+            if winner is None and error is None:
+                # First output (or an empty answer) decides the race
+                winner = provider
+                timeout = None
+                running.clear()
+                for other, event in cancel_events.items():
+                    if other != provider:
+                        event.set()
+                if on_provider is not None:
+                    on_provider(provider)
+            if provider != winner:
+                if provider in running:
+                    running.discard(provider)
+                    if not isinstance(error, LLMError):
+                        raise error
+                    errors.append(error)
+                    # Fall back to the next provider if nothing else is still running
+                    if not running and waiting:
+                        running.add(start_next())
+                        timeout = None
+                continue
+            if error is not None:
+                raise error
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        for event in cancel_events.values():
+            event.set()
+
+    messages = "; ".join(str(e) for e in errors)
+    raise NoProviderAvailable("all providers", messages or "no provider returned a result")
+
+def stream_auto(prompt, prefix=None, order=None, objective=ROUTING_OBJECTIVE, on_provider=None):
+    """
+    Stream `prompt` from the best provider under `objective`, falling back to
+    the next best while no output has been produced. `on_provider(key)` is
+    called with the provider that answers. Raises NoProviderAvailable if all fail.
+    """
+    ranked = health.rank(order, objective)
+    if not ranked:
+        raise NoProviderAvailable("all providers", "every provider's circuit breaker is open")
+    errors = []
+    for attempt, (provider, reason) in enumerate(ranked):
+        record_routing(provider, objective, "fallback" if attempt else reason)
+        stream = get_provider(provider)["stream"](prompt, prefix=prefix)
+        started = False
+        try:
+            for chunk in stream:
+                if not started:
+                    started = True
+                    if on_provider is not None:
+                        on_provider(provider)
+                yield chunk
+            if not started and on_provider is not None:
+                on_provider(provider)
+            return
+        except LLMError as e:
+            if started:
+                raise
+            errors.append(e)
+        finally:
+            stream.close()
+    raise NoProviderAvailable("all providers", "; ".join(str(e) for e in errors))
+
+def run_auto(prompt, prefix=None):
+    """
+    Blocking "auto" call with the same signature as the run_* functions.
+    """
+    return "".join(stream_auto(prompt, prefix=prefix))
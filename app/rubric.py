@@ -0,0 +1,213 @@
+"""
+Marking rubric parsing and lookup, shared by the Streamlit app and batch mode.
+
+``load_marking_criteria`` parses ``marking_criteria.md`` once and keeps the
+result until the file changes (checked by mtime and size, then by content
+hash), so Streamlit reruns do not re-parse the file. An optional JSON snapshot
+lets a fresh process skip parsing altogether. ``load_rubric_index`` adds an
+id-keyed index of parts and individual criteria for O(1) lookup.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+
+# Compiled once at import instead of on every line
+SECTION_PATTERN = re.compile(r'### \*\*Part (\d+)\*\*')
+PART_PATTERN = re.compile(r'#### \*\*Part (\d+)\.(\d+):\*\* (.*)')
+CRITERION_PATTERN = re.compile(r'- \[\s?\]\s*\*\*(Pass|Fail)\*\*:\s*(.*)')
+
+SNAPSHOT_VERSION = 1
+
+# Parse marking criteria from the markdown file
+def parse_marking_criteria(file_path="marking_criteria.md"):
+    criteria = []
+
+    try:
+        with open(file_path, 'r') as file:
+            lines = file.read().splitlines()
+    except OSError:
+        return []
+
+    current_section = None
+    current_part = None
+
+    for line in lines:
+        line = line.rstrip()
+
+        # Cheap prefix checks first so most lines never reach a regex
+        if line.startswith("#### "):
+            part_match = PART_PATTERN.match(line)
+            if part_match:
+                section_num, part_num, title = part_match.groups()
+                current_section = f"Part {section_num}"
+                title = title.strip()
+                current_part = {
+                    "id": f"Part {section_num}.{part_num}",
+                    "section": current_section,
+                    "title": title,
+                    "pass_criteria": [],
+                    "fail_criteria": [],
+                    "description": title
+                }
+                criteria.append(current_part)
+        elif line.startswith("### "):
+            section_match = SECTION_PATTERN.match(line)
+            if section_match:
+                current_section = f"Part {section_match.group(1)}"
+        elif line.startswith("- [") and current_part is not None:
+            criterion_match = CRITERION_PATTERN.match(line)
+            if criterion_match:
+                kind, text = criterion_match.groups()
+                key = "pass_criteria" if kind == "Pass" else "fail_criteria"
+                current_part[key].append(text.strip())
+
+    return criteria
+
+# Id-keyed lookup tables for parts and individual criteria
+def build_rubric_index(criteria):
+    parts = {}
+    items = {}
+    for part in criteria:
+        parts[part["id"]] = part
+        for kind in ("pass", "fail"):
+            for i, text in enumerate(part[f"{kind}_criteria"]):
+                criteria_id = f"{part['id']}_{kind}_{i}"
+                items[criteria_id] = {
+                    "id": criteria_id,
+                    "parent_id": part["id"],
+                    "type": kind,
+                    "criteria": text,
+                    "position": len(items)
+                }
+    return {"parts": parts, "criteria": items}
+
+# Turn {criterion id: comment} selections into the payload construct_prompt expects
+def build_selected_criteria(index, selections):
+    selected = []
+    by_part = {}
+    ordered = sorted(
+        (index["criteria"][criteria_id] for criteria_id in selections if criteria_id in index["criteria"]),
+        key=lambda item: item["position"]
+    )
+    for item in ordered:
+        part_id = item["parent_id"]
+        if part_id not in by_part:
+            by_part[part_id] = {
+                "id": part_id,
+                "title": index["parts"][part_id]["description"],
+                "selected_criteria": []
+            }
+            selected.append(by_part[part_id])
+        by_part[part_id]["selected_criteria"].append({
+            "id": item["id"],
+            "parent_id": part_id,
+            "type": item["type"],
+            "criteria": item["criteria"],
+            "comment": selections[item["id"]] or ""
+        })
+    return selected
+
+# --- Cached loading ---
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+def _file_digest(file_path):
+    with open(file_path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+def _read_snapshot(snapshot_path, stat, digest_fn):
+    try:
+        with open(snapshot_path, 'r') as file:
+            snapshot = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        return None
+    if snapshot.get("mtime_ns") == stat.st_mtime_ns and snapshot.get("size") == stat.st_size:
+        return snapshot
+    if snapshot.get("sha256") == digest_fn():
+        return snapshot
+    return None
+
+def _write_snapshot(snapshot_path, stat, digest, criteria):
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": digest,
+        "criteria": criteria
+    }
+    tmp_path = f"{snapshot_path}.tmp"
+    try:
+        with open(tmp_path, 'w') as file:
+            json.dump(snapshot, file)
+        os.replace(tmp_path, snapshot_path)
+    except OSError:
+        # A snapshot is only an optimisation; a read-only directory is fine
+        pass
+
+def _load_entry(file_path, snapshot_path):
+    file_path = os.path.abspath(file_path)
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return {"criteria": [], "index": build_rubric_index([])}
+
+    entry = _cache.get(file_path)
+    if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+        return entry
+
+    with _cache_lock:
+        entry = _cache.get(file_path)
+        if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            return entry
+
+        digest = None
+        def digest_fn():
+            nonlocal digest
+            if digest is None:
+                digest = _file_digest(file_path)
+            return digest
+
+        criteria = None
+        # Touched but unchanged file: keep the parsed result
+        if entry and entry["sha256"] == digest_fn():
+            criteria = entry["criteria"]
+        if criteria is None and snapshot_path:
+            snapshot = _read_snapshot(snapshot_path, stat, digest_fn)
+            if snapshot is not None:
+                criteria = snapshot["criteria"]
+        if criteria is None:
+            criteria = parse_marking_criteria(file_path)
+            if snapshot_path:
+                _write_snapshot(snapshot_path, stat, digest_fn(), criteria)
+
+        entry = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": digest_fn(),
+            "criteria": criteria,
+            "index": build_rubric_index(criteria)
+        }
+        _cache[file_path] = entry
+        return entry
+
+def load_marking_criteria(file_path="marking_criteria.md", snapshot_path=None):
+    """
+    Parsed criteria for `file_path`, re-parsed only when the file changes.
+    The returned list is shared between callers and must not be modified.
+    """
+    return _load_entry(file_path, snapshot_path)["criteria"]
+
+def load_rubric_index(file_path="marking_criteria.md", snapshot_path=None):
+    """
+    Id-keyed index ({"parts": ..., "criteria": ...}) for `file_path`, cached like load_marking_criteria.
+    """
+    return _load_entry(file_path, snapshot_path)["index"]
+
+def clear_rubric_cache():
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,253 @@
+"""
+Per-provider request scheduling: rate limits, bounded concurrency and retries.
+
+Every LLM call from the app, batch mode and the router goes through the
+scheduler for its provider, so concurrent users of one server process share a
+single budget instead of each hitting the API at full speed. A scheduler
+combines:
+
+- token buckets for requests per minute and tokens per minute,
+- a cap on requests in flight,
+- retries of retryable errors with exponential backoff and full jitter,
+  honouring the server's Retry-After for every caller of that provider.
+
+Errors are retried when they have a true ``retryable`` attribute (see
+``llm_inference.RetryableLLMError``). Coroutines scheduled with ``acall``
+share the same budget as threads, but never block the event loop: a
+coroutine waiting for a slot is woken by the release that frees it.
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `per_minute` tokens per minute.
+    A rate of 0 means unlimited.
+    """
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.capacity = per_minute
+        self._tokens = per_minute
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount=1):
+        """
+        Take `amount` tokens and return how long to wait before using them.
+        The balance may go negative, which makes later callers wait their turn.
+        """
+        if self.per_minute <= 0:
+            return 0.0
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.per_minute / 60)
+            self._updated = now
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens * 60 / self.per_minute
+
+class ProviderScheduler:
+    """
+    Rate limiting, concurrency limiting and retries for one provider.
+    """
+
+    def __init__(self, name, requests_per_minute=0, tokens_per_minute=0, max_in_flight=8,
+                 max_retries=3, base_delay=1.0, max_delay=30.0):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        # (event loop, future) for each coroutine waiting for a slot, oldest first
+        self._async_waiters = deque()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _acquire(self, tokens, stats):
+        start = time.monotonic()
+        self._in_flight.acquire()
+        try:
+            with self._lock:
+                pause = self._paused_until - time.monotonic()
+            wait = max(pause, self.requests.reserve(1), self.tokens.reserve(tokens))
+            if wait > 0:
+                time.sleep(wait)
+        except BaseException:
+            self._release()
+            raise
+        if stats is not None:
+            stats["queue_wait"] = stats.get("queue_wait", 0.0) + time.monotonic() - start
+
+    def _release(self):
+        self._in_flight.release()
+        self._wake_async_waiter()
+
+    def _wake_async_waiter(self):
+        # Let the longest waiting coroutine try for the freed slot, on its own loop
+        while True:
+            with self._lock:
+                if not self._async_waiters:
+                    return
+                loop, waiter = self._async_waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(self._notify, waiter)
+                return
+            except RuntimeError:
+                # Its event loop has been closed
+                continue
+
+    def _notify(self, waiter):
+        if waiter.done():
+            # Cancelled meanwhile: pass the wake-up on
+            self._wake_async_waiter()
+        else:
+            waiter.set_result(None)
+
+    def _forget_waiter(self, loop, waiter):
+        with self._lock:
+            try:
+                self._async_waiters.remove((loop, waiter))
+                return
+            except ValueError:
+                pass
+        # Already picked to be woken: make sure the wake-up is not lost
+        if waiter.done() and not waiter.cancelled():
+            self._wake_async_waiter()
+        else:
+            waiter.cancel()
+
+    async def _acquire_async(self, tokens, stats):
+        start = time.monotonic()
+        # Wait for a slot without blocking the event loop on the shared semaphore
+        while not self._in_flight.acquire(blocking=False):
+            loop = asyncio.get_running_loop()
+            waiter = loop.create_future()
+            with self._lock:
+                self._async_waiters.append((loop, waiter))
+            # A slot freed before this waiter was queued would not wake it
+            if self._in_flight.acquire(blocking=False):
+                self._forget_waiter(loop, waiter)
+                break
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                self._forget_waiter(loop, waiter)
+                raise
+        try:
+            with self._lock:
+                pause = self._paused_until - time.monotonic()
+            wait = max(pause, self.requests.reserve(1), self.tokens.reserve(tokens))
+            if wait > 0:
+                await asyncio.sleep(wait)
+        except BaseException:
+            # Includes cancellation while waiting for the rate limit
+            self._release()
+            raise
+        if stats is not None:
+            stats["queue_wait"] = stats.get("queue_wait", 0.0) + time.monotonic() - start
+
+    def _retry_delay(self, error, attempt):
+        """
+        Delay before retrying `error`, or None if it should not be retried.
+        """
+        if not getattr(error, "retryable", False) or attempt >= self.max_retries:
+            return None
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after:
+            # The server asked everyone to back off, not just this caller
+            with self._lock:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            return retry_after
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, fn, tokens=0, stats=None):
+        """
+        Run `fn()` under the provider's limits, retrying retryable errors.
+        `stats`, if given, is filled with queue_wait (seconds) and retries.
+        """
+        attempt = 0
+        while True:
+            self._acquire(tokens, stats)
+            try:
+                return fn()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+            finally:
+                self._release()
+            attempt += 1
+            if stats is not None:
+                stats["retries"] = attempt
+            time.sleep(delay)
+
+    async def acall(self, make_coroutine, tokens=0, stats=None):
+        """
+        Await `make_coroutine()` under the provider's limits, retrying retryable
+        errors. The async counterpart of `call`; cancellation releases the slot.
+        """
+        attempt = 0
+        while True:
+            await self._acquire_async(tokens, stats)
+            try:
+                return await make_coroutine()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+            finally:
+                self._release()
+            attempt += 1
+            if stats is not None:
+                stats["retries"] = attempt
+            await asyncio.sleep(delay)
+
+    def stream(self, make_stream, tokens=0, stats=None):
+        """
+        Yield from `make_stream()` under the provider's limits. Failures are
+        retried only before the first chunk, so no output is ever repeated.
+        """
+        attempt = 0
+        while True:
+            self._acquire(tokens, stats)
+            started = False
+            try:
+                for chunk in make_stream():
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                delay = None if started else self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+            finally:
+                self._release()
+            attempt += 1
+            if stats is not None:
+                stats["retries"] = attempt
+            time.sleep(delay)
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def get_scheduler(provider, **limits):
+    """
+    The process-wide scheduler for `provider`, created with `limits` on first use.
+    """
+    scheduler = _schedulers.get(provider)
+    if scheduler is None:
+        with _schedulers_lock:
+            scheduler = _schedulers.get(provider)
+            if scheduler is None:
+                scheduler = ProviderScheduler(provider, **limits)
+                _schedulers[provider] = scheduler
+    return scheduler
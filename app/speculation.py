@@ -0,0 +1,140 @@
+"""
+Speculative pre-generation while the marker is still editing.
+
+Markers usually tick the criteria first and then spend a while typing the
+free-text fields. With speculation on, once the prompt built from the current
+selections has not changed for ``SPECULATE_DEBOUNCE_SECONDS``, a background
+job is started for it with the same job key and cache keys Generate would use.
+If the prompt at Generate time is the same, Generate attaches to that job or
+finds its result in the response cache. If the prompt changes first, the
+speculative job is cancelled and its tokens are counted as wasted.
+
+Speculation is bounded by a process-wide budget of estimated tokens per hour
+(``SPECULATE_TOKEN_BUDGET``, 0 turns it off). Outcomes are counted in
+``metrics`` (``llm_speculation_total`` and
+``llm_speculation_wasted_tokens_total``).
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from metrics import record_speculation
+
+SPECULATE_DEBOUNCE_SECONDS = float(os.environ.get("SPECULATE_DEBOUNCE_SECONDS", "3"))
+# Estimated tokens that speculative jobs may use per hour, across all sessions
+SPECULATE_TOKEN_BUDGET = int(os.environ.get("SPECULATE_TOKEN_BUDGET", "200000"))
+# Output tokens assumed per generated part when charging the budget
+SPECULATE_OUTPUT_TOKENS = 500
+
+def estimate_tokens(prompt_chars, parts=1):
+    return prompt_chars // 4 + SPECULATE_OUTPUT_TOKENS * parts
+
+def wasted_tokens(job, prompt_chars):
+    """
+    Estimated tokens a discarded job used: its prompt if it was sent, plus
+    the output written so far.
+    """
+    if job.started is None:
+        return 0
+    return prompt_chars // 4 + sum(len(text) for text in job.texts) // 4
+
+class SpeculationBudget:
+    """
+    Rolling one-hour budget of estimated tokens, shared by all sessions.
+    """
+
+    def __init__(self, tokens_per_hour=SPECULATE_TOKEN_BUDGET):
+        self.tokens_per_hour = tokens_per_hour
+        self._spent = deque()
+        self._lock = threading.Lock()
+
+    def spent(self):
+        with self._lock:
+            self._expire(time.time())
+            return sum(tokens for _, tokens in self._spent)
+
+    def try_spend(self, tokens):
+        """
+        Charge `tokens` if they fit in the last hour's budget. Returns whether they did.
+        """
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if sum(spent for _, spent in self._spent) + tokens > self.tokens_per_hour:
+                return False
+            self._spent.append((now, tokens))
+            return True
+
+    # Called with self._lock held
+    def _expire(self, now):
+        while self._spent and self._spent[0][0] < now - 3600:
+            self._spent.popleft()
+
+budget = SpeculationBudget()
+
+class Speculator:
+    """
+    One session's speculation: the job key being watched, since when it has
+    been unchanged, and the speculative job started for it, if any.
+    """
+
+    def __init__(self, debounce=SPECULATE_DEBOUNCE_SECONDS):
+        self.debounce = debounce
+        self.key = None
+        self.since = 0.0
+        self.job = None
+        self.prompt_chars = 0
+        # Nothing more to do for this key: started, cached, over budget or generated
+        self.settled = False
+
+    def watch(self, key):
+        """
+        Note the job key for the current selections. Returns True once it has
+        been unchanged for the debounce interval and is not settled yet.
+        """
+        now = time.time()
+        if key != self.key:
+            self.discard()
+            self.key, self.since, self.settled = key, now, False
+            return False
+        return not self.settled and now - self.since >= self.debounce
+
+    def started(self, job, prompt_chars):
+        self.job = job
+        self.prompt_chars = prompt_chars
+        self.settled = True
+        record_speculation("started")
+
+    def settle(self):
+        self.settled = True
+
+    def claim(self, key):
+        """
+        Called on Generate with its job key. Returns whether a speculative job
+        was started for exactly this key; one for any other key is discarded.
+        Either way nothing more is speculated until the selections change.
+        """
+        hit = self.job is not None and key == self.key
+        if hit:
+            record_speculation("hit")
+            self.job = None
+        else:
+            self.discard()
+        self.key, self.settled = key, True
+        return hit
+
+    def discard(self):
+        """
+        Cancel the speculative job unless a real request adopted it, and count it as wasted.
+        """
+        job, self.job = self.job, None
+        if job is None or not job.speculative:
+            return
+        if job.active:
+            job.cancel()
+        record_speculation("discarded", wasted_tokens(job, self.prompt_chars))
+
+    def reset(self):
+        self.discard()
+        self.key, self.settled = None, False
@@ -0,0 +1,98 @@
+"""
+Cold start profiling.
+
+Set ``STARTUP_PROFILE=1`` to see where a fresh server process spends its time
+before the first page is shown. ``profile_imports`` times every module the
+app imports for the first time (including the modules that import pulls in),
+and ``stage`` times named steps such as parsing the rubric. Imports are only
+timed on the thread that called ``profile_imports``, so the background
+warm-up does not show up as startup time. The report is written to stderr
+once, by ``log_startup_report`` at the end of the first run of the app
+script, and the import hook is removed again. Without ``STARTUP_PROFILE``
+all three do nothing.
+"""
+import builtins
+import contextlib
+import os
+import sys
+import threading
+import time
+
+STARTUP_PROFILE = os.environ.get("STARTUP_PROFILE", "").lower() in ("1", "true", "yes")
+# Number of slowest imports listed in the report
+STARTUP_PROFILE_TOP = int(os.environ.get("STARTUP_PROFILE_TOP", "15"))
+
+# Module name -> seconds its first import took, including nested imports
+_imports = {}
+# (stage name, seconds), in the order they finished
+_stages = []
+# The import function before profiling; kept so a late import on another
+# thread still works after the hook is removed
+_original_import = builtins.__import__
+_hooked = False
+_thread = None
+_started = None
+_reported = False
+_lock = threading.Lock()
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    # Relative imports and modules that are already loaded cost next to nothing
+    if level or name in sys.modules or threading.get_ident() != _thread:
+        return _original_import(name, globals, locals, fromlist, level)
+    start = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        _imports.setdefault(name, time.perf_counter() - start)
+
+def profile_imports():
+    """
+    Start timing imports, if STARTUP_PROFILE is set and the report has not been written yet.
+    """
+    global _hooked, _thread, _started
+    with _lock:
+        if not STARTUP_PROFILE or _reported or _hooked:
+            return
+        _hooked = True
+        _thread = threading.get_ident()
+        _started = time.perf_counter()
+        builtins.__import__ = _timed_import
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Time the enclosed block as a named startup stage (only until the report is written).
+    """
+    if not STARTUP_PROFILE or _reported:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stages.append((name, time.perf_counter() - start))
+
+def startup_report(top=STARTUP_PROFILE_TOP):
+    lines = []
+    if _started is not None:
+        lines.append(f"Startup: {(time.perf_counter() - _started) * 1000:.0f} ms from the first profiled import")
+    for name, seconds in _stages:
+        lines.append(f"  stage  {seconds * 1000:8.1f} ms  {name}")
+    slowest = sorted(_imports.items(), key=lambda item: -item[1])[:top]
+    for name, seconds in slowest:
+        lines.append(f"  import {seconds * 1000:8.1f} ms  {name}")
+    return "\n".join(lines)
+
+def log_startup_report():
+    """
+    Write the report to stderr and remove the import hook. Only the first call does anything.
+    """
+    global _reported, _hooked
+    with _lock:
+        if not STARTUP_PROFILE or _reported:
+            return
+        _reported = True
+        if _hooked:
+            builtins.__import__ = _original_import
+            _hooked = False
+    print(startup_report(), file=sys.stderr, flush=True)
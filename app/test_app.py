@@ -0,0 +1,43 @@
+import os
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.chdir(APP_DIR)
+    return AppTest.from_file(os.path.join(APP_DIR, "app.py"), default_timeout=30).run()
+
+def test_selections_are_kept_in_an_id_keyed_dict(app):
+    assert app.session_state.selected_criteria == {}
+
+    app.checkbox(key="check_Part 1.1_pass_0").check().run()
+    app.checkbox(key="check_Part 3.3_fail_0").check().run()
+    assert app.session_state.selected_criteria == {"Part 1.1_pass_0": "", "Part 3.3_fail_0": ""}
+
+    app.text_area(key="comment_Part 1.1_pass_0").input("Nice framing").run()
+    assert app.session_state.selected_criteria["Part 1.1_pass_0"] == "Nice framing"
+
+    app.checkbox(key="check_Part 1.1_pass_0").uncheck().run()
+    assert app.session_state.selected_criteria == {"Part 3.3_fail_0": ""}
+    assert not app.exception
+
+def test_speculation_rebuilds_the_request_only_when_inputs_change(app, monkeypatch):
+    import prompt_builder
+    calls = []
+    build = prompt_builder.construct_prompt_parts
+    monkeypatch.setattr(prompt_builder, "construct_prompt_parts", lambda *args: calls.append(1) or build(*args))
+    monkeypatch.setenv("SPECULATE_DEBOUNCE_SECONDS", "3600")
+
+    next(box for box in app.sidebar.checkbox if box.label == "Pre-generate while editing").check().run()
+    app.checkbox(key="check_Part 1.1_pass_0").check().run()
+    built = len(calls)
+    assert built
+    for _ in range(3):
+        app.run()
+    assert len(calls) == built
+    app.text_area(key="failing_feedback").input("Missing chart").run()
+    assert len(calls) > built
+    assert not app.exception
@@ -0,0 +1,143 @@
+import json
+
+import pytest
+
+from batch_grade import run_batch, load_completed_ids
+from llm_inference import run_fake_llm, FatalLLMError, RetryableLLMError
+from packing import PackSizer, PACK_MAX_ATTEMPTS
+
+SUBMISSIONS = [
+    {
+        "id": f"learner-{i}",
+        "selected_criteria": [
+            {
+                "id": "Part 1.1",
+                "title": "Defines a problem statement",
+                "selected_criteria": [
+                    {"id": "Part 1.1_pass_0", "type": "pass",
+                     "criteria": "Defines a relevant business problem", "comment": ""}
+                ]
+            }
+        ],
+        "failing_feedback": "",
+        "learner_feedback": ""
+    }
+    for i in range(5)
+]
+
+def read_records(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file]
+
+def test_run_batch_writes_one_record_per_submission(tmp_path):
+    output = tmp_path / "results.jsonl"
+    stats = run_batch(SUBMISSIONS, run_fake_llm, str(output), "", workers=2)
+    records = read_records(output)
+    assert stats["ok"] == 5 and stats["error"] == 0
+    assert sorted(record["id"] for record in records) == sorted(s["id"] for s in SUBMISSIONS)
+    assert all(record["status"] == "ok" and "placeholder feedback" in record["feedback"] for record in records)
+
+def test_run_batch_resume_skips_completed_and_repairs_partial_line(tmp_path):
+    output = tmp_path / "results.jsonl"
+    run_batch(SUBMISSIONS[:2], run_fake_llm, str(output), "", workers=2)
+    # An interrupted run left half a record behind
+    with open(output, "a") as file:
+        file.write('{"id": "learner-2", "feedb')
+
+    stats = run_batch(SUBMISSIONS, run_fake_llm, str(output), "", workers=2)
+    records = read_records(output)
+    assert stats["skipped"] == 2 and stats["ok"] == 3
+    assert sorted(record["id"] for record in records) == sorted(s["id"] for s in SUBMISSIONS)
+    assert load_completed_ids(str(output)) == {s["id"] for s in SUBMISSIONS}
+
+def test_run_batch_records_unexpected_errors_and_continues(tmp_path):
+    output = tmp_path / "results.jsonl"
+    calls = []
+    def flaky(prompt, prefix=None):
+        calls.append(prompt)
+        # Not an LLMError: a bug in the provider wrapper, say
+        if len(calls) == 1:
+            raise KeyError("boom")
+        return run_fake_llm(prompt, prefix)
+
+    stats = run_batch(SUBMISSIONS, flaky, str(output), "", workers=1)
+    records = read_records(output)
+    assert stats["ok"] == 4 and stats["error"] == 1
+    failed = [record for record in records if record["status"] == "error"]
+    assert failed[0]["error_class"] == "KeyError"
+
+    # The failed submission is graded again on resume
+    stats = run_batch(SUBMISSIONS, run_fake_llm, str(output), "", workers=1)
+    assert stats["skipped"] == 4 and stats["ok"] == 1
+
+# --- Packed requests ---
+
+def packs_of(prompt):
+    return prompt.count("=== Submission ") - 1 if "=== Submission " in prompt else 0
+
+@pytest.fixture
+def sizer():
+    return PackSizer("fake", prefix_chars=0, max_pack=8)
+
+def test_packed_run_answers_every_submission(tmp_path, sizer):
+    output = tmp_path / "results.jsonl"
+    calls = []
+    def packed(prompt, prefix=None):
+        calls.append(packs_of(prompt))
+        return run_fake_llm(prompt, prefix)
+
+    stats = run_batch(SUBMISSIONS, packed, str(output), "", workers=1, pack_sizer=sizer)
+    records = read_records(output)
+    assert stats["ok"] == 5 and stats["requests"] == 1
+    assert calls == [5]
+    assert all(record["pack_size"] == 5 and "placeholder feedback" in record["feedback"] for record in records)
+
+def test_missing_answers_are_packed_again_then_graded_alone(tmp_path, sizer):
+    output = tmp_path / "results.jsonl"
+    calls = []
+    def drops_learner_0(prompt, prefix=None):
+        calls.append(packs_of(prompt))
+        text = run_fake_llm(prompt, prefix)
+        if packs_of(prompt):
+            answers = json.loads(text)
+            answers.pop("learner-0", None)
+            text = json.dumps(answers)
+        return text
+
+    stats = run_batch(SUBMISSIONS, drops_learner_0, str(output), "", workers=1, pack_sizer=sizer)
+    records = {record["id"]: record for record in read_records(output)}
+    assert stats["ok"] == 5 and stats["error"] == 0
+    # The first pack, then learner-0 packed again on its own, then a plain request
+    assert calls == [5] + [1] * (PACK_MAX_ATTEMPTS - 1) + [0]
+    assert "pack_size" not in records["learner-0"]
+    assert records["learner-1"]["pack_size"] == 5
+    # The incomplete answers shrank the pack size
+    assert sizer.size < 8
+
+def test_fatal_error_fails_the_whole_pack_at_once(tmp_path, sizer):
+    output = tmp_path / "results.jsonl"
+    calls = []
+    def misconfigured(prompt, prefix=None):
+        calls.append(packs_of(prompt))
+        raise FatalLLMError("Gemini 2.5 Flash", "API key not valid")
+
+    stats = run_batch(SUBMISSIONS, misconfigured, str(output), "", workers=1, pack_sizer=sizer)
+    records = read_records(output)
+    assert calls == [5]
+    assert stats["error"] == 5 and stats["ok"] == 0
+    assert all(record["error_class"] == "FatalLLMError" and "API key" in record["feedback"] for record in records)
+    assert sizer.size == 8
+
+def test_transient_error_retries_the_pack_without_shrinking_it(tmp_path, sizer):
+    output = tmp_path / "results.jsonl"
+    calls = []
+    def flaky(prompt, prefix=None):
+        calls.append(packs_of(prompt))
+        if len(calls) == 1:
+            raise RetryableLLMError("Gemini 2.5 Flash", "503 overloaded")
+        return run_fake_llm(prompt, prefix)
+
+    stats = run_batch(SUBMISSIONS, flaky, str(output), "", workers=1, pack_sizer=sizer)
+    assert calls == [5, 5]
+    assert stats["ok"] == 5 and stats["error"] == 0
+    assert sizer.size == 8
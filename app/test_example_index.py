@@ -0,0 +1,72 @@
+import os
+
+from example_index import ExampleIndex, ExampleBank, split_examples, load_example_bank
+
+EXAMPLES = [
+    "### Charts\nLabel the axes of every chart and add a legend.",
+    "### Regression\nExplain the regression coefficients and check the residuals.",
+    "### Outliers\nDiscuss the outliers in the regression and how they affect the chart.",
+]
+
+def test_split_examples_on_level_three_headings():
+    text = "Intro line\n\n### First\nBody one.\n\n### Second\nBody two.\n## Not a split\nMore.\n\n\n"
+    assert split_examples(text) == [
+        "Intro line",
+        "### First\nBody one.",
+        "### Second\nBody two.\n## Not a split\nMore.",
+    ]
+    assert split_examples("") == []
+    assert split_examples("   \n") == []
+
+def test_rank_orders_by_relevance():
+    index = ExampleIndex(EXAMPLES)
+    assert index.rank("residuals of the regression").tolist() == [1, 2, 0]
+    assert index.rank("chart legend").tolist() == [0, 2, 1]
+
+def test_rank_keeps_bank_order_without_matching_terms():
+    index = ExampleIndex(EXAMPLES)
+    # Only stopwords, or words the bank does not contain
+    assert index.rank("the and of with").tolist() == [0, 1, 2]
+    assert index.rank("zebra").tolist() == [0, 1, 2]
+    assert not index.scores("the and of").any()
+
+def test_empty_bank():
+    index = ExampleIndex([])
+    assert index.rank("regression").tolist() == []
+    bank = ExampleBank([])
+    assert bank.examples == [] and bank.text == ""
+
+def test_bank_joins_a_subset_in_bank_order():
+    bank = ExampleBank(["\n\n".join(EXAMPLES)])
+    assert bank.join([2, 0]) == EXAMPLES[0] + "\n\n" + EXAMPLES[2]
+    assert bank.join([0, 1, 2]) == bank.text
+
+def test_bank_is_reindexed_only_when_a_file_changes(tmp_path):
+    path = tmp_path / "feedback_examples.md"
+    directory = tmp_path / "feedback_examples"
+    directory.mkdir()
+    path.write_text(EXAMPLES[0])
+    bank = load_example_bank(str(path), str(directory))
+    assert load_example_bank(str(path), str(directory)) is bank
+    assert bank.examples == [EXAMPLES[0]]
+
+    # Same size, newer mtime
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    changed = load_example_bank(str(path), str(directory))
+    assert changed is not bank
+
+    # Different size, same mtime
+    stat = os.stat(path)
+    path.write_text(EXAMPLES[0] + "\n\n" + EXAMPLES[1])
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    grown = load_example_bank(str(path), str(directory))
+    assert grown is not changed
+    assert len(grown.examples) == 2
+
+    # A new file in the directory
+    (directory / "more.md").write_text(EXAMPLES[2])
+    added = load_example_bank(str(path), str(directory))
+    assert added is not grown
+    assert added.examples == EXAMPLES
+    assert load_example_bank(str(path), str(directory)) is added
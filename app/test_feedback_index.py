@@ -0,0 +1,71 @@
+import numpy as np
+
+from feedback_index import FeedbackIndex, request_vector, closest, hamming_distances, sketch, VECTOR_DIM
+
+SELECTIONS = {"Part 1.1_pass_0": "Clear problem statement", "Part 2.1_fail_0": "", "Part 3.3_fail_0": "No chart"}
+
+def test_request_vector_is_normalised_and_order_independent():
+    vector = request_vector(SELECTIONS, "Missing chart", "Is my intro ok?")
+    assert vector.shape == (VECTOR_DIM,)
+    assert np.isclose(np.linalg.norm(vector), 1.0)
+    reordered = dict(reversed(list(SELECTIONS.items())))
+    assert np.allclose(vector, request_vector(reordered, "Missing chart", "Is my intro ok?"))
+    assert not request_vector({}).any()
+
+def test_similar_requests_score_higher_than_different_ones():
+    vector = request_vector(SELECTIONS)
+    close = request_vector({**SELECTIONS, "Part 3.3_fail_0": "No charts"})
+    far = request_vector({"Part 4.1_pass_0": "", "Part 5.2_fail_1": "Wrong model"})
+    assert vector @ close > 0.8
+    assert vector @ far < 0.3
+
+def test_nearest_returns_the_stored_feedback_above_the_threshold(tmp_path):
+    index = FeedbackIndex(str(tmp_path))
+    assert index.nearest(request_vector(SELECTIONS)) is None
+    index.add(request_vector(SELECTIONS), "Stored feedback.", provider="gemini", model="flash")
+    index.add(request_vector({"Part 4.1_pass_0": ""}), "Other feedback.", provider="ollama")
+    similarity, record = index.nearest(request_vector(SELECTIONS))
+    assert similarity > 0.99
+    assert record["feedback"] == "Stored feedback." and record["provider"] == "gemini"
+    assert index.nearest(request_vector({"Part 5.2_fail_1": "Wrong model"}), threshold=0.9) is None
+
+def test_records_survive_a_restart_and_a_torn_append(tmp_path):
+    index = FeedbackIndex(str(tmp_path))
+    for i in range(5):
+        index.add(request_vector({f"Part {i}.1_pass_0": ""}), f"Feedback {i}.")
+    # A crash while appending left a vector without its record
+    with open(tmp_path / "vectors.f32", "ab") as file:
+        file.write(np.ones(VECTOR_DIM, dtype=np.float32).tobytes())
+    with open(tmp_path / "records.jsonl", "ab") as file:
+        file.write(b'{"feedback": "half')
+
+    reopened = FeedbackIndex(str(tmp_path))
+    assert len(reopened) == 5
+    similarity, record = reopened.nearest(request_vector({"Part 3.1_pass_0": ""}))
+    assert record["feedback"] == "Feedback 3."
+    reopened.add(request_vector(SELECTIONS), "After restart.")
+    assert FeedbackIndex(str(tmp_path)).nearest(request_vector(SELECTIONS))[1]["feedback"] == "After restart."
+
+def test_nearest_matches_a_brute_force_search(tmp_path):
+    rng = np.random.default_rng(0)
+    index = FeedbackIndex(str(tmp_path))
+    vectors = rng.standard_normal((300, VECTOR_DIM)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    for i, vector in enumerate(vectors):
+        index.add(vector, str(i))
+    for target in (7, 150, 299):
+        query = vectors[target] + 0.05 * rng.standard_normal(VECTOR_DIM).astype(np.float32)
+        query /= np.linalg.norm(query)
+        _, record = index.nearest(query, threshold=0.0)
+        assert record["feedback"] == str(int(np.argmax(vectors @ query)))
+
+def test_closest_picks_the_smallest_distances_without_sorting():
+    distances = np.array([5, 1, 9, 1, 3, 0, 7], dtype=np.uint8)
+    assert list(closest(distances, 3)) == [1, 3, 5]
+    assert list(closest(distances, 10)) == list(range(7))
+
+def test_hamming_distance_of_identical_sketches_is_zero():
+    vectors = np.eye(VECTOR_DIM, dtype=np.float32)[:4]
+    sketches = sketch(vectors)
+    distances = hamming_distances(np.ascontiguousarray(sketches.T), sketches[2])
+    assert distances[2] == 0 and all(distances[i] > 0 for i in (0, 1, 3))
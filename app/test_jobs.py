@@ -0,0 +1,84 @@
+import threading
+
+from jobs import JobQueue, DONE, FAILED, CANCELLED, QUEUED
+
+def blocking_work(release, calls, chunks=("Good ", "work.")):
+    def work(job):
+        calls.append(job.key)
+        release.wait(5)
+        for chunk in chunks:
+            yield 0, chunk
+    return work
+
+def wait_done(job):
+    for _ in job.follow():
+        pass
+    return job
+
+def test_identical_requests_share_one_job():
+    queue = JobQueue()
+    release, calls = threading.Event(), []
+    first = queue.submit("key", "gemini", blocking_work(release, calls))
+    second = queue.submit("key", "gemini", blocking_work(release, calls))
+    assert second is first
+    release.set()
+    assert wait_done(first).status == DONE
+    assert first.result == "Good work."
+    assert calls == ["key"]
+    # Once finished, the same key starts a new job
+    third = queue.submit("key", "gemini", blocking_work(release, calls))
+    assert third is not first
+    wait_done(third)
+    assert calls == ["key", "key"]
+
+def test_real_request_adopts_a_speculative_job():
+    queue = JobQueue()
+    release = threading.Event()
+    speculative = queue.submit("key", "gemini", blocking_work(release, []), speculative=True)
+    assert speculative.speculative
+    adopted = queue.submit("key", "gemini", blocking_work(release, []))
+    assert adopted is speculative and not adopted.speculative
+    release.set()
+    wait_done(adopted)
+
+def test_provider_bound_queues_jobs_without_blocking_other_providers():
+    queue = JobQueue(limits={"ollama": 1})
+    release, calls = threading.Event(), []
+    running = queue.submit("a", "ollama", blocking_work(release, calls))
+    waiting = queue.submit("b", "ollama", blocking_work(release, calls))
+    other = queue.submit("c", "gemini", lambda job: iter([(0, "x")]))
+    assert wait_done(other).status == DONE
+    assert waiting.status == QUEUED
+    assert queue.stats()["waiting"] == {"ollama": 1}
+    release.set()
+    assert wait_done(running).status == DONE and wait_done(waiting).status == DONE
+    assert calls == ["a", "b"]
+
+def test_on_done_only_for_successful_jobs():
+    queue = JobQueue()
+    finished = []
+    def failing(job):
+        raise RuntimeError("provider down")
+        yield
+    failed = wait_done(queue.submit("bad", "gemini", failing, on_done=finished.append))
+    assert failed.status == FAILED and str(failed.error) == "provider down"
+    called = threading.Event()
+    done = queue.submit("good", "gemini", lambda job: iter([(0, "ok")]),
+                        on_done=lambda job: (finished.append(job), called.set()))
+    # on_done runs on the worker after the job is marked finished
+    assert called.wait(1)
+    assert finished == [done]
+
+def test_cancel_stops_the_work():
+    queue = JobQueue()
+    closed = threading.Event()
+    def endless(job):
+        try:
+            while True:
+                yield 0, "."
+        finally:
+            closed.set()
+    job = queue.submit("key", "gemini", endless)
+    job.cancel()
+    assert wait_done(job).status == CANCELLED
+    assert closed.wait(1)
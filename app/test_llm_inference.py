@@ -0,0 +1,361 @@
+import asyncio
+import threading
+import time
+import weakref
+from types import SimpleNamespace
+
+import pytest
+
+import llm_inference
+import scheduler
+from llm_inference import (
+    strip_thinking_stream,
+    remove_thinking_tags,
+    get_client,
+    get_async_client,
+    reset_clients,
+    classify_error,
+    LLMError,
+    RetryableLLMError,
+    FatalLLMError
+)
+
+def stripped(chunks):
+    return "".join(strip_thinking_stream(chunks))
+
+def test_text_without_think_blocks_passes_through():
+    assert stripped(["Good ", "work ", "overall."]) == "Good work overall."
+
+def test_think_block_in_one_chunk_is_removed():
+    assert stripped(["<think>plan the answer</think>\n\nGood work."]) == "Good work."
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7])
+def test_tags_split_across_chunks_are_removed(size):
+    text = "<think>step one\nstep two</think>\n\nGood work. <think>more</think>Keep going."
+    chunks = [text[i:i + size] for i in range(0, len(text), size)]
+    assert stripped(chunks) == "Good work. Keep going."
+
+def test_matches_blocking_cleanup():
+    text = "<think>reasoning</think>\nFeedback text."
+    assert stripped([text]) == remove_thinking_tags(text)
+
+def test_unclosed_think_block_yields_nothing_after_it():
+    assert stripped(["Intro. <think>never", " closed"]) == "Intro. "
+
+def test_text_that_only_looks_like_a_tag_is_kept():
+    assert stripped(["a <thin", "g> and a <", "b>"]) == "a <thing> and a <b>"
+    assert stripped(["ends with <thi"]) == "ends with <thi"
+
+class APIError(Exception):
+    """An SDK error carrying an HTTP status and response headers."""
+
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+class ReadTimeout(Exception):
+    """Named like httpx's timeout errors, which do not subclass TimeoutError."""
+
+@pytest.mark.parametrize("error", [
+    TimeoutError("timed out"),
+    ConnectionError("connection reset"),
+    ReadTimeout("read timed out"),
+    APIError(429),
+    APIError(500),
+    APIError(503),
+])
+def test_transient_errors_are_retryable(error):
+    classified = classify_error("Gemini 2.5 Flash", error)
+    assert isinstance(classified, RetryableLLMError)
+    assert classified.retryable
+    assert str(classified) == f"Error with Gemini 2.5 Flash: {error}"
+
+@pytest.mark.parametrize("error", [
+    APIError(400),
+    APIError(401),
+    APIError(404),
+    KeyError("GEMINI_API_KEY"),
+    ValueError("bad model"),
+])
+def test_other_errors_are_fatal(error):
+    classified = classify_error("Gemini 2.5 Flash", error)
+    assert isinstance(classified, FatalLLMError)
+    assert not classified.retryable
+
+def test_status_code_and_retry_after_are_kept():
+    classified = classify_error("Gemini 2.5 Flash", APIError(429, {"retry-after": "7"}))
+    assert classified.status_code == 429
+    assert classified.retry_after == 7.0
+    assert classify_error("Gemini 2.5 Flash", APIError(429, {"retry-after": "soon"})).retry_after is None
+
+def test_llm_errors_pass_through():
+    error = RetryableLLMError("Gemini 2.5 Flash", "rate limited")
+    assert classify_error("Other", error) is error
+    assert isinstance(FatalLLMError("Gemini 2.5 Flash", "no key"), LLMError)
+
+@pytest.fixture
+def client_factories(monkeypatch):
+    # Stand-in clients; creation is slow so concurrent first calls overlap
+    created = []
+    def factory():
+        time.sleep(0.05)
+        client = object()
+        created.append(client)
+        return client
+    monkeypatch.setattr(llm_inference, "_clients", {})
+    monkeypatch.setattr(llm_inference, "_async_clients", weakref.WeakKeyDictionary())
+    monkeypatch.setitem(llm_inference.CLIENT_FACTORIES, "together", factory)
+    monkeypatch.setitem(llm_inference.ASYNC_CLIENT_FACTORIES, "together", factory)
+    return created
+
+def test_threads_share_one_client(client_factories):
+    clients = []
+    barrier = threading.Barrier(8)
+    def worker():
+        barrier.wait()
+        clients.append(get_client("together"))
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(client_factories) == 1
+    assert all(client is client_factories[0] for client in clients)
+    assert get_client("together") is client_factories[0]
+
+def test_reset_clients_drops_the_shared_client(client_factories):
+    first = get_client("together")
+    reset_clients()
+    second = get_client("together")
+    assert second is not first
+    assert len(client_factories) == 2
+
+def test_each_event_loop_gets_its_own_async_client(client_factories):
+    async def twice():
+        return get_async_client("together"), get_async_client("together")
+    first_loop = asyncio.run(twice())
+    second_loop = asyncio.run(twice())
+    # Shared within a loop, not across loops
+    assert first_loop[0] is first_loop[1]
+    assert second_loop[0] is second_loop[1]
+    assert first_loop[0] is not second_loop[0]
+    assert len(client_factories) == 2
+
+# --- Gemini prefix cache ---
+
+class FakeCaches:
+    def __init__(self):
+        self.calls = []
+        self.fail_create = False
+        self.fail_update = False
+
+    def create(self, model, config):
+        self.calls.append(("create", config.contents[0]))
+        if self.fail_create:
+            raise RuntimeError("content too small")
+        return SimpleNamespace(name=f"cachedContents/{len(self.calls)}")
+
+    def update(self, name, config):
+        self.calls.append(("update", name))
+        if self.fail_update:
+            raise RuntimeError("not found")
+
+    def delete(self, name):
+        self.calls.append(("delete", name))
+
+    def count(self, kind):
+        return sum(1 for call in self.calls if call[0] == kind)
+
+class MissingCacheError(Exception):
+    code = 404
+
+    def __init__(self):
+        super().__init__("CachedContent not found (or permission denied)")
+
+class FakeModels:
+    # generate_content fails once with a missing cache, as after a server-side expiry
+    def __init__(self):
+        self.configs = []
+
+    def generate_content(self, model, contents, config):
+        self.configs.append(config)
+        if len(self.configs) == 1:
+            raise MissingCacheError()
+        return SimpleNamespace(text="Feedback.", usage_metadata=None)
+
+    def generate_content_stream(self, model, contents, config):
+        self.configs.append(config)
+        if len(self.configs) == 1:
+            raise MissingCacheError()
+        return iter([SimpleNamespace(text="Feed", usage_metadata=None), SimpleNamespace(text="back.", usage_metadata=None)])
+
+class AsyncFakeModels(FakeModels):
+    async def generate_content(self, model, contents, config):
+        return FakeModels.generate_content(self, model, contents, config)
+
+LONG_PREFIX = "Instructions and examples. " * 200
+
+@pytest.fixture
+def gemini(monkeypatch):
+    client = SimpleNamespace(caches=FakeCaches(), models=FakeModels())
+    monkeypatch.setattr(llm_inference, "_prefix_caches", {})
+    monkeypatch.setattr(llm_inference, "get_client", lambda provider: client)
+    return client
+
+@pytest.fixture
+def clock(monkeypatch):
+    # time.time as seen by the prefix cache
+    now = [1000.0]
+    monkeypatch.setattr(llm_inference, "time", SimpleNamespace(time=lambda: now[0]))
+    return now
+
+def test_prefix_cache_is_created_on_first_use_and_reused(gemini, clock):
+    name = llm_inference.get_gemini_prefix_cache(LONG_PREFIX)
+    assert name == "cachedContents/1"
+    assert gemini.caches.calls == [("create", LONG_PREFIX)]
+    clock[0] += llm_inference.PREFIX_CACHE_TTL_SECONDS / 2
+    assert llm_inference.get_gemini_prefix_cache(LONG_PREFIX) == name
+    assert gemini.caches.count("create") == 1
+
+def test_short_prefix_is_not_cached(gemini):
+    assert llm_inference.get_gemini_prefix_cache("Short instructions.") is None
+    assert gemini.caches.calls == []
+
+def test_prefix_cache_is_renewed_near_its_ttl(gemini, clock):
+    name = llm_inference.get_gemini_prefix_cache(LONG_PREFIX)
+    clock[0] += llm_inference.PREFIX_CACHE_TTL_SECONDS - 30
+    assert llm_inference.get_gemini_prefix_cache(LONG_PREFIX) == name
+    assert gemini.caches.calls[1:] == [("update", name)]
+    # Renewed for another full TTL
+    clock[0] += llm_inference.PREFIX_CACHE_TTL_SECONDS / 2
+    assert llm_inference.get_gemini_prefix_cache(LONG_PREFIX) == name
+    assert len(gemini.caches.calls) == 2
+
+def test_failed_renewal_creates_a_new_handle(gemini, clock):
+    llm_inference.get_gemini_prefix_cache(LONG_PREFIX)
+    gemini.caches.fail_update = True
+    clock[0] += llm_inference.PREFIX_CACHE_TTL_SECONDS - 30
+    assert llm_inference.get_gemini_prefix_cache(LONG_PREFIX) == "cachedContents/3"
+    assert [kind for kind, _ in gemini.caches.calls] == ["create", "update", "create"]
+
+def test_least_recently_used_handle_is_evicted_and_deleted(gemini, clock):
+    prefixes = [f"{i} {LONG_PREFIX}" for i in range(llm_inference.PREFIX_CACHE_MAX_HANDLES + 1)]
+    names = []
+    for prefix in prefixes[:-1]:
+        clock[0] += 1
+        names.append(llm_inference.get_gemini_prefix_cache(prefix))
+    # Using the oldest handle again makes the second one the least recently used
+    clock[0] += 1
+    assert llm_inference.get_gemini_prefix_cache(prefixes[0]) == names[0]
+    clock[0] += 1
+    llm_inference.get_gemini_prefix_cache(prefixes[-1])
+    assert gemini.caches.calls[-1] == ("delete", names[1])
+    assert len(llm_inference._prefix_caches) == llm_inference.PREFIX_CACHE_MAX_HANDLES
+
+def test_failed_creation_is_not_retried_until_the_ttl(gemini, clock):
+    gemini.caches.fail_create = True
+    assert llm_inference.get_gemini_prefix_cache(LONG_PREFIX) is None
+    clock[0] += 60
+    assert llm_inference.get_gemini_prefix_cache(LONG_PREFIX) is None
+    assert gemini.caches.count("create") == 1
+    gemini.caches.fail_create = False
+    clock[0] += llm_inference.PREFIX_CACHE_TTL_SECONDS
+    assert llm_inference.get_gemini_prefix_cache(LONG_PREFIX) is not None
+    assert gemini.caches.count("create") == 2
+
+def test_run_recreates_a_missing_cache_and_retries(gemini):
+    assert llm_inference.run_gemini_flash("Suffix.", prefix=LONG_PREFIX) == "Feedback."
+    assert [config.cached_content for config in gemini.models.configs] == ["cachedContents/1", "cachedContents/2"]
+
+def test_stream_recreates_a_missing_cache_and_retries(gemini):
+    assert "".join(llm_inference.stream_gemini_flash("Suffix.", prefix=LONG_PREFIX)) == "Feedback."
+    assert [config.cached_content for config in gemini.models.configs] == ["cachedContents/1", "cachedContents/2"]
+
+def test_arun_recreates_a_missing_cache_and_retries(gemini, monkeypatch):
+    models = AsyncFakeModels()
+    monkeypatch.setattr(llm_inference, "get_async_client", lambda provider: SimpleNamespace(models=models))
+    assert asyncio.run(llm_inference.arun_gemini_flash("Suffix.", prefix=LONG_PREFIX)) == "Feedback."
+    assert [config.cached_content for config in models.configs] == ["cachedContents/1", "cachedContents/2"]
+
+# --- Async API ---
+
+class FakeAsyncCompletions:
+    """
+    Together's async chat completions. A prompt "<text>:<seconds>" answers
+    "<text>" after that delay, and "fail" is rejected like a bad request.
+    """
+
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+        self.cancelled = 0
+
+    async def create(self, model, messages):
+        text, _, delay = messages[0]["content"].partition(":")
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(float(delay or 0))
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.active -= 1
+        if text == "fail":
+            raise APIError(400)
+        return SimpleNamespace(usage=None, choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+@pytest.fixture
+def together(monkeypatch):
+    completions = FakeAsyncCompletions()
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    monkeypatch.setattr(llm_inference, "get_async_client", lambda provider: client)
+    return completions
+
+def use_scheduler(monkeypatch, max_in_flight):
+    provider = scheduler.ProviderScheduler("together", max_in_flight=max_in_flight)
+    monkeypatch.setattr(llm_inference, "provider_scheduler", lambda key: provider)
+    return provider
+
+# With one slot, a slot that is not released would block the next call
+def test_timeout_raises_and_releases_the_slot(together, monkeypatch):
+    use_scheduler(monkeypatch, 1)
+    async def main():
+        with pytest.raises(RetryableLLMError, match="no response within 0.05 seconds"):
+            await llm_inference.arun_deepseek_r1_together("slow:10", timeout=0.05)
+        assert together.cancelled == 1
+        return await asyncio.wait_for(llm_inference.arun_deepseek_r1_together("next"), 1)
+    assert asyncio.run(main()) == "next"
+
+def test_cancellation_closes_the_request_and_releases_the_slot(together, monkeypatch):
+    use_scheduler(monkeypatch, 1)
+    async def main():
+        task = asyncio.create_task(llm_inference.arun_deepseek_r1_together("slow:10"))
+        await asyncio.sleep(0.02)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert together.cancelled == 1
+        return await asyncio.wait_for(llm_inference.arun_deepseek_r1_together("next"), 1)
+    assert asyncio.run(main()) == "next"
+
+def test_gather_prompts_keeps_order_and_isolates_failures(together, monkeypatch):
+    use_scheduler(monkeypatch, 8)
+    prompts = ["first:0.05", "fail", "slow:10", "last:0"]
+    results = asyncio.run(llm_inference.gather_prompts(
+        llm_inference.arun_deepseek_r1_together, prompts, timeout=0.5
+    ))
+    assert results[0] == "first"
+    assert isinstance(results[1], FatalLLMError)
+    assert isinstance(results[2], RetryableLLMError)
+    assert results[3] == "last"
+    # Only the timed-out prompt was cancelled
+    assert together.cancelled == 1
+
+def test_limit_bounds_concurrency(together, monkeypatch):
+    use_scheduler(monkeypatch, 8)
+    prompts = [f"p{i}:0.02" for i in range(6)]
+    results = llm_inference.run_prompts(llm_inference.arun_deepseek_r1_together, prompts, limit=2)
+    assert results == [f"p{i}" for i in range(6)]
+    assert together.max_active == 2
@@ -0,0 +1,114 @@
+import asyncio
+import time
+
+import pytest
+
+import llm_inference
+import metrics
+from metrics import RecordLog, load_records, record_call, summarize_by_provider
+
+@pytest.fixture
+def metrics_file(tmp_path, monkeypatch):
+    path = tmp_path / "llm_metrics.jsonl"
+    monkeypatch.setattr(metrics, "METRICS_FILE", str(path))
+    return path
+
+@pytest.fixture
+def recorded(monkeypatch):
+    records = []
+    monkeypatch.setattr(llm_inference, "record_call", lambda **fields: records.append(fields))
+    return records
+
+def test_blocking_and_async_calls_have_no_time_to_first_token(recorded):
+    @llm_inference.scheduled("gemini")
+    def run(prompt, prefix=None, usage=None):
+        return "feedback"
+
+    @llm_inference.scheduled("gemini")
+    async def arun(prompt, prefix=None, usage=None):
+        return "feedback"
+
+    assert run("prompt") == "feedback"
+    assert asyncio.run(arun("prompt")) == "feedback"
+    assert [record["ttft_s"] for record in recorded] == [None, None]
+    assert all(record["latency_s"] is not None for record in recorded)
+
+def test_streams_record_time_to_first_token(recorded):
+    @llm_inference.scheduled("gemini")
+    def stream(prompt, prefix=None, usage=None):
+        time.sleep(0.01)
+        yield "a"
+        yield "b"
+
+    assert "".join(stream("prompt")) == "ab"
+    assert recorded[0]["ttft_s"] >= 0.01
+
+def test_records_are_appended_and_read_back(metrics_file):
+    record_call(provider="gemini", model="flash", latency_s=1.0)
+    record_call(provider="gemini", model="flash", latency_s=2.0, ts=1.0)
+    assert [r["latency_s"] for r in load_records(str(metrics_file))] == [1.0, 2.0]
+    assert [r["latency_s"] for r in load_records(str(metrics_file), since=10)] == [1.0]
+
+def test_file_is_rotated_at_the_size_cap(metrics_file, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_MAX_BYTES", 1000)
+    for i in range(20):
+        record_call(provider="gemini", model="flash", latency_s=float(i))
+    rotated = metrics_file.with_name("llm_metrics.jsonl.1")
+    assert rotated.exists() and rotated.stat().st_size >= 1000
+    assert not metrics_file.exists() or metrics_file.stat().st_size < 1000
+    # Readers see the rotated records first, then the current ones, with none lost in between
+    latencies = [r["latency_s"] for r in load_records(str(metrics_file))]
+    assert latencies == sorted(latencies) and latencies[-1] == 19.0
+
+def test_record_log_reads_only_new_lines_and_follows_rotation(metrics_file, monkeypatch):
+    log = RecordLog(str(metrics_file))
+    assert log.refresh() == []
+    record_call(provider="gemini", latency_s=1.0)
+    first = log.refresh()
+    assert [r["latency_s"] for r in first] == [1.0]
+
+    # A partly written line waits for the next refresh
+    with open(metrics_file, "a") as file:
+        file.write('{"provider": "gemini", "latency_s": 2.0')
+    assert len(log.refresh()) == 1
+    with open(metrics_file, "a") as file:
+        file.write("}\n")
+    assert [r["latency_s"] for r in log.refresh()] == [1.0, 2.0]
+    assert [r["latency_s"] for r in first] == [1.0]
+
+    monkeypatch.setattr(metrics, "METRICS_MAX_BYTES", 1)
+    record_call(provider="gemini", latency_s=3.0)
+    assert [r["latency_s"] for r in log.refresh()] == [1.0, 2.0, 3.0]
+    record_call(provider="gemini", latency_s=4.0)
+    # Only the current file and one rotated file are kept
+    assert [r["latency_s"] for r in log.refresh()] == [4.0]
+
+def test_prometheus_file_writes_are_throttled(tmp_path, monkeypatch):
+    path = tmp_path / "llm.prom"
+    writes = []
+    monkeypatch.setattr(metrics, "PROM_FILE", str(path))
+    monkeypatch.setattr(metrics, "PROM_FILE_INTERVAL", 0.2)
+    monkeypatch.setattr(metrics, "METRICS_FILE", "")
+    monkeypatch.setattr(metrics, "_prom_written", 0.0)
+    monkeypatch.setattr(metrics, "write_prometheus_file", lambda p: writes.append(time.monotonic()))
+    record_call(provider="gemini", latency_s=0.1)
+    time.sleep(0.05)
+    for _ in range(50):
+        record_call(provider="gemini", latency_s=0.1)
+    time.sleep(0.5)
+    # One write straight away, then one trailing write for all the later records
+    assert len(writes) == 2
+    assert writes[1] - writes[0] >= 0.15
+
+def test_summary_percentiles_skip_missing_ttft():
+    records = [
+        {"provider": "gemini", "latency_s": 1.0, "ttft_s": None},
+        {"provider": "gemini", "latency_s": 2.0, "ttft_s": 0.5},
+        {"provider": "gemini", "latency_s": 3.0, "error_class": "LLMError"},
+        {"provider": "gemini", "latency_s": 0.0, "cache_hit": True},
+    ]
+    row = summarize_by_provider(records)[0]
+    assert row["calls"] == 3 and row["cache_hits"] == 1
+    assert row["error_rate"] == pytest.approx(1 / 3)
+    assert row["latency_p50"] == 2.0
+    assert row["ttft_p50"] == 0.5
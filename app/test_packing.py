@@ -0,0 +1,69 @@
+import json
+from collections import deque
+
+from packing import PackSizer, parse_packed_response, PACK_OUTPUT_TOKENS_PER_SUBMISSION
+
+def test_complete_json_is_split_by_id():
+    text = 'Here you go:\n```json\n' + json.dumps({"a": " Good work. ", "b": "Needs a chart."}) + '\n```'
+    results, retry = parse_packed_response(text, ["a", "b"])
+    assert results == {"a": "Good work.", "b": "Needs a chart."}
+    assert retry == []
+
+def test_missing_empty_and_unknown_entries_are_retried_or_ignored():
+    text = json.dumps({"a": "Fine.", "b": "  ", "c": ["not", "text"], "zzz": "Stray."})
+    results, retry = parse_packed_response(text, ["a", "b", "c", "d"])
+    assert results == {"a": "Fine."}
+    assert retry == ["b", "c", "d"]
+
+def test_truncated_json_keeps_complete_entries():
+    text = '{"a": "First \\"quoted\\" line\\nsecond line", "b": "Second", "c": "Cut o'
+    results, retry = parse_packed_response(text, ["a", "b", "c"])
+    assert results == {"a": 'First "quoted" line\nsecond line', "b": "Second"}
+    assert retry == ["c"]
+
+def test_numeric_ids_match_their_string_keys():
+    results, retry = parse_packed_response('{"1": "One", "2": "Two"}', [1, 2])
+    assert results == {1: "One", 2: "Two"} and retry == []
+
+def test_no_json_retries_everything():
+    assert parse_packed_response("I cannot help with that.", ["a", "b"]) == ({}, ["a", "b"])
+    assert parse_packed_response("", ["a"]) == ({}, ["a"])
+
+def test_take_is_bounded_by_the_pack_size():
+    sizer = PackSizer("fake", prefix_chars=4000, max_pack=3)
+    queue = deque(range(7))
+    assert sizer.take(queue, lambda submission: 100) == [0, 1, 2]
+    assert list(queue) == [3, 4, 5, 6]
+
+def test_take_stops_at_the_context_window():
+    sizer = PackSizer("ollama", prefix_chars=4000, max_pack=16)
+    room = int(sizer.context_tokens * 0.8) - sizer.prefix_tokens
+    per_submission = (room // 3) * 4
+    pack = sizer.take(deque(range(10)), lambda submission: per_submission - PACK_OUTPUT_TOKENS_PER_SUBMISSION * 4)
+    assert len(pack) == 3
+    # A single submission is always sent, even if it is too large to pack
+    assert sizer.take(deque(["huge"]), lambda submission: 10 ** 9) == ["huge"]
+
+def test_take_respects_the_output_cap():
+    sizer = PackSizer("gemini", prefix_chars=0, max_pack=1000)
+    pack = sizer.take(deque(range(1000)), lambda submission: 10)
+    assert len(pack) * sizer.output_per_submission + 1000 <= sizer.output_tokens
+    assert len(pack) > 1
+
+def test_size_halves_on_incomplete_pack_and_grows_after_complete_ones():
+    sizer = PackSizer("fake", prefix_chars=0, max_pack=8)
+    sizer.record(8, 5, 5 * 1600)
+    assert sizer.size == 4
+    sizer.record(4, 4, 4 * 1600)
+    assert sizer.size == 5
+    for _ in range(10):
+        sizer.record(sizer.size, sizer.size, sizer.size * 1600)
+    assert sizer.size == 8
+    sizer.record(8, 0, 0)
+    assert sizer.size == 4
+
+def test_output_estimate_follows_measured_responses():
+    sizer = PackSizer("fake", prefix_chars=0)
+    for _ in range(30):
+        sizer.record(2, 2, 2 * 400)
+    assert abs(sizer.output_per_submission - 100) <= 5
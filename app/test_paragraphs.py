@@ -0,0 +1,59 @@
+import threading
+import time
+
+import pytest
+
+from paragraphs import stream_paragraphs, join_paragraphs
+
+PROMPTS = [("general", "prefix", "one"), ("failing", "prefix", "two"), ("learner", "prefix", "three")]
+
+def test_paragraphs_run_concurrently_and_are_tagged_by_position():
+    def make_stream(prefix, suffix):
+        time.sleep(0.1)
+        yield f"{suffix}-a "
+        yield f"{suffix}-b"
+    start = time.monotonic()
+    texts = ["", "", ""]
+    for index, chunk in stream_paragraphs(make_stream, PROMPTS):
+        texts[index] += chunk
+    assert time.monotonic() - start < 0.25
+    assert texts == ["one-a one-b", "two-a two-b", "three-a three-b"]
+    assert join_paragraphs(texts) == "one-a one-b\n\ntwo-a two-b\n\nthree-a three-b"
+
+def test_first_error_is_raised_and_the_other_streams_are_closed():
+    closed = threading.Event()
+    def make_stream(prefix, suffix):
+        if suffix == "two":
+            raise RuntimeError("provider down")
+        return slow_stream()
+    def slow_stream():
+        try:
+            while True:
+                time.sleep(0.01)
+                yield "."
+        finally:
+            closed.set()
+    with pytest.raises(RuntimeError, match="provider down"):
+        for _ in stream_paragraphs(make_stream, PROMPTS):
+            pass
+    assert closed.wait(1)
+
+def test_closing_early_cancels_the_paragraphs():
+    closed = []
+    def make_stream(prefix, suffix):
+        try:
+            for i in range(1000):
+                time.sleep(0.005)
+                yield str(i)
+        finally:
+            closed.append(suffix)
+    stream = stream_paragraphs(make_stream, PROMPTS)
+    next(stream)
+    stream.close()
+    deadline = time.monotonic() + 1
+    while len(closed) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sorted(closed) == ["one", "three", "two"]
+
+def test_join_skips_empty_paragraphs():
+    assert join_paragraphs(["  First. ", "", None, "Second."]) == "First.\n\nSecond."
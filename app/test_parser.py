@@ -1,97 +1,103 @@
-import re
+import os
 
-def parse_marking_criteria(file_path="marking_criteria.md"):
-    criteria = []
-    
-    try:
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
-        
-        current_section = None
-        current_part = None
-        current_id = None
-        current_title = None
-        pass_criteria = []
-        fail_criteria = []
-        
-        for line in lines:
-            # Strip any trailing whitespace
-            line = line.rstrip()
-            
-            # Check for section header
-            section_match = re.match(r'### \*\*Part (\d+)\*\*', line)
-            if section_match:
-                current_section = f"Part {section_match.group(1)}"
-                print(f"Found section: {current_section}")
-                continue
-            
-            # Check for part header
-            part_match = re.match(r'#### \*\*Part (\d+)\.(\d+):\*\* (.*)', line)
-            if part_match:
-                # If we were processing a previous part, add it to the criteria list
-                if current_part is not None:
-                    criteria.append({
-                        "id": current_id,
-                        "section": current_section,
-                        "title": current_title,
-                        "pass_criteria": pass_criteria,
-                        "fail_criteria": fail_criteria,
-                        "description": current_title
-                    })
-                
-                # Start a new part
-                section_num = part_match.group(1)
-                part_num = part_match.group(2)
-                current_part = f"{section_num}.{part_num}"
-                current_id = f"Part {current_part}"
-                current_title = part_match.group(3).strip()
-                # Update current section just in case it wasn't set properly
-                current_section = f"Part {section_num}"
-                print(f"  Found part: {current_id} - {current_title}")
-                pass_criteria = []
-                fail_criteria = []
-                continue
-            
-            # Check for pass criteria
-            pass_match = re.match(r'- \[\s?\]\s*\*\*Pass\*\*:\s*(.*)', line)
-            if pass_match and current_part is not None:
-                pass_text = pass_match.group(1).strip()
-                pass_criteria.append(pass_text)
-                print(f"    Found pass criteria: {pass_text[:30]}...")
-                continue
-            
-            # Check for fail criteria
-            fail_match = re.match(r'- \[\s?\]\s*\*\*Fail\*\*:\s*(.*)', line)
-            if fail_match and current_part is not None:
-                fail_text = fail_match.group(1).strip()
-                fail_criteria.append(fail_text)
-                print(f"    Found fail criteria: {fail_text[:30]}...")
-                continue
-        
-        # Add the last part if there is one
-        if current_part is not None:
-            criteria.append({
-                "id": current_id,
-                "section": current_section,
-                "title": current_title,
-                "pass_criteria": pass_criteria,
-                "fail_criteria": fail_criteria,
-                "description": current_title
-            })
-        
-        print(f"\nTotal criteria items found: {len(criteria)}")
-        return criteria
-        
-    except Exception as e:
-        print(f"Error parsing marking criteria: {str(e)}")
-        return []
+import pytest
 
-if __name__ == "__main__":
-    criteria = parse_marking_criteria()
-    
-    # Print a summary of what was found
-    for item in criteria:
-        print(f"\n{item['id']}: {item['title']}")
-        print(f"  Section: {item['section']}")
-        print(f"  Pass criteria: {len(item['pass_criteria'])}")
-        print(f"  Fail criteria: {len(item['fail_criteria'])}")
\ No newline at end of file
+import rubric
+from rubric import (
+    parse_marking_criteria,
+    build_rubric_index,
+    build_selected_criteria,
+    load_marking_criteria,
+    load_rubric_index,
+    clear_rubric_cache
+)
+
+RUBRIC = """### **Part 1**
+#### **Part 1.1:** Defines a problem statement
+- [ ] **Pass**: Defines a relevant business problem  
+- [ ] **Fail**: Does not define a problem statement  
+#### **Part 1.2:** Explains success measures
+- [ ] **Pass**: Explains two success measures
+### **Part 2**  
+#### **Part 2.1:** Calculates statistics
+- [ ] **Fail**: No statistics
+- [x] **Pass**: ignored, already ticked
+"""
+
+@pytest.fixture
+def rubric_file(tmp_path):
+    path = tmp_path / "marking_criteria.md"
+    path.write_text(RUBRIC)
+    clear_rubric_cache()
+    yield path
+    clear_rubric_cache()
+
+def test_parses_parts_sections_and_criteria(rubric_file):
+    criteria = parse_marking_criteria(str(rubric_file))
+    assert [part["id"] for part in criteria] == ["Part 1.1", "Part 1.2", "Part 2.1"]
+    first = criteria[0]
+    assert first["section"] == "Part 1"
+    assert first["title"] == first["description"] == "Defines a problem statement"
+    assert first["pass_criteria"] == ["Defines a relevant business problem"]
+    assert first["fail_criteria"] == ["Does not define a problem statement"]
+    assert criteria[2]["section"] == "Part 2"
+    assert criteria[2]["pass_criteria"] == [] and criteria[2]["fail_criteria"] == ["No statistics"]
+
+def test_missing_file_parses_to_nothing(tmp_path):
+    assert parse_marking_criteria(str(tmp_path / "missing.md")) == []
+
+def test_shipped_rubric_parses():
+    criteria = parse_marking_criteria(os.path.join(os.path.dirname(__file__), "marking_criteria.md"))
+    index = build_rubric_index(criteria)
+    assert len(criteria) == 14
+    assert len(index["criteria"]) == 31
+    assert index["criteria"]["Part 1.1_pass_0"]["parent_id"] == "Part 1.1"
+
+def test_index_ids_and_positions(rubric_file):
+    index = build_rubric_index(parse_marking_criteria(str(rubric_file)))
+    assert list(index["criteria"]) == ["Part 1.1_pass_0", "Part 1.1_fail_0", "Part 1.2_pass_0", "Part 2.1_fail_0"]
+    assert [item["position"] for item in index["criteria"].values()] == [0, 1, 2, 3]
+    assert index["criteria"]["Part 1.1_fail_0"]["type"] == "fail"
+
+def test_cached_until_the_file_changes(rubric_file, monkeypatch):
+    calls = []
+    parse = rubric.parse_marking_criteria
+    monkeypatch.setattr(rubric, "parse_marking_criteria", lambda path: calls.append(path) or parse(path))
+
+    first = load_marking_criteria(str(rubric_file))
+    assert load_marking_criteria(str(rubric_file)) is first
+    assert load_rubric_index(str(rubric_file))["parts"].keys() == {"Part 1.1", "Part 1.2", "Part 2.1"}
+    assert len(calls) == 1
+
+    # Touched but unchanged: the hash matches, so no re-parse
+    stat = os.stat(rubric_file)
+    os.utime(rubric_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert load_marking_criteria(str(rubric_file)) is first
+    assert len(calls) == 1
+
+    rubric_file.write_text(RUBRIC + "#### **Part 2.2:** Builds a model\n")
+    assert [part["id"] for part in load_marking_criteria(str(rubric_file))][-1] == "Part 2.2"
+    assert len(calls) == 2
+
+def test_snapshot_skips_parsing_in_a_fresh_process(rubric_file, tmp_path, monkeypatch):
+    snapshot = tmp_path / "rubric.json"
+    expected = load_marking_criteria(str(rubric_file), snapshot_path=str(snapshot))
+    assert snapshot.exists()
+
+    clear_rubric_cache()
+    monkeypatch.setattr(rubric, "parse_marking_criteria", lambda path: pytest.fail("parsed again"))
+    assert load_marking_criteria(str(rubric_file), snapshot_path=str(snapshot)) == expected
+
+def test_selections_become_prompt_payload_in_rubric_order(rubric_file):
+    index = build_rubric_index(parse_marking_criteria(str(rubric_file)))
+    # Insertion order of the selections dict does not matter, unknown ids are skipped
+    selections = {"Part 2.1_fail_0": None, "Part 1.1_fail_0": "Too vague.", "Part 9.9_pass_0": "", "Part 1.1_pass_0": ""}
+    selected = build_selected_criteria(index, selections)
+    assert [part["id"] for part in selected] == ["Part 1.1", "Part 2.1"]
+    assert selected[0]["title"] == "Defines a problem statement"
+    assert [(item["id"], item["type"], item["comment"]) for item in selected[0]["selected_criteria"]] == [
+        ("Part 1.1_pass_0", "pass", ""),
+        ("Part 1.1_fail_0", "fail", "Too vague."),
+    ]
+    assert selected[1]["selected_criteria"][0]["criteria"] == "No statistics"
+    assert selected[1]["selected_criteria"][0]["comment"] == ""
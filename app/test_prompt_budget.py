@@ -0,0 +1,67 @@
+import pytest
+
+from example_index import ExampleBank
+from prompt_budget import count_tokens, select_examples
+from prompt_builder import construct_prompt_parts, construct_paragraph_prompts, PROMPT_INSTRUCTIONS
+
+EXAMPLES = [
+    "### Charts\nLabel the axes of every chart and add a legend.",
+    "### Regression\n" + " ".join(["Explain the regression coefficients and check the residuals."] * 5),
+    "### Outliers\nDiscuss the outliers in the regression.",
+    "### Structure\nOrder the methodology section chronologically.",
+]
+
+@pytest.fixture
+def bank():
+    return ExampleBank(["\n\n".join(EXAMPLES)])
+
+def tokens(text):
+    return count_tokens(text, "gemini")
+
+def test_whole_bank_is_sent_while_it_fits(bank):
+    text, report = select_examples(bank, "regression", "gemini", 100, budget=10_000, top_k=8)
+    assert text == bank.text
+    assert report == {
+        "prompt_tokens": 100 + tokens(bank.text),
+        "budget": 10_000,
+        "examples": 4,
+        "available": 4,
+        "tokens_saved": 0,
+    }
+
+def test_more_than_top_k_examples_keeps_the_most_relevant(bank):
+    text, report = select_examples(bank, "regression outliers", "gemini", 100, budget=10_000, top_k=2)
+    # Chosen by relevance, sent in bank order
+    assert text == EXAMPLES[1] + "\n\n" + EXAMPLES[2]
+    assert report["examples"] == 2 and report["available"] == 4
+    assert report["tokens_saved"] == tokens(bank.text) - tokens(text)
+
+def test_examples_that_overrun_the_budget_are_skipped(bank):
+    fixed = 100
+    # Room for the short regression example but not the long one
+    budget = fixed + tokens(EXAMPLES[2]) + 5
+    text, report = select_examples(bank, "regression", "gemini", fixed, budget=budget, top_k=8)
+    assert text == EXAMPLES[2]
+    assert report["prompt_tokens"] <= budget
+
+def test_no_examples_when_the_rest_of_the_prompt_is_over_budget(bank):
+    text, report = select_examples(bank, "regression", "gemini", 500, budget=400)
+    assert text == ""
+    assert report["examples"] == 0
+    assert report["prompt_tokens"] == 500
+    assert report["tokens_saved"] == tokens(bank.text)
+
+def test_selected_examples_are_kept_out_of_the_prefix():
+    args = ([], "Missing chart.", "")
+    for examples in (EXAMPLES[0], EXAMPLES[2]):
+        whole_prefix, whole_suffix = construct_prompt_parts(*args, examples)
+        prefix, suffix = construct_prompt_parts(*args, examples, per_request_examples=True)
+        # Same prompt, but the prefix no longer depends on the examples
+        assert prefix + suffix == whole_prefix + whole_suffix
+        assert prefix == PROMPT_INSTRUCTIONS
+        assert suffix.startswith(examples)
+        for _, paragraph_prefix, paragraph_suffix in construct_paragraph_prompts(
+            *args, examples, per_request_examples=True
+        ):
+            assert paragraph_prefix == PROMPT_INSTRUCTIONS
+            assert paragraph_suffix.startswith(examples)
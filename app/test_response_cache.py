@@ -0,0 +1,59 @@
+import pytest
+
+import response_cache
+from response_cache import ResponseCache, make_cache_key
+
+@pytest.fixture
+def clock(monkeypatch):
+    # A controllable clock so LRU order and expiry do not depend on timing
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    return now
+
+def test_cache_key_changes_with_every_input():
+    base = make_cache_key("gemini", "flash", {"temperature": 0}, "prompt")
+    assert base == make_cache_key("gemini", "flash", {"temperature": 0}, "prompt")
+    assert base != make_cache_key("together", "flash", {"temperature": 0}, "prompt")
+    assert base != make_cache_key("gemini", "pro", {"temperature": 0}, "prompt")
+    assert base != make_cache_key("gemini", "flash", {"temperature": 1}, "prompt")
+    assert base != make_cache_key("gemini", "flash", {"temperature": 0}, "prompt!")
+
+def test_hits_misses_and_contains(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"))
+    assert cache.get("a") is None
+    assert not cache.contains("a")
+    cache.put("a", "feedback")
+    assert cache.contains("a")
+    assert cache.get("a") == "feedback"
+    # contains() is not counted
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+def test_least_recently_used_entry_is_evicted(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"), max_entries=2)
+    cache.put("a", "A")
+    clock[0] += 1
+    cache.put("b", "B")
+    clock[0] += 1
+    cache.get("a")
+    clock[0] += 1
+    cache.put("c", "C")
+    assert cache.contains("a") and cache.contains("c")
+    assert not cache.contains("b")
+
+def test_size_limit_evicts_until_under_budget(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"), max_bytes=10)
+    for key in "abc":
+        clock[0] += 1
+        cache.put(key, "x" * 4)
+    assert cache.stats()["entries"] == 2 and cache.stats()["bytes"] == 8
+    assert not cache.contains("a")
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"), ttl_seconds=60)
+    cache.put("a", "A")
+    clock[0] += 59
+    assert cache.get("a") == "A"
+    clock[0] += 2
+    assert not cache.contains("a")
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
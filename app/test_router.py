@@ -0,0 +1,237 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import router
+from router import ProviderHealth, CLOSED, OPEN, NoProviderAvailable, generate_fastest, stream_fastest, hedge_delay
+
+def call(provider, error_class=None, latency_s=1.0, prompt_tokens=1000, output_tokens=500, **fields):
+    return dict(provider=provider, error_class=error_class, latency_s=latency_s,
+                prompt_tokens=prompt_tokens, output_tokens=output_tokens, **fields)
+
+@pytest.fixture
+def health(monkeypatch):
+    # No background probes unless a test asks for them
+    monkeypatch.setattr(ProviderHealth, "_probe", lambda self, provider: None)
+    return ProviderHealth()
+
+def state(health, provider):
+    return next(entry for entry in health.snapshot() if entry["provider"] == provider)
+
+def test_breaker_opens_after_consecutive_failures(health):
+    for _ in range(router.BREAKER_FAILURES - 1):
+        health.observe(call("gemini", "RetryableLLMError"))
+    assert state(health, "gemini")["state"] == CLOSED
+    health.observe(call("gemini", "RetryableLLMError"))
+    assert state(health, "gemini")["state"] == OPEN
+    assert "gemini" not in health.available(["gemini", "together"])
+    assert [p for p, _ in health.rank(["gemini", "together"])] == ["together"]
+
+def test_a_success_resets_the_failure_count(health):
+    for _ in range(router.BREAKER_FAILURES - 1):
+        health.observe(call("gemini", "RetryableLLMError"))
+    health.observe(call("gemini"))
+    health.observe(call("gemini", "RetryableLLMError"))
+    assert state(health, "gemini")["state"] == CLOSED
+
+def test_fatal_error_opens_at_once(health):
+    health.observe(call("together", "FatalLLMError"))
+    entry = state(health, "together")
+    assert entry["state"] == OPEN
+    assert entry["open_until"] - time.time() > router.FATAL_COOLDOWN_SECONDS - 5
+
+def test_cache_hits_cancellations_and_unknown_providers_are_ignored(health):
+    health.observe(call("gemini", cache_hit=True))
+    health.observe(call("gemini", "GenerationCancelled"))
+    health.observe(call("nope"))
+    assert state(health, "gemini")["samples"] == 0
+
+def test_rank_explores_first_then_orders_by_objective(health):
+    order = ["gemini", "together", "ollama"]
+    health.observe(call("gemini", latency_s=1.0))
+    health.observe(call("ollama", latency_s=4.0))
+    assert health.rank(order, "latency") == [("together", "explore"), ("gemini", "best"), ("ollama", "best")]
+    health.observe(call("together", latency_s=2.0))
+    assert [p for p, _ in health.rank(order, "latency")] == ["gemini", "together", "ollama"]
+    # The local model is free
+    assert [p for p, _ in health.rank(order, "cost")] == ["ollama", "together", "gemini"]
+
+def test_error_rate_lowers_the_rank(health):
+    order = ["gemini", "together"]
+    health.observe(call("gemini", latency_s=1.0))
+    health.observe(call("together", latency_s=1.2))
+    health.observe(call("gemini", "RetryableLLMError"))
+    health.observe(call("gemini", "RetryableLLMError"))
+    assert [p for p, _ in health.rank(order, "latency")] == ["together", "gemini"]
+
+def test_probe_backs_off_then_closes_the_breaker(monkeypatch):
+    monkeypatch.setattr(router, "BREAKER_COOLDOWN_SECONDS", 0.05)
+    attempts = []
+    closed = threading.Event()
+    def run(prompt, prefix=None):
+        attempts.append(time.monotonic())
+        if len(attempts) < 3:
+            raise router.LLMError("still down")
+        closed.set()
+        return "OK"
+    monkeypatch.setattr(router, "get_provider", lambda provider: {"run": run})
+    health = ProviderHealth()
+    for _ in range(router.BREAKER_FAILURES):
+        health.observe(call("gemini", "RetryableLLMError"))
+    assert closed.wait(2)
+    deadline = time.monotonic() + 1
+    while state(health, "gemini")["state"] != CLOSED and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert state(health, "gemini")["state"] == CLOSED
+    # Cool-downs of 0.05, 0.1 and 0.2 seconds before the three probes
+    gaps = [b - a for a, b in zip(attempts, attempts[1:])]
+    assert gaps[1] > gaps[0] * 1.5
+
+def test_unknown_routing_objective_is_rejected_at_import():
+    result = subprocess.run(
+        [sys.executable, "-c", "import router"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=dict(os.environ, ROUTING_OBJECTIVE="fastest"),
+        capture_output=True, text=True
+    )
+    assert result.returncode != 0
+    assert "ROUTING_OBJECTIVE must be one of latency, cost, balanced, not 'fastest'" in result.stderr
+
+# --- Fastest available ---
+
+class StubProvider:
+    """
+    A provider stream with a delay before the first chunk and between chunks,
+    failing with an LLMError before chunk `fail_at` if given.
+    """
+
+    def __init__(self, first_chunk=0.0, chunks=("Good ", "work."), chunk_delay=0.0, fail_at=None):
+        self.first_chunk = first_chunk
+        self.chunks = chunks
+        self.chunk_delay = chunk_delay
+        self.fail_at = fail_at
+        self.started = None
+        self.sent = 0
+        self.closed = threading.Event()
+
+    def stream(self, prompt, prefix=None):
+        self.started = time.monotonic()
+        try:
+            time.sleep(self.first_chunk)
+            for i, chunk in enumerate(self.chunks):
+                if i == self.fail_at:
+                    raise router.LLMError("stub", "request failed")
+                if i:
+                    time.sleep(self.chunk_delay)
+                self.sent += 1
+                yield chunk
+        finally:
+            self.closed.set()
+
+ORDER = ["gemini", "together"]
+
+@pytest.fixture
+def stubs(monkeypatch, health):
+    providers = {}
+    monkeypatch.setattr(router, "health", health)
+    monkeypatch.setattr(router, "latency_tracker", router.LatencyTracker())
+    monkeypatch.setattr(router, "first_chunk_tracker", router.LatencyTracker())
+    monkeypatch.setattr(router, "DEFAULT_HEDGE_DELAY", 0.1)
+    monkeypatch.setattr(router, "get_provider", lambda key: {"stream": providers[key].stream})
+    return providers
+
+def test_hedge_delay_is_a_percentile_of_recent_latencies(stubs):
+    assert hedge_delay("gemini") == router.DEFAULT_HEDGE_DELAY
+    for i in range(1, 11):
+        router.latency_tracker.record("gemini", i / 10)
+    assert hedge_delay("gemini", 0.9) == pytest.approx(1.0)
+    assert hedge_delay("gemini", 0.5) == pytest.approx(0.6)
+    assert hedge_delay("gemini", 0.5, router.first_chunk_tracker) == router.DEFAULT_HEDGE_DELAY
+
+def test_fast_primary_is_not_hedged(stubs):
+    stubs["gemini"], stubs["together"] = StubProvider(), StubProvider()
+    assert generate_fastest("Prompt", order=ORDER) == ("Good work.", "gemini")
+    assert stubs["together"].started is None
+
+def test_slow_primary_is_hedged_after_the_delay(stubs):
+    stubs["gemini"] = StubProvider(first_chunk=1.0)
+    stubs["together"] = StubProvider(chunks=("Fast.",))
+    start = time.monotonic()
+    assert generate_fastest("Prompt", order=ORDER) == ("Fast.", "together")
+    assert time.monotonic() - start < 0.8
+    assert stubs["together"].started - stubs["gemini"].started >= 0.09
+
+def test_failed_primary_falls_back_without_waiting_for_the_hedge(stubs, monkeypatch):
+    monkeypatch.setattr(router, "DEFAULT_HEDGE_DELAY", 5.0)
+    stubs["gemini"] = StubProvider(fail_at=0)
+    stubs["together"] = StubProvider(chunks=("Fallback.",))
+    start = time.monotonic()
+    assert generate_fastest("Prompt", order=ORDER) == ("Fallback.", "together")
+    assert time.monotonic() - start < 1.0
+
+def test_every_provider_failing_raises(stubs):
+    stubs["gemini"], stubs["together"] = StubProvider(fail_at=0), StubProvider(fail_at=1)
+    with pytest.raises(NoProviderAvailable, match="request failed; .*request failed"):
+        generate_fastest("Prompt", order=ORDER)
+
+def test_losing_stream_is_cancelled(stubs):
+    stubs["gemini"] = StubProvider(first_chunk=0.2, chunks=("x",) * 50, chunk_delay=0.02)
+    stubs["together"] = StubProvider(chunks=("Fast.",))
+    assert generate_fastest("Prompt", order=ORDER) == ("Fast.", "together")
+    assert stubs["gemini"].closed.wait(1)
+    assert stubs["gemini"].sent < 50
+
+def test_providers_with_an_open_breaker_are_skipped(stubs, health):
+    stubs["gemini"], stubs["together"] = StubProvider(), StubProvider(chunks=("Together.",))
+    health.observe(call("gemini", "FatalLLMError"))
+    assert generate_fastest("Prompt", order=ORDER) == ("Together.", "together")
+    assert stubs["gemini"].started is None
+    health.observe(call("together", "FatalLLMError"))
+    with pytest.raises(NoProviderAvailable):
+        generate_fastest("Prompt", order=ORDER)
+    with pytest.raises(NoProviderAvailable):
+        next(stream_fastest("Prompt", order=ORDER))
+
+def test_stream_fastest_yields_chunks_as_they_arrive(stubs):
+    stubs["gemini"] = StubProvider(chunks=("One ", "two ", "three."), chunk_delay=0.1)
+    answered = []
+    stream = stream_fastest("Prompt", order=ORDER, on_provider=answered.append)
+    assert next(stream) == "One "
+    assert stubs["gemini"].sent < 3
+    assert "".join(stream) == "two three."
+    assert answered == ["gemini"]
+
+def test_stream_fastest_hedges_on_the_first_chunk(stubs):
+    stubs["gemini"] = StubProvider(first_chunk=1.0)
+    stubs["together"] = StubProvider(chunks=("Fast ", "answer."), chunk_delay=0.05)
+    answered = []
+    start = time.monotonic()
+    assert "".join(stream_fastest("Prompt", order=ORDER, on_provider=answered.append)) == "Fast answer."
+    assert time.monotonic() - start < 0.8
+    assert answered == ["together"]
+    # The slow request is closed once it produces its first chunk
+    assert stubs["gemini"].closed.wait(2)
+    assert stubs["gemini"].sent <= 1
+
+def test_stream_fastest_falls_back_only_before_output(stubs):
+    stubs["gemini"], stubs["together"] = StubProvider(fail_at=0), StubProvider(chunks=("Fallback.",))
+    assert "".join(stream_fastest("Prompt", order=ORDER)) == "Fallback."
+
+    stubs["gemini"], stubs["together"] = StubProvider(fail_at=1), StubProvider()
+    stream = stream_fastest("Prompt", order=ORDER)
+    assert next(stream) == "Good "
+    with pytest.raises(router.LLMError, match="request failed"):
+        next(stream)
+    assert stubs["together"].started is None
+
+def test_closing_stream_fastest_cancels_the_request(stubs):
+    stubs["gemini"] = StubProvider(chunks=("x",) * 50, chunk_delay=0.02)
+    stream = stream_fastest("Prompt", order=ORDER)
+    next(stream)
+    stream.close()
+    assert stubs["gemini"].closed.wait(1)
+    assert stubs["gemini"].sent < 50
@@ -0,0 +1,196 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import scheduler
+from scheduler import TokenBucket, ProviderScheduler
+
+class Retryable(Exception):
+    retryable = True
+
+    def __init__(self, retry_after=None):
+        super().__init__("rate limited")
+        self.retry_after = retry_after
+
+@pytest.fixture
+def clock(monkeypatch):
+    # time.monotonic and time.sleep as seen by the scheduler; sleeping advances the clock
+    now = [100.0]
+    sleeps = []
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+    monkeypatch.setattr(scheduler.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(scheduler.time, "sleep", sleep)
+    return now, sleeps
+
+def test_token_bucket_allows_a_burst_then_spaces_requests(clock):
+    now, _ = clock
+    bucket = TokenBucket(60)
+    assert all(bucket.reserve() == 0.0 for _ in range(60))
+    assert bucket.reserve() == pytest.approx(1.0)
+    # The balance went negative, so the next caller queues behind the last one
+    assert bucket.reserve() == pytest.approx(2.0)
+    now[0] += 10
+    assert bucket.reserve() == 0.0
+
+def test_token_bucket_refills_over_time(clock):
+    now, _ = clock
+    bucket = TokenBucket(120)
+    assert bucket.reserve(120) == 0.0
+    now[0] += 30
+    assert bucket.reserve(60) == 0.0
+    assert bucket.reserve(1) == pytest.approx(0.5)
+
+def test_zero_rate_is_unlimited(clock):
+    bucket = TokenBucket(0)
+    assert all(bucket.reserve(1000) == 0.0 for _ in range(10))
+
+def test_requests_wait_for_the_rate_limit(clock):
+    _, sleeps = clock
+    provider = ProviderScheduler("test", requests_per_minute=2)
+    stats = {}
+    for _ in range(3):
+        provider.call(lambda: "ok", stats=stats)
+    assert sleeps == [pytest.approx(30.0)]
+    assert stats["queue_wait"] == pytest.approx(30.0)
+
+def test_retryable_errors_are_retried_with_bounded_backoff(clock):
+    _, sleeps = clock
+    provider = ProviderScheduler("test", max_retries=3, base_delay=1.0, max_delay=3.0)
+    attempts = []
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 4:
+            raise Retryable()
+        return "ok"
+    stats = {}
+    assert provider.call(flaky, stats=stats) == "ok"
+    assert stats["retries"] == 3
+    assert len(sleeps) == 3
+    assert all(0 <= delay <= limit for delay, limit in zip(sleeps, (1.0, 2.0, 3.0)))
+
+def test_gives_up_after_max_retries(clock):
+    provider = ProviderScheduler("test", max_retries=2)
+    attempts = []
+    def failing():
+        attempts.append(1)
+        raise Retryable()
+    with pytest.raises(Retryable):
+        provider.call(failing)
+    assert len(attempts) == 3
+
+def test_other_errors_are_not_retried(clock):
+    provider = ProviderScheduler("test")
+    attempts = []
+    def failing():
+        attempts.append(1)
+        raise ValueError("bad request")
+    with pytest.raises(ValueError):
+        provider.call(failing)
+    assert len(attempts) == 1
+
+def test_retry_after_pauses_every_caller(clock):
+    _, sleeps = clock
+    provider = ProviderScheduler("test")
+    attempts = []
+    def limited():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise Retryable(retry_after=7)
+        return "ok"
+    assert provider.call(limited) == "ok"
+    assert sleeps == [7]
+    # The pause has passed for this caller's retry; a caller arriving during it waits
+    provider._paused_until = scheduler.time.monotonic() + 5
+    provider.call(lambda: "ok")
+    assert sleeps[-1] == pytest.approx(5)
+
+def test_stream_retries_only_before_the_first_chunk(clock):
+    provider = ProviderScheduler("test")
+    attempts = []
+    def make_stream():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise Retryable()
+        yield "a"
+        raise Retryable()
+    chunks = []
+    with pytest.raises(Retryable):
+        for chunk in provider.stream(make_stream):
+            chunks.append(chunk)
+    assert chunks == ["a"]
+    assert len(attempts) == 2
+
+def test_max_in_flight_bounds_concurrent_calls():
+    provider = ProviderScheduler("test", max_in_flight=2)
+    running = []
+    peak = []
+    lock = threading.Lock()
+    def work():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.pop()
+    threads = [threading.Thread(target=provider.call, args=(work,)) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) == 2
+
+def test_async_waiter_is_woken_when_a_coroutine_releases():
+    provider = ProviderScheduler("test", max_in_flight=1)
+    async def main():
+        release = asyncio.Event()
+        holder = asyncio.create_task(provider.acall(release.wait))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(provider.acall(lambda: asyncio.sleep(0, "done")))
+        await asyncio.sleep(0.3)
+        assert not waiter.done()
+        released_at = time.monotonic()
+        release.set()
+        assert await waiter == "done"
+        await holder
+        return time.monotonic() - released_at
+    # Woken by the release itself, not on a later poll
+    assert asyncio.run(main()) < 0.02
+
+def test_async_waiter_is_woken_when_a_thread_releases():
+    provider = ProviderScheduler("test", max_in_flight=1)
+    release = threading.Event()
+    thread = threading.Thread(target=provider.call, args=(release.wait,))
+    thread.start()
+    async def main():
+        waiter = asyncio.create_task(provider.acall(lambda: asyncio.sleep(0, "done")))
+        await asyncio.sleep(0.3)
+        assert not waiter.done()
+        released_at = time.monotonic()
+        release.set()
+        assert await waiter == "done"
+        return time.monotonic() - released_at
+    assert asyncio.run(main()) < 0.02
+    thread.join()
+
+def test_cancelled_async_waiter_does_not_swallow_the_wake_up():
+    provider = ProviderScheduler("test", max_in_flight=1)
+    async def main():
+        release = asyncio.Event()
+        holder = asyncio.create_task(provider.acall(release.wait))
+        await asyncio.sleep(0.01)
+        cancelled = asyncio.create_task(provider.acall(lambda: asyncio.sleep(0)))
+        waiter = asyncio.create_task(provider.acall(lambda: asyncio.sleep(0, "done")))
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        release.set()
+        assert await asyncio.wait_for(waiter, 1) == "done"
+        await holder
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        # Every slot is free again
+        assert provider._in_flight.acquire(blocking=False)
+    asyncio.run(main())
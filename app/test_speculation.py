@@ -0,0 +1,98 @@
+import pytest
+
+import speculation
+from speculation import SpeculationBudget, Speculator, estimate_tokens, wasted_tokens
+
+class FakeJob:
+    def __init__(self, speculative=True, active=True, started=1.0, texts=("",)):
+        self.speculative = speculative
+        self.active = active
+        self.started = started
+        self.texts = list(texts)
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [10_000.0]
+    monkeypatch.setattr(speculation.time, "time", lambda: now[0])
+    return now
+
+@pytest.fixture
+def outcomes(monkeypatch):
+    recorded = []
+    monkeypatch.setattr(speculation, "record_speculation", lambda outcome, wasted=0: recorded.append((outcome, wasted)))
+    return recorded
+
+def test_budget_refuses_what_does_not_fit_and_refills_after_an_hour(clock):
+    budget = SpeculationBudget(tokens_per_hour=1000)
+    assert budget.try_spend(600)
+    assert not budget.try_spend(500)
+    assert budget.try_spend(400)
+    assert budget.spent() == 1000
+    clock[0] += 1800
+    assert not budget.try_spend(1)
+    clock[0] += 1801
+    assert budget.spent() == 0
+    assert budget.try_spend(1000)
+
+def test_zero_budget_disables_speculation(clock):
+    assert not SpeculationBudget(tokens_per_hour=0).try_spend(1)
+
+def test_estimates():
+    assert estimate_tokens(4000, parts=3) == 1000 + 3 * speculation.SPECULATE_OUTPUT_TOKENS
+    assert wasted_tokens(FakeJob(started=None), 4000) == 0
+    assert wasted_tokens(FakeJob(texts=("a" * 400, "b" * 400)), 4000) == 1000 + 200
+
+def test_watch_fires_once_the_key_is_unchanged_for_the_debounce(clock, outcomes):
+    speculator = Speculator(debounce=3)
+    assert not speculator.watch("a")
+    clock[0] += 2
+    assert not speculator.watch("a")
+    clock[0] += 1
+    assert speculator.watch("a")
+    speculator.settle()
+    assert not speculator.watch("a")
+    # A new key restarts the debounce
+    assert not speculator.watch("b")
+    clock[0] += 3
+    assert speculator.watch("b")
+
+def test_changed_selections_cancel_the_job_and_count_waste(clock, outcomes):
+    speculator = Speculator(debounce=0)
+    speculator.watch("a")
+    job = FakeJob(texts=("x" * 40,))
+    speculator.started(job, 400)
+    speculator.watch("b")
+    assert job.cancelled
+    assert outcomes == [("started", 0), ("discarded", 110)]
+
+def test_claim_with_the_same_key_is_a_hit(clock, outcomes):
+    speculator = Speculator(debounce=0)
+    speculator.watch("a")
+    job = FakeJob()
+    speculator.started(job, 400)
+    assert speculator.claim("a")
+    assert not job.cancelled
+    assert outcomes[-1] == ("hit", 0)
+    # Nothing more is speculated for the generated selections
+    assert not speculator.watch("a")
+
+def test_claim_with_another_key_discards_the_job(clock, outcomes):
+    speculator = Speculator(debounce=0)
+    speculator.watch("a")
+    job = FakeJob()
+    speculator.started(job, 400)
+    assert not speculator.claim("b")
+    assert job.cancelled
+
+def test_adopted_job_is_never_cancelled(clock, outcomes):
+    speculator = Speculator(debounce=0)
+    speculator.watch("a")
+    job = FakeJob(speculative=False)
+    speculator.started(job, 400)
+    speculator.reset()
+    assert not job.cancelled
+    assert outcomes == [("started", 0)]
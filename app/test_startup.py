@@ -0,0 +1,93 @@
+import builtins
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import startup
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+@pytest.fixture
+def profiler(monkeypatch, tmp_path):
+    # A fresh, enabled profiler, and a module that has not been imported yet
+    monkeypatch.setattr(startup, "STARTUP_PROFILE", True)
+    monkeypatch.setattr(startup, "_imports", {})
+    monkeypatch.setattr(startup, "_stages", [])
+    monkeypatch.setattr(startup, "_hooked", False)
+    monkeypatch.setattr(startup, "_thread", None)
+    monkeypatch.setattr(startup, "_started", None)
+    monkeypatch.setattr(startup, "_reported", False)
+    (tmp_path / "slow_startup_module.py").write_text("import time\ntime.sleep(0.02)\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield startup
+    builtins.__import__ = startup._original_import
+    sys.modules.pop("slow_startup_module", None)
+
+def test_records_stages_and_imports(profiler):
+    profiler.profile_imports()
+    assert builtins.__import__ is profiler._timed_import
+    __import__("slow_startup_module")
+    with profiler.stage("parse rubric"):
+        pass
+    assert profiler._imports["slow_startup_module"] >= 0.02
+    assert [name for name, _ in profiler._stages] == ["parse rubric"]
+    report = profiler.startup_report()
+    assert report.startswith("Startup: ")
+    assert "stage " in report and "parse rubric" in report
+    assert "slow_startup_module" in report
+
+def test_reports_once_and_removes_the_hook(profiler, capsys):
+    profiler.profile_imports()
+    with profiler.stage("first run"):
+        pass
+    profiler.log_startup_report()
+    assert builtins.__import__ is profiler._original_import
+    assert "first run" in capsys.readouterr().err
+
+    # Later runs of the app script neither record nor report again
+    profiler.profile_imports()
+    assert builtins.__import__ is profiler._original_import
+    with profiler.stage("second run"):
+        pass
+    profiler.log_startup_report()
+    assert capsys.readouterr().err == ""
+    assert [name for name, _ in profiler._stages] == ["first run"]
+
+def test_imports_on_other_threads_are_not_timed(profiler):
+    profiler.profile_imports()
+    thread = threading.Thread(target=lambda: __import__("slow_startup_module"))
+    thread.start()
+    thread.join()
+    assert "slow_startup_module" not in profiler._imports
+
+def test_does_nothing_when_disabled(profiler, monkeypatch, capsys):
+    monkeypatch.setattr(startup, "STARTUP_PROFILE", False)
+    profiler.profile_imports()
+    assert builtins.__import__ is profiler._original_import
+    with profiler.stage("parse rubric"):
+        pass
+    profiler.log_startup_report()
+    assert profiler._stages == []
+    assert capsys.readouterr().err == ""
+
+@pytest.mark.parametrize("value, reported", [("1", True), ("", False), ("0", False)])
+def test_enabled_only_by_the_environment_variable(value, reported):
+    script = (
+        "import startup\n"
+        "startup.profile_imports()\n"
+        "import json\n"
+        "with startup.stage('parse rubric'):\n"
+        "    pass\n"
+        "startup.log_startup_report()\n"
+        "startup.log_startup_report()\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=APP_DIR,
+        env=dict(os.environ, STARTUP_PROFILE=value), capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stderr.count("Startup: ") == (1 if reported else 0)
+    assert ("parse rubric" in result.stderr) == reported